@@ -0,0 +1,219 @@
+# ai_resilience.py
+# Deadlines, a circuit breaker and an adaptive concurrency limit around Gemini calls.
+# Without them a degraded Gemini holds every worker on a slow call and the webhook stops
+# answering. Each call type (generation, embedding) has a guard: calls get a deadline through
+# the SDK's request_options; an AIMD limiter admits at most `limit` calls at once, growing the
+# limit by one per limit's worth of fast calls and halving it when calls are slow or fail; and
+# after AI_BREAKER_FAILURE_THRESHOLD consecutive failures the breaker opens, so calls fail fast
+# (AIUnavailableError) until a probe call succeeds AI_BREAKER_RESET_SECONDS later.
+
+import logging
+import threading
+import time
+
+from google.api_core import exceptions as api_exceptions
+
+from config import (
+    LOGGING_LEVEL, log_level_map, AI_RESILIENCE_ENABLED, AI_GENERATION_TIMEOUT_SECONDS,
+    AI_EMBEDDING_TIMEOUT_SECONDS, AI_BREAKER_FAILURE_THRESHOLD, AI_BREAKER_RESET_SECONDS,
+    AI_CONCURRENCY_INITIAL, AI_CONCURRENCY_MIN, AI_CONCURRENCY_MAX, AI_LATENCY_TARGET_MS
+)
+
+logger = logging.getLogger(__name__)
+logger.setLevel(log_level_map.get(LOGGING_LEVEL, logging.INFO))
+
+# Errors that say Gemini is unhealthy. Anything else (a rejected prompt, a blocked response)
+# means it answered, and doesn't count against the breaker.
+_UPSTREAM_FAILURES = (
+    api_exceptions.ServerError, api_exceptions.TooManyRequests, api_exceptions.RetryError,
+    TimeoutError, ConnectionError
+)
+
+
+class AIUnavailableError(Exception):
+    """Raised instead of calling Gemini while the breaker is open or the concurrency limit is reached."""
+
+
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold=AI_BREAKER_FAILURE_THRESHOLD, reset_seconds=AI_BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """True if a call may go ahead. Once open, a single probe call is let through after reset_seconds."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info("Gemini calls are succeeding again: circuit breaker closed.")
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+                if self.state == self.CLOSED:
+                    logger.warning(f"{self.failures} consecutive Gemini failures: circuit breaker opened.")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self._probing = False
+                self.trips += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "trips": self.trips,
+                "open_for_seconds": round(time.monotonic() - self.opened_at, 1) if self.state != self.CLOSED else 0.0,
+            }
+
+
+class AdaptiveLimiter:
+    """Additive-increase / multiplicative-decrease limit on concurrent calls, driven by latency."""
+
+    def __init__(self, initial=AI_CONCURRENCY_INITIAL, min_limit=AI_CONCURRENCY_MIN, max_limit=AI_CONCURRENCY_MAX,
+                 latency_target_ms=AI_LATENCY_TARGET_MS, backoff=0.5):
+        self.min_limit = min(min_limit, max_limit)
+        self.max_limit = max_limit
+        self.limit = float(min(max(initial, self.min_limit), max_limit))
+        self.latency_target = latency_target_ms / 1000.0
+        self.backoff = backoff
+        self.in_flight = 0
+        self.rejected = 0
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        with self._lock:
+            if self.in_flight >= int(self.limit):
+                self.rejected += 1
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self, latency=None, ok=True):
+        """Frees a slot. `latency` (seconds) of a completed call adjusts the limit; None leaves it alone."""
+        now = time.monotonic()
+        with self._lock:
+            self.in_flight -= 1
+            if latency is None:
+                return
+            if ok and latency <= self.latency_target:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            elif now - self._last_decrease >= self.latency_target:
+                # At most one decrease per latency target, so a burst of slow calls halves the limit once.
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                self._last_decrease = now
+
+    def stats(self):
+        with self._lock:
+            return {
+                "limit": int(self.limit),
+                "in_flight": self.in_flight,
+                "rejected": self.rejected,
+                "latency_target_ms": int(self.latency_target * 1000),
+            }
+
+
+class GeminiGuard:
+    def __init__(self, name, timeout_seconds, breaker=None, limiter=None):
+        self.name = name
+        self.timeout_seconds = timeout_seconds
+        self.breaker = breaker or CircuitBreaker()
+        self.limiter = limiter or AdaptiveLimiter()
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.short_circuited = 0
+        self.total_latency = 0.0
+
+    def call(self, fn, timeout_seconds=None):
+        """
+        Runs fn(request_options), where request_options carries this guard's deadline for the SDK
+        call. Raises AIUnavailableError without calling fn while the breaker is open or the
+        concurrency limit is reached. A call with its own `timeout_seconds` (a batch call) counts
+        towards the breaker, but its latency doesn't steer the concurrency limit.
+        """
+        if not AI_RESILIENCE_ENABLED:
+            return fn(None)
+        if not self.limiter.try_acquire():
+            self._count_short_circuit()
+            raise AIUnavailableError(f"Gemini {self.name} concurrency limit reached")
+        if not self.breaker.allow():
+            self.limiter.release()
+            self._count_short_circuit()
+            raise AIUnavailableError(f"Gemini {self.name} circuit breaker is open")
+
+        timeout = timeout_seconds or self.timeout_seconds
+        start = time.monotonic()
+        failed = True
+        try:
+            result = fn({"timeout": timeout})
+            failed = False
+            return result
+        except Exception as e:
+            failed = isinstance(e, _UPSTREAM_FAILURES)
+            raise
+        finally:
+            latency = time.monotonic() - start
+            timed_out = latency >= timeout
+            failed = failed or timed_out
+            self.limiter.release(latency if timeout_seconds is None else None, ok=not failed)
+            if failed:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            with self._lock:
+                self.calls += 1
+                self.failures += failed
+                self.timeouts += timed_out
+                self.total_latency += latency
+
+    def _count_short_circuit(self):
+        with self._lock:
+            self.short_circuited += 1
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                "enabled": AI_RESILIENCE_ENABLED,
+                "timeout_seconds": self.timeout_seconds,
+                "calls": self.calls,
+                "failures": self.failures,
+                "timeouts": self.timeouts,
+                "short_circuited": self.short_circuited,
+                "avg_latency_ms": round(self.total_latency / self.calls * 1000, 1) if self.calls else 0.0,
+            }
+        stats["breaker"] = self.breaker.stats()
+        stats["concurrency"] = self.limiter.stats()
+        return stats
+
+
+generation_guard = GeminiGuard("generation", AI_GENERATION_TIMEOUT_SECONDS)
+embedding_guard = GeminiGuard("embedding", AI_EMBEDDING_TIMEOUT_SECONDS)
+
+
+def get_resilience_stats():
+    return {"generation": generation_guard.stats(), "embedding": embedding_guard.stats()}
@@ -7,17 +7,35 @@ import os
 import json
 import logging
 import numpy as np
+import random
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 # Import specific types for Gemini safety settings directly at the top for clarity.
 from google.generativeai.types import HarmCategory, HarmBlockThreshold
+from google.api_core import exceptions as api_exceptions
 
 # --- START MODIFICATION FOR DB REFACTORING ---
 # Using the new, client-centric DB modules.
-from db.faqs_crud import get_all_faqs, add_faq, get_faq_by_id, update_faq, soft_delete_faq_by_id
-from db.conversations_crud import get_conversation_history_by_whatsapp_id
-from db.clients_crud import get_client_config_by_whatsapp_id
+from db.faqs_crud import (
+    get_all_faqs, add_faq, get_faq_by_id, update_faq, soft_delete_faq_by_id, update_faq_embeddings
+)
+from db.conversation_history_cache import conversation_history_cache
+from db.conversation_summaries_crud import get_conversation_summary
+from db.response_cache import response_cache
 # --- END MODIFICATION FOR DB REFACTORING ---
+from faq_cache import faq_cache, normalize_vector
+from embedding_cache import query_embedding_cache, cache_key
+from single_flight import SingleFlight
+from ai_resilience import AIUnavailableError, generation_guard, embedding_guard
+from utils.text_normalization import normalize_text
+from db.faq_lexical_index import faq_lexical_index
+from config import (
+    EMBEDDING_CACHE_ENABLED, FAQ_LEXICAL_MATCH_ENABLED, EMBEDDING_BATCH_SIZE, EMBEDDING_BATCH_CONCURRENCY,
+    EMBEDDING_BATCH_MAX_RETRIES, EMBEDDING_BATCH_BACKOFF_SECONDS, SUMMARY_ENABLED, PROMPT_HISTORY_TOKEN_BUDGET,
+    RESPONSE_CACHE_ENABLED, AI_EMBEDDING_BATCH_TIMEOUT_SECONDS
+)
 
 # --- Logging Configuration ---
 logger = logging.getLogger(__name__)
@@ -56,24 +74,148 @@ except Exception as e:
     logger.critical(f"Failed to initialize Gemini models: {e}", exc_info=True)
     text_model = None
 
+# Concurrent identical upstream calls (e.g. many users sending the same campaign reply at once)
+# share one call: embeddings by model and normalised text, generations by client, model and
+# normalised query when the prompt has no conversation history in it.
+embedding_flight = SingleFlight("embedding")
+generation_flight = SingleFlight("generation")
+
+def get_single_flight_stats():
+    return {"embedding": embedding_flight.stats(), "generation": generation_flight.stats()}
+
 def generate_embedding(text):
+    """
+    Returns the embedding for `text`, served from the query-embedding cache when possible.
+    """
     if not GEMINI_EMBEDDING_MODEL:
         logger.error("Embedding model not configured. Cannot generate embedding.")
         return None
-    try:
+    if EMBEDDING_CACHE_ENABLED:
+        cached = query_embedding_cache.get(GEMINI_EMBEDDING_MODEL, text)
+        if cached is not None:
+            return cached
+
+    def embed(request_options):
         response = genai.embed_content(
             model=GEMINI_EMBEDDING_MODEL,
             content=text,
-            task_type="RETRIEVAL_QUERY"
+            task_type="RETRIEVAL_QUERY",
+            request_options=request_options
         )
-        return response['embedding']
+        embedding = response['embedding']
+        if EMBEDDING_CACHE_ENABLED:
+            query_embedding_cache.put(GEMINI_EMBEDDING_MODEL, text, embedding)
+        return embedding
+
+    try:
+        embedding, _ = embedding_flight.do(cache_key(GEMINI_EMBEDDING_MODEL, text), lambda: embedding_guard.call(embed))
+        return embedding
+    except AIUnavailableError as e:
+        logger.warning(f"Skipping embedding for text: '{text[:50]}...': {e}")
+        return None
     except Exception as e:
         logger.error(f"Error generating embedding for text: '{text[:50]}...'. Error: {e}", exc_info=True)
         return None
 
+def _embed_batch(texts, max_retries=EMBEDDING_BATCH_MAX_RETRIES):
+    """
+    Embeds a batch in one batch-embedding call and returns a list aligned with `texts`
+    (None for items that could not be embedded).
+    Calls go through embedding_guard. Items missing from a response, and whole calls that fail
+    with a transient error (timeout, 5xx, 429), are retried with backoff and then given up on;
+    nothing is retried while the guard is refusing calls. Only when Gemini rejects the request itself (400) is the batch split in half,
+    so only the bad items end up as None.
+    """
+    results = [None] * len(texts)
+    pending = list(range(len(texts)))
+    rejected = False
+    for attempt in range(max_retries + 1):
+        batch = [texts[i] for i in pending]
+        try:
+            response = embedding_guard.call(
+                lambda _: genai.embed_content(
+                    model=GEMINI_EMBEDDING_MODEL,
+                    content=batch,
+                    task_type="RETRIEVAL_QUERY",
+                    request_options={"timeout": AI_EMBEDDING_BATCH_TIMEOUT_SECONDS}
+                ),
+                timeout_seconds=AI_EMBEDDING_BATCH_TIMEOUT_SECONDS
+            )
+            embeddings = response['embedding']
+            for i, embedding in zip(pending, embeddings):
+                if embedding:
+                    results[i] = embedding
+            pending = [i for i in pending if results[i] is None]
+            if not pending:
+                return results
+            logger.warning(f"Batch embedding returned {len(pending)} empty results. Retrying those items.")
+        except api_exceptions.BadRequest as e:
+            # Some input was rejected; resending the same batch won't help.
+            logger.warning(f"Batch embedding of {len(pending)} texts was rejected: {e}")
+            rejected = True
+            break
+        except AIUnavailableError as e:
+            logger.warning(f"Skipping batch embedding of {len(pending)} texts: {e}")
+            break
+        except Exception as e:
+            logger.warning(f"Batch embedding of {len(pending)} texts failed (attempt {attempt + 1}): {e}")
+        if attempt < max_retries:
+            time.sleep(EMBEDDING_BATCH_BACKOFF_SECONDS * (2 ** attempt) * (1 + random.random()))
+
+    if rejected and len(pending) > 1:
+        # Isolate the rejected items instead of losing the whole batch.
+        half = len(pending) // 2
+        for part in (pending[:half], pending[half:]):
+            for i, embedding in zip(part, _embed_batch([texts[i] for i in part], max_retries=max_retries)):
+                results[i] = embedding
+    elif rejected:
+        logger.error(f"Gemini rejected the text for embedding: '{texts[pending[0]][:50]}...'.")
+    elif pending:
+        logger.error(f"Giving up on embedding {len(pending)} texts.")
+    return results
+
+def generate_embeddings(texts, batch_size=EMBEDDING_BATCH_SIZE, max_workers=EMBEDDING_BATCH_CONCURRENCY):
+    """
+    Embeds many texts using the Gemini batch-embedding endpoint.
+    Texts are sent in batches of `batch_size` with at most `max_workers` batches in flight.
+    Returns a list aligned with `texts`; failed items are None.
+    This is the bulk FAQ (document) path, so the query-embedding cache is neither read nor filled.
+    """
+    texts = list(texts)
+    results = [None] * len(texts)
+    if not GEMINI_EMBEDDING_MODEL:
+        logger.error("Embedding model not configured. Cannot generate embeddings.")
+        return results
+
+    # Embed each distinct text only once.
+    pending = {}
+    for i, text in enumerate(texts):
+        pending.setdefault(text, []).append(i)
+    unique_texts = list(pending)
+    if not unique_texts:
+        return results
+
+    batches = [unique_texts[i:i + batch_size] for i in range(0, len(unique_texts), batch_size)]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(batches))) as executor:
+        for batch, embeddings in zip(batches, executor.map(_embed_batch, batches)):
+            for text, embedding in zip(batch, embeddings):
+                if embedding is None:
+                    continue
+                for i in pending[text]:
+                    results[i] = embedding
+
+    failed = sum(1 for r in results if r is None)
+    logger.info(f"Generated embeddings for {len(texts) - failed}/{len(texts)} texts in {len(batches)} batches.")
+    return results
+
+def faq_embedding_text(question, answer):
+    """Text embedded for an FAQ by the bulk paths (manage_faqs, seeding, re-embedding)."""
+    return f"{question} {answer}"
+
 def find_relevant_faq(user_query, client_id):
     """
-    Finds most relevant FAQ for client using cosine similarity.
+    Finds most relevant FAQ for client using cosine similarity against the
+    client's cached, pre-normalised FAQ matrix (see faq_cache).
     Includes fallback to global FAQs if client-specific FAQs are empty.
     """
     if not GEMINI_EMBEDDING_MODEL:
@@ -85,34 +227,18 @@ def find_relevant_faq(user_query, client_id):
         logger.error("Failed to generate embedding for user query.")
         return None, 0.0
 
-    # Step 1: Fetch client-specific FAQs
-    faqs = get_all_faqs(client_id)
-    if not faqs:
+    # Step 1: Search client-specific FAQs
+    faq_matrix = faq_cache.get(client_id)
+    if not faq_matrix.size:
         logger.warning(f"No FAQs found for client '{client_id}'. Trying global FAQs (client_id=None).")
-        faqs = get_all_faqs(None)
+        faq_matrix = faq_cache.get(None)
 
-    if not faqs:
+    if not faq_matrix.size:
         logger.info("No FAQs available at all.")
         return None, 0.0
 
-    max_similarity = -1
-    relevant_faq = None
-    user_query_embedding_np = np.array(user_query_embedding)
-
-    for faq in faqs:
-        faq_embedding = faq.get('embedding')
-        if faq_embedding:
-            try:
-                faq_embedding_np = np.array(faq_embedding)
-                dot_product = np.dot(user_query_embedding_np, faq_embedding_np)
-                norm_user = np.linalg.norm(user_query_embedding_np)
-                norm_faq = np.linalg.norm(faq_embedding_np)
-                similarity = dot_product / (norm_user * norm_faq) if norm_user and norm_faq else 0
-                if similarity > max_similarity:
-                    max_similarity = similarity
-                    relevant_faq = faq
-            except Exception as e:
-                logger.error(f"Error calculating similarity for FAQ ID {faq.get('id')}: {e}", exc_info=True)
+    matches = faq_matrix.search(normalize_vector(user_query_embedding))
+    relevant_faq, max_similarity = matches[0] if matches else (None, -1)
 
     if relevant_faq and max_similarity >= FAQ_SIMILARITY_THRESHOLD:
         logger.info(f"Found relevant FAQ (Q='{relevant_faq['question'][:50]}...') with similarity {max_similarity:.2f} for client '{client_id}'.")
@@ -121,28 +247,112 @@ def find_relevant_faq(user_query, client_id):
         logger.info(f"No relevant FAQs above threshold ({FAQ_SIMILARITY_THRESHOLD}) for query '{user_query[:50]}...'. Max similarity: {max_similarity:.2f}.")
         return None, max_similarity
 
-def generate_ai_reply(user_query, wa_id, client_id):
+def estimate_tokens(text):
+    """Rough token count for budgeting prompts (about 4 characters per token)."""
+    return len(text) // 4 + 1
+
+def truncate_to_tokens(text, max_tokens):
+    """Cuts `text` at a word boundary so that estimate_tokens() of it is at most `max_tokens`."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    kept = ""
+    for word in text.split():
+        candidate = f"{kept} {word}" if kept else word
+        if estimate_tokens(candidate) > max_tokens:
+            break
+        kept = candidate
+    return kept
+
+def build_history_context(wa_id, client_id, recent_turns=5, token_budget=PROMPT_HISTORY_TOKEN_BUDGET):
+    """
+    Returns the conversation context for a generative prompt: the rolling summary (if the
+    conversation has one) followed by as many of the last `recent_turns` messages as fit the
+    budget, newest kept first. Its size stays flat however long the conversation runs.
+    """
+    context = ""
+    summary_row = get_conversation_summary(wa_id, client_id) if SUMMARY_ENABLED else None
+    if summary_row and summary_row['summary']:
+        # The summary may use at most half the budget, leaving room for the latest turns.
+        summary = truncate_to_tokens(summary_row['summary'], token_budget // 2)
+        if summary:
+            token_budget -= estimate_tokens(summary)
+            context = f"Conversation Summary:\n{summary}\n\n"
+
+    kept = []
+    for line in reversed(conversation_history_cache.get_lines(wa_id, client_id, limit=recent_turns)):
+        cost = estimate_tokens(line)
+        if cost > token_budget:
+            break
+        kept.append(line)
+        token_budget -= cost
+    history_string = "".join(line + "\n" for line in reversed(kept))
+    return context + f"Conversation History:\n{history_string}\n\n"
+
+def summarize_conversation(previous_summary, lines, max_words):
+    """
+    Folds new conversation lines into a running summary with the text model.
+    Returns the new summary, or None if the model is unavailable or fails.
+    """
+    if not text_model:
+        return None
+    prompt = (
+        f"Update the running summary of a customer conversation with a business assistant. "
+        f"Keep facts the assistant will need later (names, orders, problems, promises, preferences), "
+        f"drop small talk, and write at most {max_words} words of plain text.\n\n"
+        f"Current summary:\n{previous_summary or '(none)'}\n\n"
+        f"New messages:\n" + "\n".join(lines) + "\n\nUpdated summary:"
+    )
+    try:
+        response = generation_guard.call(lambda request_options: text_model.generate_content(prompt, request_options=request_options))
+        return response.text.strip() or None
+    except Exception as e:
+        logger.error(f"Error summarising conversation: {e}", exc_info=True)
+        return None
+
+def lookup_cached_response(user_query, client_id, first_message):
+    """
+    Returns (cached answer or None, query embedding or None). Only a conversation's first message
+    is eligible: with prior context the same words can mean something else. The embedding (from
+    the query-embedding cache, as find_relevant_faq already computed it) is returned so a fresh
+    answer can be stored under it.
+    """
+    if not RESPONSE_CACHE_ENABLED or not first_message:
+        return None, None
+    query_embedding = generate_embedding(user_query)
+    if query_embedding is None:
+        return None, None
+    answer, similarity = response_cache.lookup(client_id, GEMINI_MODEL_NAME, query_embedding)
+    if answer:
+        logger.info(f"Serving cached generative answer for client '{client_id}' (similarity {similarity:.3f}).")
+    return answer, query_embedding
+
+def generate_ai_reply(user_query, wa_id, client_id, client_config=None):
     """
     Generates an AI reply based on the user's query and conversation history.
     Prioritizes answers from the FAQ database if a relevant FAQ is found.
     If no relevant FAQ, it uses the Generative AI model to produce a response.
     Includes fallback for global FAQs if client-specific FAQs are missing.
+    `client_config` is the client's config as already resolved by the webhook.
     """
     response_text = "I'm sorry, I couldn't process your request at the moment. Please try again later."
     faq_matched = False
     faq_question = None
     faq_answer = None
+    response_cached = False
     ai_model_used = GEMINI_MODEL_NAME
 
     try:
-        # Fetch client-specific configuration from the database using the WhatsApp ID.
-        client_config = get_client_config_by_whatsapp_id(wa_id)
         if client_config:
             logger.info(f"Processing message for client: `{client_config.get('client_id')}` (WA ID: {wa_id})")
             client_id = client_config.get('client_id', client_id)
 
-        # 1. Attempt to find a relevant FAQ in the database (with fallback to global FAQs).
-        relevant_faq, similarity = find_relevant_faq(user_query, client_id)
+        # 1. Exact/normalised match against FAQ questions and aliases: no external calls at all.
+        relevant_faq = faq_lexical_index.lookup(client_id, user_query) if FAQ_LEXICAL_MATCH_ENABLED else None
+        if relevant_faq:
+            logger.info(f"Lexical FAQ match for client '{client_id}' (FAQ ID {relevant_faq['id']}). Skipping embedding search.")
+        else:
+            # 2. Attempt to find a relevant FAQ in the database (with fallback to global FAQs).
+            relevant_faq, similarity = find_relevant_faq(user_query, client_id)
 
         if relevant_faq:
             faq_matched = True
@@ -155,14 +365,16 @@ def generate_ai_reply(user_query, wa_id, client_id):
             logger.info(
                 f"No relevant FAQ found for user query for client '{client_id}'. Proceeding with generative AI.")
 
-            # 2. If no relevant FAQ is found, use the Generative AI model.
-            if text_model:
-                # Fetch recent conversation history for context.
-                conversation_history = get_conversation_history_by_whatsapp_id(wa_id, limit=5, client_id=client_id)
-
-                history_string = ""
-                for msg in conversation_history:
-                    history_string += f"{msg['sender'].capitalize()}: {msg['message_text']}\n"
+            # 3. If no relevant FAQ is found, reuse an answer generated for the same question, or
+            # use the Generative AI model.
+            first_message = not conversation_history_cache.get_lines(wa_id, client_id, limit=1)
+            cached_answer, query_embedding = lookup_cached_response(user_query, client_id, first_message)
+            if cached_answer:
+                response_text = cached_answer
+                response_cached = True
+            elif text_model:
+                # Conversation context: rolling summary plus the most recent messages.
+                history_context = build_history_context(wa_id, client_id)
 
                 # Define system instruction (persona/guidelines for the AI)
                 system_instruction = (
@@ -182,27 +394,42 @@ def generate_ai_reply(user_query, wa_id, client_id):
                     )
 
                 prompt = (
-                    f"Conversation History:\n{history_string}\n\n"
+                    f"{history_context}"
                     f"User: {user_query}\n\n"
                     "AI:"
                 )
                 logger.debug(f"Sending prompt to Gemini:\n{prompt}")
 
-                response = text_model.generate_content(
-                    contents=[{"role": "user", "parts": [{"text": system_instruction}, {"text": prompt}]}],
-                    safety_settings={
-                        HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
-                        HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
-                        HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
-                        HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE
-                    }
-                )
-                response_text = response.text
+                def generate(request_options):
+                    response = text_model.generate_content(
+                        contents=[{"role": "user", "parts": [{"text": system_instruction}, {"text": prompt}]}],
+                        safety_settings={
+                            HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
+                            HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
+                            HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
+                            HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE
+                        },
+                        request_options=request_options
+                    )
+                    return response.text
+
+                if first_message:
+                    # No conversation history in the prompt: identical concurrent queries share one call.
+                    flight_key = (client_id, GEMINI_MODEL_NAME, system_instruction, normalize_text(user_query))
+                    response_text, shared = generation_flight.do(flight_key, lambda: generation_guard.call(generate))
+                else:
+                    response_text, shared = generation_guard.call(generate), False
                 logger.info(f"Generative AI response for client '{client_id}': {response_text[:50]}...")
+                if query_embedding is not None and not shared:
+                    response_cache.store(client_id, GEMINI_MODEL_NAME, user_query, query_embedding, response_text)
             else:
                 logger.error("Generative AI model not initialized. Cannot generate AI reply.")
                 response_text = "I'm sorry, my AI capabilities are not active right now."
 
+    except AIUnavailableError as e:
+        # Gemini is failing or saturated: answer straight away instead of queueing behind it.
+        logger.warning(f"Generative AI unavailable for client '{client_id}': {e}")
+        response_text = "We're receiving a lot of messages right now. Please try again in a few minutes."
     except Exception as e:
         logger.error(f"Error in generate_ai_reply: {e}", exc_info=True)
         response_text = "I encountered an error while trying to respond. Please try again."
@@ -212,6 +439,7 @@ def generate_ai_reply(user_query, wa_id, client_id):
         "faq_matched": faq_matched,
         "faq_question": faq_question,
         "faq_answer": faq_answer,
+        "response_cached": response_cached,
         "ai_model_used": ai_model_used
     }
 
@@ -225,7 +453,12 @@ def add_faq_entry(question, answer, client_id):
         logger.error(f"Failed to generate embedding for FAQ question: '{question[:50]}...' (Client: {client_id})")
         return False
     try:
-        add_faq(question, answer, embedding, client_id)
+        faq_id = add_faq(question, answer, embedding, client_id)
+        if not faq_id:
+            logger.error(f"Failed to store FAQ: '{question[:50]}...' for client '{client_id}'.")
+            return False
+        faq_cache.upsert(client_id, {"id": faq_id, "question": question, "answer": answer,
+                                     "client_id": client_id, "embedding": embedding})
         logger.info(f"Successfully added new FAQ: '{question[:50]}...' for client '{client_id}'.")
         return True
     except Exception as e:
@@ -250,7 +483,10 @@ def update_faq_entry(faq_id, question, answer, client_id):
                          "FAQ update will proceed with old embedding if available, or fail if new embedding is critical.")
 
     try:
-        update_faq(faq_id, question, answer, embedding, client_id)
+        if not update_faq(faq_id, question, answer, embedding, client_id):
+            return False
+        faq_cache.upsert(client_id, {"id": int(faq_id), "question": question, "answer": answer,
+                                     "client_id": client_id, "embedding": embedding})
         logger.info(f"Successfully updated FAQ ID {faq_id}: Q='{question[:50]}...' for client '{client_id}'")
         return True
     except Exception as e:
@@ -262,13 +498,31 @@ def delete_faq_entry(faq_id, client_id):
     Deletes an FAQ entry from the database for a specific client.
     """
     try:
-        soft_delete_faq_by_id(faq_id, client_id)
+        if not soft_delete_faq_by_id(faq_id, client_id):
+            return False
+        faq_cache.remove(client_id, faq_id)
         logger.info(f"Successfully deleted FAQ ID {faq_id} for client '{client_id}'.")
         return True
     except Exception as e:
         logger.error(f"Error deleting FAQ entry: {e}", exc_info=True)
         return False
 
+def reembed_faqs(client_id=None):
+    """
+    Re-embeds every active FAQ (for one client, or all clients) with the current embedding
+    model, using batched embedding calls and a single bulk update.
+    Returns the number of FAQs updated.
+    """
+    faqs = get_all_faqs(client_id)
+    if not faqs:
+        return 0
+    embeddings = generate_embeddings(faq_embedding_text(faq['question'], faq['answer']) for faq in faqs)
+    updates = [(faq['id'], embedding) for faq, embedding in zip(faqs, embeddings) if embedding is not None]
+    updated = update_faq_embeddings(updates)
+    faq_cache.invalidate(client_id)
+    logger.info(f"Re-embedded {updated}/{len(faqs)} FAQs for client '{client_id if client_id else 'all'}'.")
+    return updated
+
 def get_faqs_for_client(client_id):
     """
     Retrieves all FAQs for a specific client from the database.
@@ -277,32 +531,27 @@ def get_faqs_for_client(client_id):
 
 def get_most_relevant_faq(user_query: str, client_id: str):
     """
-    Fetch FAQs dynamically from the DB for the given client, compute similarity using embeddings,
+    Score the query against the client's cached FAQ matrix
     and return the most relevant FAQ if above the similarity threshold.
     """
     try:
+        if FAQ_LEXICAL_MATCH_ENABLED:
+            lexical_match = faq_lexical_index.lookup(client_id, user_query)
+            if lexical_match:
+                return lexical_match
+
         user_embedding = generate_embedding(user_query)
         if user_embedding is None:
             logger.warning("Failed to generate embedding for user query.")
             return None
 
-        faqs = get_all_faqs(client_id)
-        if not faqs:
+        faq_matrix = faq_cache.get(client_id)
+        if not faq_matrix.size:
             logger.info(f"No FAQs found for client {client_id}.")
             return None
 
-        best_match = None
-        max_similarity = 0.0
-
-        for faq in faqs:
-            try:
-                faq_embedding = np.array(faq.get('embedding', []), dtype=float)
-                similarity = cosine_similarity(user_embedding, faq_embedding)
-                if similarity > max_similarity:
-                    max_similarity = similarity
-                    best_match = faq
-            except Exception as e:
-                logger.error(f"Error processing FAQ embedding: {e}", exc_info=True)
+        matches = faq_matrix.search(normalize_vector(user_embedding))
+        best_match, max_similarity = matches[0] if matches else (None, 0.0)
 
         if best_match and max_similarity >= FAQ_SIMILARITY_THRESHOLD:
             logger.info(f"Found relevant FAQ (Q='{best_match['question'][:30]}...') with similarity {max_similarity:.2f} for client '{client_id}'.")
@@ -10,6 +10,21 @@ from db.conversations_crud import (
     get_monthly_conversation_counts,
     get_daily_conversation_counts
 )
+from webhook import get_ingestion_stats, get_coalescing_stats
+from faq_cache import faq_cache
+from embedding_cache import query_embedding_cache
+from db.faq_lexical_index import faq_lexical_index
+from db.response_cache import response_cache
+from db.client_config_cache import client_config_cache
+from db.conversation_history_cache import conversation_history_cache
+from conversation_summarizer import conversation_summarizer
+from whatsapp_api_utils import send_metrics, get_outbound_stats
+from outbox_dispatcher import outbox_dispatcher
+from db.conversation_writer import conversation_writer
+from message_dedup import message_deduplicator
+from rate_limiter import rate_limiter
+from ai_utils import get_single_flight_stats
+from ai_resilience import get_resilience_stats
 
 api_bp = Blueprint('api_routes', __name__, url_prefix='/api')
 logger = logging.getLogger(__name__)
@@ -48,7 +63,8 @@ def api_get_faqs():
             return jsonify({"error": "client_id required for super_admin."}), 400
     else:
         client_id = getattr(current_user, 'client_id', None)
-    faqs = get_all_faqs(client_id)
+    # Embeddings are binary vectors; they are not part of the API payload.
+    faqs = [{k: v for k, v in faq.items() if k != "embedding"} for faq in get_all_faqs(client_id)]
     return jsonify({"faqs": faqs})
 
 @api_bp.route('/chat_history/<wa_id>', methods=['GET'])
@@ -95,3 +111,30 @@ def api_get_daily_report():
     return jsonify({"labels": days, "values": values, "raw": counts})
 
 
+@api_bp.route('/status', methods=['GET'])
+@login_required
+def api_get_status():
+    """
+    Return runtime metrics for the message pipeline (super_admin only).
+    """
+    if current_user.role != "super_admin":
+        return jsonify({"error": "Access denied."}), 403
+    return jsonify({
+        "webhook_ingestion": get_ingestion_stats(),
+        "message_dedup": message_deduplicator.stats(),
+        "message_coalescing": get_coalescing_stats(),
+        "rate_limiter": rate_limiter.stats(),
+        "faq_cache": faq_cache.stats(),
+        "embedding_cache": query_embedding_cache.stats(),
+        "faq_lexical_index": faq_lexical_index.stats(),
+        "response_cache": response_cache.stats(),
+        "single_flight": get_single_flight_stats(),
+        "ai_resilience": get_resilience_stats(),
+        "client_config_cache": client_config_cache.stats(),
+        "conversation_history_cache": conversation_history_cache.stats(),
+        "conversation_summaries": conversation_summarizer.stats(),
+        "whatsapp_send": send_metrics.stats(),
+        "whatsapp_outbound": get_outbound_stats(),
+        "outbox": outbox_dispatcher.stats(),
+        "conversation_writer": conversation_writer.stats()
+    })
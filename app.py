@@ -1,6 +1,7 @@
 # app.py
 import sys
 import logging
+import threading
 import google.generativeai as genai
 from flask import Flask, redirect, url_for, render_template
 from flask_login import LoginManager, current_user
@@ -14,7 +15,8 @@ from config import (
     FLASK_DEBUG, HOST, PORT,
     FIREBASE_API_KEY, FIREBASE_AUTH_DOMAIN, FIREBASE_PROJECT_ID,
     FIREBASE_STORAGE_BUCKET, FIREBASE_MESSAGING_SENDER_ID, FIREBASE_APP_ID,
-    FIREBASE_ENABLED  # <-- Import the flag!
+    FIREBASE_ENABLED,  # <-- Import the flag!
+    FAQ_EMBEDDING_MIGRATION_ON_STARTUP, OUTBOX_ENABLED
 )
 
 # Import blueprints and utility functions
@@ -27,6 +29,9 @@ from routes.faqs import faqs_bp
 from routes.conversations import conversations_bp
 
 from db.db_connection import init_db
+from db.faqs_crud import migrate_faq_embeddings
+from db.client_config_cache import client_config_cache
+from outbox_dispatcher import outbox_dispatcher
 import firebase_admin_utils
 
 # --- Logging Configuration (From config.py) ---
@@ -98,6 +103,15 @@ def login_page():
 with app.app_context():
     init_db()
     logger.info("Database initialization complete.")
+    client_config_cache.preload()
+
+# Convert legacy JSON embeddings to BLOBs in the background; readers handle both formats meanwhile.
+if FAQ_EMBEDDING_MIGRATION_ON_STARTUP:
+    threading.Thread(target=migrate_faq_embeddings, name="faq-embedding-migration", daemon=True).start()
+
+# Deliver replies left in the outbox by a previous run (crash or restart) without waiting for new traffic.
+if OUTBOX_ENABLED:
+    outbox_dispatcher.start()
 
 if __name__ == "__main__":
     logging.getLogger('whatsapp_api_utils').setLevel(log_level_map.get(LOGGING_LEVEL, logging.INFO))
@@ -0,0 +1,77 @@
+# bench_db.py
+# Micro-benchmark of the database work done for one inbound text message:
+# client config lookup (cached), query-embedding cache lookup,
+# conversation history (prompt lines) and the conversation insert.
+#
+# Runs against a throwaway database, so it is safe to run anywhere:
+#   python bench_db.py --messages 2000 --threads 1
+#   DB_POOL_ENABLED=0 python bench_db.py     # connection per CRUD call, for comparison
+#   CONVERSATION_WRITE_BEHIND_ENABLED=true python bench_db.py   # group-committed inserts
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the per-message database path.")
+    parser.add_argument("--messages", type=int, default=2000, help="Messages per thread")
+    parser.add_argument("--threads", type=int, default=1, help="Concurrent worker threads")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="bench_db_")
+    os.environ["DATABASE_NAME"] = os.path.join(workdir, "bench.db")
+    os.chdir(workdir)  # Keep the log file out of the repo.
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    from db.db_connection import init_db
+    from db.clients_crud import add_client
+    from db.client_config_cache import client_config_cache
+    from db.conversations_crud import add_message
+    from db.conversation_history_cache import conversation_history_cache
+    from db.embedding_cache_crud import get_cached_embedding
+
+    init_db()
+    add_client("bench_client", "Bench", "bench_phone", "token")
+
+    def one_message(wa_id, i):
+        client_config_cache.get("bench_phone")
+        get_cached_embedding(f"missing-{i}")
+        conversation_history_cache.get_prompt_history(wa_id, "bench_client", limit=5)
+        add_message(wa_id, f"message {i}", "user", "bench_client", "reply")
+
+    latencies = []
+    lock = threading.Lock()
+
+    def worker(n):
+        wa_id = f"wa_{n}"
+        local = []
+        for i in range(args.messages):
+            start = time.perf_counter()
+            one_message(wa_id, i)
+            local.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(args.threads)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    total = len(latencies)
+    print(f"pool={os.getenv('DB_POOL_ENABLED', 'default')} threads={args.threads} messages={total}")
+    print(f"  throughput: {total / elapsed:,.0f} msg/s")
+    print(f"  latency ms: mean {statistics.mean(latencies) * 1000:.3f}  "
+          f"p50 {latencies[total // 2] * 1000:.3f}  p99 {latencies[int(total * 0.99)] * 1000:.3f}")
+
+
+if __name__ == "__main__":
+    main()
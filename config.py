@@ -15,6 +15,26 @@ log_level_map = {
     "CRITICAL": logging.CRITICAL
 }
 
+def _env_int(name, default):
+    """Reads an integer setting from the environment, falling back to the default on bad input."""
+    try:
+        return int(os.getenv(name, default))
+    except ValueError:
+        logging.warning(f"Invalid {name} in .env. Defaulting to {default}.")
+        return default
+
+def _env_float(name, default):
+    """Reads a float setting from the environment, falling back to the default on bad input."""
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        logging.warning(f"Invalid {name} in .env. Defaulting to {default}.")
+        return default
+
+def _env_bool(name, default):
+    """Reads a 'true'/'false' setting from the environment."""
+    return os.getenv(name, str(default)).lower() == "true"
+
 # --- Flask Configuration ---
 SECRET_KEY = os.getenv('FLASK_SECRET_KEY', 'a_very_strong_and_secret_key_please_change_this_in_production')
 # PATCH: use False as default for local dev convenience.
@@ -32,6 +52,35 @@ WHATSAPP_BUSINESS_ACCOUNT_ID = os.getenv("WHATSAPP_BUSINESS_ACCOUNT_ID")
 VERIFY_TOKEN = os.getenv("VERIFY_TOKEN")
 DEFAULT_WHATSAPP_ACCESS_TOKEN = os.getenv("WHATSAPP_ACCESS_TOKEN")
 
+# Outbound Graph API sends: pooled keep-alive connections, timeouts and retries on 429/5xx
+WHATSAPP_API_BASE_URL = os.getenv("WHATSAPP_API_BASE_URL", "https://graph.facebook.com/v19.0").rstrip("/")
+WHATSAPP_HTTP_POOL_SIZE = max(1, _env_int("WHATSAPP_HTTP_POOL_SIZE", 32))
+WHATSAPP_CONNECT_TIMEOUT_SECONDS = _env_float("WHATSAPP_CONNECT_TIMEOUT_SECONDS", 3.05)
+WHATSAPP_READ_TIMEOUT_SECONDS = _env_float("WHATSAPP_READ_TIMEOUT_SECONDS", 10.0)
+WHATSAPP_SEND_MAX_RETRIES = max(0, _env_int("WHATSAPP_SEND_MAX_RETRIES", 3))
+WHATSAPP_SEND_BACKOFF_SECONDS = _env_float("WHATSAPP_SEND_BACKOFF_SECONDS", 0.5)
+WHATSAPP_SEND_MAX_BACKOFF_SECONDS = _env_float("WHATSAPP_SEND_MAX_BACKOFF_SECONDS", 30.0)
+# Outbound throughput governor: replies queue per business number instead of failing with 429s.
+# Defaults follow the Cloud API's standard limits (80 msg/s per number; ~1 msg per 6 s per recipient, with bursts).
+WHATSAPP_OUTBOUND_SCHEDULER_ENABLED = _env_bool("WHATSAPP_OUTBOUND_SCHEDULER_ENABLED", True)
+WHATSAPP_NUMBER_RATE_PER_SECOND = _env_float("WHATSAPP_NUMBER_RATE_PER_SECOND", 80.0)
+WHATSAPP_NUMBER_BURST = max(1, _env_int("WHATSAPP_NUMBER_BURST", 80))
+WHATSAPP_PAIR_RATE_PER_SECOND = _env_float("WHATSAPP_PAIR_RATE_PER_SECOND", 1 / 6)
+WHATSAPP_PAIR_BURST = max(1, _env_int("WHATSAPP_PAIR_BURST", 10))
+WHATSAPP_OUTBOUND_MAX_WAIT_SECONDS = _env_float("WHATSAPP_OUTBOUND_MAX_WAIT_SECONDS", 120.0)
+WHATSAPP_OUTBOUND_QUEUE_MAXSIZE = max(1, _env_int("WHATSAPP_OUTBOUND_QUEUE_MAXSIZE", 10000))  # Per number
+WHATSAPP_OUTBOUND_WORKERS = max(1, _env_int("WHATSAPP_OUTBOUND_WORKERS", 16))
+# Durable outbox: replies are stored with the conversation row and delivered (at least once) by a background dispatcher
+OUTBOX_ENABLED = _env_bool("OUTBOX_ENABLED", True)
+OUTBOX_BATCH_SIZE = max(1, _env_int("OUTBOX_BATCH_SIZE", 50))
+OUTBOX_MAX_IN_FLIGHT = max(1, _env_int("OUTBOX_MAX_IN_FLIGHT", 500))  # Claimed rows waiting on the outbound scheduler
+OUTBOX_POLL_INTERVAL_SECONDS = _env_float("OUTBOX_POLL_INTERVAL_SECONDS", 1.0)
+OUTBOX_MAX_ATTEMPTS = max(1, _env_int("OUTBOX_MAX_ATTEMPTS", 6))
+OUTBOX_RETRY_BACKOFF_SECONDS = _env_float("OUTBOX_RETRY_BACKOFF_SECONDS", 5.0)
+# A claimed row not finished within this time is assumed lost (crash) and sent again; keep above the outbound max wait
+OUTBOX_LEASE_SECONDS = max(1, _env_int("OUTBOX_LEASE_SECONDS", 300))
+OUTBOX_RETENTION_SECONDS = _env_int("OUTBOX_RETENTION_DAYS", 7) * 86400
+
 # --- Gemini AI Configuration ---
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 if not GEMINI_API_KEY:
@@ -41,6 +90,33 @@ GEMINI_EMBEDDING_MODEL = os.getenv('GEMINI_EMBEDDING_MODEL', 'embedding-001')
 
 # --- Database Configuration ---
 DATABASE_NAME = os.getenv('DATABASE_NAME', 'conversations.db')
+# Keep one long-lived connection per thread instead of reconnecting on every CRUD call
+DB_POOL_ENABLED = _env_bool("DB_POOL_ENABLED", True)
+DB_BUSY_TIMEOUT_MS = max(0, _env_int("DB_BUSY_TIMEOUT_MS", 5000))
+DB_CACHE_SIZE_KB = max(0, _env_int("DB_CACHE_SIZE_KB", 16384))  # Page cache per connection
+DB_MMAP_SIZE_MB = max(0, _env_int("DB_MMAP_SIZE_MB", 128))
+# Buffer conversation inserts and commit them in groups (see db/conversation_writer.py)
+CONVERSATION_WRITE_BEHIND_ENABLED = _env_bool("CONVERSATION_WRITE_BEHIND_ENABLED", False)
+CONVERSATION_WRITE_BATCH_SIZE = max(1, _env_int("CONVERSATION_WRITE_BATCH_SIZE", 100))
+CONVERSATION_WRITE_FLUSH_MS = max(1, _env_int("CONVERSATION_WRITE_FLUSH_MS", 50))
+
+# Recent messages per conversation kept in memory, pre-rendered for the AI prompt
+HISTORY_CACHE_ENABLED = _env_bool("HISTORY_CACHE_ENABLED", True)
+HISTORY_CACHE_MAX_CONVERSATIONS = max(1, _env_int("HISTORY_CACHE_MAX_CONVERSATIONS", 10000))
+HISTORY_CACHE_MESSAGES = max(1, _env_int("HISTORY_CACHE_MESSAGES", 10))  # Ring buffer size per conversation
+HISTORY_CACHE_TTL_SECONDS = _env_float("HISTORY_CACHE_TTL_SECONDS", 1800)  # Idle conversations are dropped
+
+# Rolling per-conversation summaries, refreshed in the background every N stored messages, so the
+# generative prompt is summary + recent turns within a fixed budget however long the chat runs
+SUMMARY_ENABLED = _env_bool("SUMMARY_ENABLED", False)
+SUMMARY_REFRESH_EVERY = max(1, _env_int("SUMMARY_REFRESH_EVERY", 10))
+SUMMARY_MAX_WORDS = max(10, _env_int("SUMMARY_MAX_WORDS", 150))
+SUMMARY_MAX_NEW_MESSAGES = max(1, _env_int("SUMMARY_MAX_NEW_MESSAGES", 50))  # Folded in per refresh
+SUMMARY_WORKERS = max(1, _env_int("SUMMARY_WORKERS", 2))
+PROMPT_HISTORY_TOKEN_BUDGET = max(50, _env_int("PROMPT_HISTORY_TOKEN_BUDGET", 1000))  # Summary + recent turns
+
+# Client configs are cached per process and refreshed after this many seconds (or on any client change)
+CLIENT_CONFIG_CACHE_TTL_SECONDS = _env_float("CLIENT_CONFIG_CACHE_TTL_SECONDS", 300)
 
 # --- Rate Limiting Configuration ---
 try:
@@ -48,6 +124,68 @@ try:
 except ValueError:
     logging.warning("Invalid RATE_LIMIT_SECONDS in .env. Defaulting to 5 seconds.")
     RATE_LIMIT_SECONDS = 5
+# Messages a sender may send back to back before RATE_LIMIT_SECONDS spacing applies
+RATE_LIMIT_BURST = max(1, _env_int("RATE_LIMIT_BURST", 1))
+# 'memory' (per process) or 'sqlite' (shared by all worker processes on the host)
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory").lower()
+RATE_LIMIT_SQLITE_PATH = os.getenv("RATE_LIMIT_SQLITE_PATH", os.path.splitext(DATABASE_NAME)[0] + "_rate_limits.db")
+RATE_LIMIT_MAX_KEYS = max(1, _env_int("RATE_LIMIT_MAX_KEYS", 100000))  # Memory backend cap on tracked senders
+
+# --- Webhook Ingestion Configuration ---
+# When enabled, the webhook only validates and enqueues messages; a worker pool runs the AI and send stages.
+WEBHOOK_ASYNC_ENABLED = _env_bool("WEBHOOK_ASYNC_ENABLED", False)
+WEBHOOK_WORKER_COUNT = max(1, _env_int("WEBHOOK_WORKER_COUNT", 8))
+WEBHOOK_QUEUE_MAXSIZE = _env_int("WEBHOOK_QUEUE_MAXSIZE", 1000)  # Per worker; 0 means unbounded
+WEBHOOK_ENQUEUE_TIMEOUT_SECONDS = _env_float("WEBHOOK_ENQUEUE_TIMEOUT_SECONDS", 0.5)
+# Max senders processed in parallel when a batched webhook POST is handled inline
+WEBHOOK_BATCH_CONCURRENCY = max(1, _env_int("WEBHOOK_BATCH_CONCURRENCY", 8))
+
+# Rapid text messages from one sender within this window are answered with one AI call (0 = off;
+# clients.coalesce_window_ms overrides it per client). The window restarts with every message,
+# up to MESSAGE_COALESCE_MAX_WAIT_MS or MESSAGE_COALESCE_MAX_MESSAGES.
+MESSAGE_COALESCE_WINDOW_MS = max(0, _env_int("MESSAGE_COALESCE_WINDOW_MS", 0))
+MESSAGE_COALESCE_MAX_WAIT_MS = max(1, _env_int("MESSAGE_COALESCE_MAX_WAIT_MS", 5000))
+MESSAGE_COALESCE_MAX_MESSAGES = max(1, _env_int("MESSAGE_COALESCE_MAX_MESSAGES", 10))
+
+# Inbound message ids already handled, so webhook redeliveries from Meta are acknowledged without reprocessing
+MESSAGE_DEDUP_ENABLED = _env_bool("MESSAGE_DEDUP_ENABLED", True)
+MESSAGE_DEDUP_MEMORY_SIZE = max(1, _env_int("MESSAGE_DEDUP_MEMORY_SIZE", 10000))  # In-process LRU entries
+MESSAGE_DEDUP_TTL_SECONDS = _env_int("MESSAGE_DEDUP_TTL_SECONDS", 7 * 24 * 3600)  # Meta retries for up to 7 days
+MESSAGE_DEDUP_PRUNE_EVERY = max(1, _env_int("MESSAGE_DEDUP_PRUNE_EVERY", 1000))  # Prune the SQLite tier every N new ids
+
+# --- Embedding Cache Configuration ---
+EMBEDDING_CACHE_ENABLED = _env_bool("EMBEDDING_CACHE_ENABLED", True)
+EMBEDDING_CACHE_MEMORY_SIZE = max(1, _env_int("EMBEDDING_CACHE_MEMORY_SIZE", 10000))  # In-process LRU entries
+EMBEDDING_CACHE_TTL_SECONDS = _env_int("EMBEDDING_CACHE_TTL_SECONDS", 30 * 24 * 3600)
+EMBEDDING_CACHE_MAX_ROWS = _env_int("EMBEDDING_CACHE_MAX_ROWS", 200000)  # SQLite tier size cap
+EMBEDDING_CACHE_PRUNE_EVERY = max(1, _env_int("EMBEDDING_CACHE_PRUNE_EVERY", 500))  # Prune SQLite tier every N writes
+
+# --- Batch Embedding Configuration ---
+EMBEDDING_BATCH_SIZE = min(100, max(1, _env_int("EMBEDDING_BATCH_SIZE", 100)))  # Gemini accepts up to 100 texts per call
+EMBEDDING_BATCH_CONCURRENCY = max(1, _env_int("EMBEDDING_BATCH_CONCURRENCY", 4))
+EMBEDDING_BATCH_MAX_RETRIES = max(0, _env_int("EMBEDDING_BATCH_MAX_RETRIES", 3))
+EMBEDDING_BATCH_BACKOFF_SECONDS = _env_float("EMBEDDING_BATCH_BACKOFF_SECONDS", 1.0)
+
+# --- Response Cache Configuration ---
+# Serve a previously generated answer to a near-identical first message instead of calling the model
+RESPONSE_CACHE_ENABLED = _env_bool("RESPONSE_CACHE_ENABLED", False)
+RESPONSE_CACHE_SIMILARITY = _env_float("RESPONSE_CACHE_SIMILARITY", 0.95)  # Cosine similarity of query embeddings
+RESPONSE_CACHE_TTL_SECONDS = _env_int("RESPONSE_CACHE_TTL_SECONDS", 24 * 3600)
+RESPONSE_CACHE_MAX_ENTRIES = max(1, _env_int("RESPONSE_CACHE_MAX_ENTRIES", 1000))  # Per client
+
+# --- Gemini Call Resilience ---
+# Per-call deadlines, a circuit breaker that fails fast to a fallback reply while Gemini is
+# unhealthy, and an AIMD concurrency limit that shrinks when latency exceeds the target
+AI_RESILIENCE_ENABLED = _env_bool("AI_RESILIENCE_ENABLED", True)
+AI_GENERATION_TIMEOUT_SECONDS = _env_float("AI_GENERATION_TIMEOUT_SECONDS", 20.0)
+AI_EMBEDDING_TIMEOUT_SECONDS = _env_float("AI_EMBEDDING_TIMEOUT_SECONDS", 5.0)
+AI_EMBEDDING_BATCH_TIMEOUT_SECONDS = _env_float("AI_EMBEDDING_BATCH_TIMEOUT_SECONDS", 60.0)
+AI_BREAKER_FAILURE_THRESHOLD = max(1, _env_int("AI_BREAKER_FAILURE_THRESHOLD", 5))  # Consecutive failures that open it
+AI_BREAKER_RESET_SECONDS = _env_float("AI_BREAKER_RESET_SECONDS", 30.0)  # Open time before one probe call is let through
+AI_CONCURRENCY_INITIAL = max(1, _env_int("AI_CONCURRENCY_INITIAL", 16))  # In-flight calls allowed per call type
+AI_CONCURRENCY_MIN = max(1, _env_int("AI_CONCURRENCY_MIN", 2))
+AI_CONCURRENCY_MAX = max(1, _env_int("AI_CONCURRENCY_MAX", 64))
+AI_LATENCY_TARGET_MS = max(1, _env_int("AI_LATENCY_TARGET_MS", 5000))  # Slower calls shrink the limit
 
 # --- FAQ Configuration ---
 try:
@@ -55,6 +193,31 @@ try:
 except ValueError:
     logging.warning("Invalid FAQ_SIMILARITY_THRESHOLD in .env. Defaulting to 0.75.")
     FAQ_SIMILARITY_THRESHOLD = 0.75
+# Memory budget for the per-client FAQ embedding matrices; cold clients are evicted first
+FAQ_CACHE_MAX_BYTES = _env_int("FAQ_CACHE_MAX_MB", 256) * 1024 * 1024
+# How often a cached FAQ matrix or lexical index is checked against faq_versions for changes
+# made by other processes (imports, seeding, other workers); 0 checks on every lookup
+FAQ_CACHE_VERSION_CHECK_SECONDS = _env_float("FAQ_CACHE_VERSION_CHECK_SECONDS", 1.0)
+# Storage encoding for FAQ embeddings: float32, float16 or int8
+FAQ_EMBEDDING_STORAGE_DTYPE = os.getenv("FAQ_EMBEDDING_STORAGE_DTYPE", "float32").lower()
+if FAQ_EMBEDDING_STORAGE_DTYPE not in ("float32", "float16", "int8"):
+    logging.warning("Invalid FAQ_EMBEDDING_STORAGE_DTYPE in .env. Defaulting to float32.")
+    FAQ_EMBEDDING_STORAGE_DTYPE = "float32"
+# Rows converted per transaction when migrating legacy JSON embeddings to BLOBs
+FAQ_EMBEDDING_MIGRATION_BATCH_SIZE = max(1, _env_int("FAQ_EMBEDDING_MIGRATION_BATCH_SIZE", 200))
+FAQ_EMBEDDING_MIGRATION_ON_STARTUP = _env_bool("FAQ_EMBEDDING_MIGRATION_ON_STARTUP", True)
+# Answer messages that match an FAQ question or alias (ignoring case/punctuation) without any AI call
+FAQ_LEXICAL_MATCH_ENABLED = _env_bool("FAQ_LEXICAL_MATCH_ENABLED", True)
+# Approximate (IVF) FAQ search for large clients; smaller clients use exact search
+FAQ_ANN_MIN_SIZE = _env_int("FAQ_ANN_MIN_SIZE", 5000)
+FAQ_ANN_NLIST = _env_int("FAQ_ANN_NLIST", 0)  # Clusters per index; 0 picks ~4*sqrt(n)
+FAQ_ANN_NPROBE = max(1, _env_int("FAQ_ANN_NPROBE", 8))  # Clusters scanned per query: higher = better recall, slower
+FAQ_ANN_TRAIN_ITERATIONS = max(1, _env_int("FAQ_ANN_TRAIN_ITERATIONS", 10))
+FAQ_ANN_RETRAIN_DRIFT = _env_float("FAQ_ANN_RETRAIN_DRIFT", 0.3)  # Retrain a persisted index when this share of rows is new
+FAQ_ANN_INDEX_DIR = os.getenv("FAQ_ANN_INDEX_DIR", "faq_index")
+# Bulk FAQ import (import_faqs.py): rows embedded and inserted per transaction, and where uploads are kept
+FAQ_IMPORT_CHUNK_SIZE = max(1, _env_int("FAQ_IMPORT_CHUNK_SIZE", 500))
+FAQ_IMPORT_UPLOAD_DIR = os.getenv("FAQ_IMPORT_UPLOAD_DIR", "faq_imports")
 
 # --- Firebase Optional Toggle (NEW!) ---
 FIREBASE_ENABLED = os.getenv("FIREBASE_ENABLED", "false").lower() == "true"  # <-- NEW
@@ -0,0 +1,125 @@
+# conversation_summarizer.py
+# Keeps a rolling summary per conversation (the `conversation_summaries` table) off the hot path.
+# note_message() counts stored messages per conversation; every SUMMARY_REFRESH_EVERY messages
+# a background worker folds the messages newer than the summary into it, one text model call per
+# SUMMARY_MAX_NEW_MESSAGES, until it is caught up. A conversation's first summary is seeded from
+# its most recent messages rather than worked up from its first one. generate_ai_reply then
+# prompts with the summary plus the last few turns (ai_utils.build_history_context) instead of
+# an ever-growing transcript.
+
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from config import (
+    LOGGING_LEVEL, log_level_map, SUMMARY_ENABLED, SUMMARY_REFRESH_EVERY, SUMMARY_MAX_WORDS,
+    SUMMARY_MAX_NEW_MESSAGES, SUMMARY_WORKERS, HISTORY_CACHE_MAX_CONVERSATIONS
+)
+from db.conversation_summaries_crud import (
+    get_conversation_summary, get_messages_since, get_latest_messages, save_conversation_summary
+)
+from ai_utils import summarize_conversation
+
+logger = logging.getLogger(__name__)
+logger.setLevel(log_level_map.get(LOGGING_LEVEL, logging.INFO))
+
+
+def _render_for_summary(message):
+    lines = [f"{message['sender'].capitalize()}: {message['message_text']}"]
+    if message.get('response_text'):
+        lines.append(f"Assistant: {message['response_text']}")
+    return lines
+
+
+class ConversationSummarizer:
+    def __init__(self, refresh_every=SUMMARY_REFRESH_EVERY, max_words=SUMMARY_MAX_WORDS,
+                 max_new_messages=SUMMARY_MAX_NEW_MESSAGES, workers=SUMMARY_WORKERS,
+                 max_tracked=HISTORY_CACHE_MAX_CONVERSATIONS):
+        self.refresh_every = refresh_every
+        self.max_words = max_words
+        self.max_new_messages = max_new_messages
+        self.workers = workers
+        self.max_tracked = max_tracked
+        # (client_id, wa_id) -> messages stored since the last refresh was scheduled. Losing a
+        # count to eviction only delays that conversation's next refresh.
+        self._counts = OrderedDict()
+        self._in_flight = set()
+        self._lock = threading.Lock()
+        self._executor = None
+        self.refreshes = 0
+        self.failures = 0
+
+    def note_message(self, wa_id, client_id):
+        """Call after a message is stored; schedules a refresh every `refresh_every` messages."""
+        if not SUMMARY_ENABLED or not client_id:
+            return
+        key = (client_id, wa_id)
+        with self._lock:
+            count = self._counts.pop(key, 0) + 1
+            if count < self.refresh_every or key in self._in_flight:
+                self._counts[key] = count
+                while len(self._counts) > self.max_tracked:
+                    self._counts.popitem(last=False)
+                return
+            self._in_flight.add(key)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="summarizer")
+            executor = self._executor
+        executor.submit(self._refresh, wa_id, client_id)
+
+    def _refresh(self, wa_id, client_id):
+        try:
+            self.refresh(wa_id, client_id)
+        except Exception as e:
+            logger.error(f"Error refreshing summary for {wa_id} (Client: {client_id}): {e}", exc_info=True)
+            with self._lock:
+                self.failures += 1
+        finally:
+            with self._lock:
+                self._in_flight.discard((client_id, wa_id))
+
+    def refresh(self, wa_id, client_id):
+        """Folds messages newer than the stored summary into it until caught up. Returns True if it was updated."""
+        current = get_conversation_summary(wa_id, client_id)
+        if current:
+            summary = current['summary']
+            messages = get_messages_since(wa_id, client_id, current['last_message_id'], self.max_new_messages)
+        else:
+            # Seed from the latest window: an existing long conversation would otherwise need a
+            # model call per window of its whole history before the summary is current.
+            summary = None
+            messages = get_latest_messages(wa_id, client_id, self.max_new_messages)
+
+        updated = False
+        while messages:
+            lines = [line for message in messages for line in _render_for_summary(message)]
+            summary = summarize_conversation(summary, lines, self.max_words)
+            if not summary:
+                with self._lock:
+                    self.failures += 1
+                return updated
+            if not save_conversation_summary(wa_id, client_id, summary, messages[-1]['id'], len(messages)):
+                return updated
+            updated = True
+            with self._lock:
+                self.refreshes += 1
+            logger.info(f"Summarised {len(messages)} new messages for {wa_id} (Client: {client_id}).")
+            if len(messages) < self.max_new_messages:
+                break
+            messages = get_messages_since(wa_id, client_id, messages[-1]['id'], self.max_new_messages)
+        return updated
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": SUMMARY_ENABLED,
+                "refresh_every": self.refresh_every,
+                "tracked_conversations": len(self._counts),
+                "in_flight": len(self._in_flight),
+                "refreshes": self.refreshes,
+                "failures": self.failures,
+            }
+
+
+conversation_summarizer = ConversationSummarizer()
@@ -0,0 +1,98 @@
+# db/client_config_cache.py
+# Process-wide cache of active client configs keyed by WhatsApp phone number id.
+# Client configs rarely change, so all of them are held as one snapshot that is reloaded
+# when its TTL expires or when db/clients_crud.py reports a change; inbound messages then
+# resolve their client without touching the database.
+
+import sqlite3
+import logging
+import threading
+import time
+from db.db_connection import get_db_connection
+from config import LOGGING_LEVEL, log_level_map, CLIENT_CONFIG_CACHE_TTL_SECONDS
+
+logger = logging.getLogger(__name__)
+logger.setLevel(log_level_map.get(LOGGING_LEVEL, logging.INFO))
+
+
+def _load_client_configs():
+    """Returns {whatsapp_phone_number_id: config} for every active client."""
+    conn = get_db_connection()
+    configs = {}
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT client_id, client_name, whatsapp_phone_number_id, whatsapp_api_token, ai_system_instruction, ai_model_name,
+                   rate_limit_seconds, rate_limit_burst, coalesce_window_ms
+            FROM clients
+            WHERE active = 1
+        """)
+        for row in cursor.fetchall():
+            # setdefault: like the single-row lookup, the first active client wins a shared number.
+            configs.setdefault(row['whatsapp_phone_number_id'], dict(row))
+    except sqlite3.Error as e:
+        logger.error(f"Error loading client configs: {e}", exc_info=True)
+        return None
+    finally:
+        conn.close()
+    return configs
+
+
+class ClientConfigCache:
+    def __init__(self, loader=_load_client_configs, ttl_seconds=CLIENT_CONFIG_CACHE_TTL_SECONDS):
+        self.loader = loader
+        self.ttl_seconds = ttl_seconds
+        self._configs = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.hits = 0
+        self.loads = 0
+
+    def _snapshot(self):
+        with self._lock:
+            if self._configs is not None and time.monotonic() - self._loaded_at < self.ttl_seconds:
+                self.hits += 1
+                return self._configs
+            generation = self._generation
+        configs = self.loader()
+        with self._lock:
+            self.loads += 1
+            if configs is None:
+                # DB error: keep serving the stale snapshot rather than failing every message.
+                return self._configs or {}
+            # A load that raced with an invalidation is used once but not kept.
+            if self._generation == generation:
+                self._configs = configs
+                self._loaded_at = time.monotonic()
+        return configs
+
+    def get(self, whatsapp_phone_number_id):
+        """Returns a copy of the active client config for a phone number id, or None."""
+        config = self._snapshot().get(whatsapp_phone_number_id)
+        return dict(config) if config else None
+
+    def preload(self):
+        """Loads all client configs now (at startup) so the first messages don't hit the DB."""
+        configs = self._snapshot()
+        logger.info(f"Preloaded {len(configs)} client configs.")
+        return len(configs)
+
+    def invalidate(self):
+        """Called by db/clients_crud.py whenever a client is added, updated or deleted."""
+        with self._lock:
+            self._generation += 1
+            self._configs = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "clients": len(self._configs) if self._configs is not None else 0,
+                "ttl_seconds": self.ttl_seconds,
+                "age_seconds": time.monotonic() - self._loaded_at if self._configs is not None else None,
+                "hits": self.hits,
+                "loads": self.loads,
+            }
+
+
+client_config_cache = ClientConfigCache()
@@ -2,6 +2,8 @@
 import sqlite3
 import logging
 from db.db_connection import get_db_connection
+from db.client_config_cache import client_config_cache
+from db.response_cache import response_cache
 
 logger = logging.getLogger(__name__)
 
@@ -15,6 +17,7 @@ def add_client(client_id, client_name, whatsapp_phone_number_id, whatsapp_api_to
             VALUES (?, ?, ?, ?, ?, ?, 1)
         ''', (client_id, client_name, whatsapp_phone_number_id, whatsapp_api_token, ai_system_instruction, ai_model_name))
         conn.commit()
+        client_config_cache.invalidate()
         logger.info(f"Client '{client_id}' added successfully.")
         return True
     except sqlite3.IntegrityError as e:
@@ -52,7 +55,8 @@ def get_client_by_id(client_id):
     finally:
         conn.close()
 
-def update_client(client_id, whatsapp_api_token=None, ai_system_instruction=None):
+def update_client(client_id, whatsapp_api_token=None, ai_system_instruction=None,
+                  rate_limit_seconds=None, rate_limit_burst=None, coalesce_window_ms=None):
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
@@ -64,12 +68,26 @@ def update_client(client_id, whatsapp_api_token=None, ai_system_instruction=None
         if ai_system_instruction:
             updates.append("ai_system_instruction = ?")
             params.append(ai_system_instruction)
+        # Per-client inbound rate limit; 0 disables it for the client.
+        if rate_limit_seconds is not None:
+            updates.append("rate_limit_seconds = ?")
+            params.append(rate_limit_seconds)
+        if rate_limit_burst is not None:
+            updates.append("rate_limit_burst = ?")
+            params.append(rate_limit_burst)
+        if coalesce_window_ms is not None:
+            updates.append("coalesce_window_ms = ?")
+            params.append(coalesce_window_ms)
         if not updates:
             return False
         params.append(client_id)
         query = f"UPDATE clients SET {', '.join(updates)} WHERE client_id = ? AND active = 1"
         cursor.execute(query, params)
         conn.commit()
+        client_config_cache.invalidate()
+        if ai_system_instruction:
+            # Cached answers were generated under the old instruction.
+            response_cache.invalidate(client_id)
         logger.info(f"Client '{client_id}' updated successfully.")
         return True
     except sqlite3.Error as e:
@@ -84,6 +102,7 @@ def soft_delete_client(client_id):
         cursor = conn.cursor()
         cursor.execute("UPDATE clients SET active = 0 WHERE client_id = ?", (client_id,))
         conn.commit()
+        client_config_cache.invalidate()
         logger.info(f"Client '{client_id}' soft deleted (active set to 0).")
         return True
     except sqlite3.Error as e:
@@ -97,7 +116,8 @@ def get_client_config_by_whatsapp_id(whatsapp_id):
         conn = get_db_connection()
         cursor = conn.cursor()
         cursor.execute("""
-            SELECT client_id, client_name, whatsapp_phone_number_id, whatsapp_api_token, ai_system_instruction, ai_model_name
+            SELECT client_id, client_name, whatsapp_phone_number_id, whatsapp_api_token, ai_system_instruction, ai_model_name,
+                   rate_limit_seconds, rate_limit_burst, coalesce_window_ms
             FROM clients
             WHERE whatsapp_phone_number_id = ? AND active = 1
         """, (whatsapp_id,))
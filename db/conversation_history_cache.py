@@ -0,0 +1,121 @@
+# db/conversation_history_cache.py
+# Per-conversation ring buffers of recent messages, pre-rendered as prompt lines.
+# The generative fallback needs the last few messages of a conversation on every call; they are
+# held here keyed by (client_id, wa_id) in a bounded LRU, and add_message appends to a loaded
+# buffer so it never goes stale. Conversations are loaded from the database on first use and
+# dropped when idle for HISTORY_CACHE_TTL_SECONDS or when the LRU is full.
+
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from config import (
+    LOGGING_LEVEL, log_level_map, HISTORY_CACHE_ENABLED, HISTORY_CACHE_MAX_CONVERSATIONS,
+    HISTORY_CACHE_MESSAGES, HISTORY_CACHE_TTL_SECONDS
+)
+
+logger = logging.getLogger(__name__)
+logger.setLevel(log_level_map.get(LOGGING_LEVEL, logging.INFO))
+
+
+def render_line(sender, message_text):
+    return f"{sender.capitalize()}: {message_text}"
+
+
+def _load_history(wa_id, client_id, limit):
+    # Imported here: conversations_crud updates this cache from add_message.
+    from db.conversations_crud import get_conversation_history_by_whatsapp_id
+    return get_conversation_history_by_whatsapp_id(wa_id, limit=limit, client_id=client_id)
+
+
+class ConversationHistoryCache:
+    def __init__(self, loader=_load_history, max_conversations=HISTORY_CACHE_MAX_CONVERSATIONS,
+                 messages=HISTORY_CACHE_MESSAGES, ttl_seconds=HISTORY_CACHE_TTL_SECONDS):
+        self.loader = loader
+        self.max_conversations = max_conversations
+        self.messages = messages
+        self.ttl_seconds = ttl_seconds
+        self._buffers = OrderedDict()  # (client_id, wa_id) -> [deque of lines, last used]
+        self._loading = {}             # key -> True if a message was added while it was loading
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_lines(self, wa_id, client_id, limit=5):
+        """Returns the last `limit` messages of the conversation as rendered prompt lines, oldest first."""
+        if not HISTORY_CACHE_ENABLED or client_id is None or limit > self.messages:
+            return [render_line(m['sender'], m['message_text']) for m in self.loader(wa_id, client_id, limit)]
+        key = (client_id, wa_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._buffers.get(key)
+            if entry is not None and now - entry[1] < self.ttl_seconds:
+                self._buffers.move_to_end(key)
+                entry[1] = now
+                self.hits += 1
+                lines = list(entry[0])
+                return lines[-limit:] if limit else []
+            if entry is not None:
+                del self._buffers[key]
+            self.misses += 1
+            self._loading[key] = False
+            generation = self._generation
+
+        lines = [render_line(m['sender'], m['message_text']) for m in self.loader(wa_id, client_id, self.messages)]
+        with self._lock:
+            # A message added (or an invalidation) during the load may be missing from it: use it once, don't keep it.
+            raced = self._loading.pop(key, True) or self._generation != generation
+            if not raced:
+                self._buffers[key] = [deque(lines, maxlen=self.messages), now]
+                self._evict(now)
+        return lines[-limit:] if limit else []
+
+    def get_prompt_history(self, wa_id, client_id, limit=5):
+        """The history block for a prompt: one line per message, each ending in a newline."""
+        return "".join(line + "\n" for line in self.get_lines(wa_id, client_id, limit))
+
+    def record(self, wa_id, client_id, sender, message_text):
+        """Appends a stored message to its conversation's buffer, if that conversation is loaded."""
+        if not HISTORY_CACHE_ENABLED:
+            return
+        key = (client_id, wa_id)
+        with self._lock:
+            if key in self._loading:
+                self._loading[key] = True
+            entry = self._buffers.get(key)
+            if entry is not None:
+                entry[0].append(render_line(sender, message_text))
+
+    def _evict(self, now):
+        while self._buffers:
+            key, (lines, last_used) = next(iter(self._buffers.items()))
+            if len(self._buffers) > self.max_conversations or now - last_used >= self.ttl_seconds:
+                del self._buffers[key]
+                self.evictions += 1
+            else:
+                break
+
+    def invalidate(self):
+        """Drops every buffer, e.g. after conversations were deleted."""
+        with self._lock:
+            self._generation += 1
+            self._buffers.clear()
+            for key in self._loading:
+                self._loading[key] = True
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": HISTORY_CACHE_ENABLED,
+                "conversations": len(self._buffers),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+conversation_history_cache = ConversationHistoryCache()
@@ -0,0 +1,77 @@
+# db/conversation_summaries_crud.py
+import sqlite3
+import logging
+import time
+from db.db_connection import get_db_connection
+from config import LOGGING_LEVEL, log_level_map
+
+logger = logging.getLogger(__name__)
+logger.setLevel(log_level_map.get(LOGGING_LEVEL, logging.INFO))
+
+def get_conversation_summary(wa_id, client_id):
+    """Returns the conversation's summary row as a dict, or None if it has not been summarised yet."""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM conversation_summaries WHERE client_id = ? AND wa_id = ?", (client_id, wa_id))
+        row = cursor.fetchone()
+        return dict(row) if row else None
+    except sqlite3.Error as e:
+        logger.error(f"Error reading conversation summary for {wa_id}: {e}", exc_info=True)
+        return None
+    finally:
+        conn.close()
+
+def get_messages_since(wa_id, client_id, after_id, limit):
+    """Active messages of a conversation with id > after_id, oldest first."""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT id, sender, message_text, response_text FROM conversations "
+            "WHERE wa_id = ? AND client_id = ? AND active = 1 AND id > ? ORDER BY id LIMIT ?",
+            (wa_id, client_id, after_id, limit)
+        )
+        return [dict(row) for row in cursor.fetchall()]
+    except sqlite3.Error as e:
+        logger.error(f"Error reading messages to summarise for {wa_id}: {e}", exc_info=True)
+        return []
+    finally:
+        conn.close()
+
+def get_latest_messages(wa_id, client_id, limit):
+    """The conversation's last `limit` active messages, oldest first."""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT id, sender, message_text, response_text FROM conversations "
+            "WHERE wa_id = ? AND client_id = ? AND active = 1 ORDER BY id DESC LIMIT ?",
+            (wa_id, client_id, limit)
+        )
+        return [dict(row) for row in cursor.fetchall()][::-1]
+    except sqlite3.Error as e:
+        logger.error(f"Error reading recent messages to summarise for {wa_id}: {e}", exc_info=True)
+        return []
+    finally:
+        conn.close()
+
+def save_conversation_summary(wa_id, client_id, summary, last_message_id, added_messages):
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT INTO conversation_summaries (client_id, wa_id, summary, last_message_id, message_count, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (client_id, wa_id) DO UPDATE SET summary = excluded.summary, "
+            "last_message_id = excluded.last_message_id, message_count = message_count + excluded.message_count, "
+            "updated_at = excluded.updated_at",
+            (client_id, wa_id, summary, last_message_id, added_messages, int(time.time()))
+        )
+        conn.commit()
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Error saving conversation summary for {wa_id}: {e}", exc_info=True)
+        return False
+    finally:
+        conn.close()
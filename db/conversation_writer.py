@@ -0,0 +1,152 @@
+# db/conversation_writer.py
+# Optional write-behind buffer for conversation inserts (CONVERSATION_WRITE_BEHIND_ENABLED).
+# add_message() hands rows to the writer, which commits them in groups with one executemany
+# per transaction: every CONVERSATION_WRITE_BATCH_SIZE rows or CONVERSATION_WRITE_FLUSH_MS,
+# whichever comes first, and on shutdown. Rows not yet flushed are returned by pending() so
+# history reads still see them. A crash loses at most one flush interval of rows.
+
+import atexit
+import logging
+import sqlite3
+import threading
+import time
+
+from db.db_connection import get_db_connection
+from config import LOGGING_LEVEL, log_level_map, CONVERSATION_WRITE_BATCH_SIZE, CONVERSATION_WRITE_FLUSH_MS
+
+logger = logging.getLogger(__name__)
+logger.setLevel(log_level_map.get(LOGGING_LEVEL, logging.INFO))
+
+_INSERT = (
+    "INSERT INTO conversations (wa_id, timestamp, message_text, sender, response_text, client_id, active) "
+    "VALUES (?, ?, ?, ?, ?, ?, 1)"
+)
+
+
+class ConversationWriter:
+    def __init__(self, batch_size=CONVERSATION_WRITE_BATCH_SIZE, flush_ms=CONVERSATION_WRITE_FLUSH_MS):
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = max(0.001, flush_ms / 1000.0)
+        self._buffer = []      # rows waiting for the writer thread
+        self._flushing = []    # rows taken by the writer thread, not yet committed
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._stopping = False
+        self.written = 0
+        self.flushes = 0
+        self.errors = 0
+
+    def start(self):
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="conversation-writer", daemon=True)
+            self._thread.start()
+        logger.info(f"Started conversation writer (batch {self.batch_size}, every {self.flush_interval * 1000:.0f} ms).")
+
+    def add(self, wa_id, message_text, sender, client_id, response_text=None):
+        """Buffers one conversation row; it is committed by the next flush."""
+        if self._thread is None:
+            self.start()
+        row = (wa_id, int(time.time()), message_text, sender, response_text, client_id)
+        with self._cond:
+            self._buffer.append(row)
+            if len(self._buffer) >= self.batch_size:
+                self._cond.notify()
+
+    def pending(self, wa_id, client_id=None):
+        """Unflushed rows for a WhatsApp user, shaped like conversations rows (id is None)."""
+        with self._cond:
+            rows = [row for row in self._flushing + self._buffer
+                    if row[0] == wa_id and (client_id is None or row[5] == client_id)]
+        return [
+            {"id": None, "wa_id": r[0], "timestamp": r[1], "message_text": r[2], "sender": r[3],
+             "response_text": r[4], "client_id": r[5], "active": 1}
+            for r in rows
+        ]
+
+    def flush(self):
+        """Commits everything buffered so far. Returns the number of rows written."""
+        with self._flush_lock:
+            with self._cond:
+                if not self._buffer:
+                    return 0
+                self._flushing, self._buffer = self._buffer, []
+                rows = self._flushing
+            conn = get_db_connection()
+            try:
+                conn.executemany(_INSERT, rows)
+                conn.commit()
+                self.written += len(rows)
+                self.flushes += 1
+                logger.debug(f"Flushed {len(rows)} conversation rows.")
+                return len(rows)
+            except sqlite3.Error as e:
+                conn.rollback()
+                logger.warning(f"Batch insert of {len(rows)} conversation rows failed ({e}); writing them one by one.")
+                return self._write_each(conn, rows)
+            finally:
+                with self._cond:
+                    self._flushing = []
+                conn.close()
+
+    def _write_each(self, conn, rows):
+        """Fallback after a failed batch, so one bad row (e.g. an unknown client_id) doesn't sink the rest."""
+        written = 0
+        for row in rows:
+            try:
+                conn.execute(_INSERT, row)
+                conn.commit()
+                written += 1
+            except sqlite3.Error as e:
+                conn.rollback()
+                self.errors += 1
+                logger.error(f"Error adding message to DB for {row[0]} (Client: {row[5]}): {e}")
+        self.written += written
+        self.flushes += 1
+        return written
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if len(self._buffer) < self.batch_size and not self._stopping:
+                    self._cond.wait(self.flush_interval)
+                stopping = self._stopping
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Conversation writer failed: {e}", exc_info=True)
+            if stopping:
+                return
+
+    def shutdown(self, timeout=10.0):
+        """Flushes what is buffered and stops the writer thread."""
+        with self._cond:
+            thread = self._thread
+            if thread is None:
+                return
+            self._stopping = True
+            self._cond.notify()
+        thread.join(timeout)
+        with self._cond:
+            self._thread = None
+        self.flush()  # Anything added while the thread was exiting.
+        logger.info("Conversation writer stopped.")
+
+    def stats(self):
+        with self._cond:
+            buffered = len(self._buffer) + len(self._flushing)
+        return {
+            "running": self._thread is not None,
+            "buffered": buffered,
+            "written": self.written,
+            "flushes": self.flushes,
+            "rows_per_flush": self.written / self.flushes if self.flushes else 0.0,
+            "errors": self.errors,
+        }
+
+
+conversation_writer = ConversationWriter()
+atexit.register(conversation_writer.shutdown)
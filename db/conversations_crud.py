@@ -2,14 +2,25 @@
 import sqlite3
 import logging
 import time
+from collections import Counter
 from db.db_connection import get_db_connection
-from config import LOGGING_LEVEL, log_level_map
+from db.conversation_writer import conversation_writer
+from db.conversation_history_cache import conversation_history_cache
+from config import LOGGING_LEVEL, log_level_map, CONVERSATION_WRITE_BEHIND_ENABLED
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 logger.setLevel(log_level_map.get(LOGGING_LEVEL, logging.INFO))
 
 def add_message(wa_id, message_text, sender, client_id, response_text=None):
+    """
+    Stores a conversation row and returns its id. With write-behind enabled the row is buffered
+    and committed by the conversation writer, and None is returned.
+    """
+    if CONVERSATION_WRITE_BEHIND_ENABLED:
+        conversation_writer.add(wa_id, message_text, sender, client_id, response_text)
+        conversation_history_cache.record(wa_id, client_id, sender, message_text)
+        return None
     conn = get_db_connection()
     cursor = conn.cursor()
     timestamp = int(time.time())
@@ -19,6 +30,7 @@ def add_message(wa_id, message_text, sender, client_id, response_text=None):
             (wa_id, timestamp, message_text, sender, response_text, client_id)
         )
         conn.commit()
+        conversation_history_cache.record(wa_id, client_id, sender, message_text)
         logger.info(f"Message added to DB from {sender} (Client: {client_id}): '{message_text[:50]}...'")
         return cursor.lastrowid
     except sqlite3.Error as e:
@@ -28,6 +40,9 @@ def add_message(wa_id, message_text, sender, client_id, response_text=None):
         conn.close()
 
 def get_conversation_history_by_whatsapp_id(wa_id, limit=10, client_id=None):
+    # Read-your-writes: rows still in the write-behind buffer are included. The snapshot is taken
+    # before the SELECT, so a row flushed in between is found by the SELECT instead of being missed.
+    pending = conversation_writer.pending(wa_id, client_id) if CONVERSATION_WRITE_BEHIND_ENABLED else []
     conn = get_db_connection()
     cursor = conn.cursor()
     conversations = []
@@ -50,7 +65,22 @@ def get_conversation_history_by_whatsapp_id(wa_id, limit=10, client_id=None):
         logger.error(f"Error getting conversation history for {wa_id}: {e}", exc_info=True)
     finally:
         conn.close()
-    return conversations[::-1]
+    conversations.reverse()
+    if pending:
+        # A pending row the SELECT also returned was flushed after the snapshot: keep one copy.
+        stored = Counter(_row_key(c) for c in conversations)
+        unflushed = []
+        for row in pending:
+            key = _row_key(row)
+            if stored[key]:
+                stored[key] -= 1
+            else:
+                unflushed.append(row)
+        conversations = sorted(conversations + unflushed, key=lambda c: c['timestamp'])[-limit:]
+    return conversations
+
+def _row_key(row):
+    return (row['wa_id'], row['timestamp'], row['sender'], row['message_text'], row['response_text'], row['client_id'])
 
 def get_all_conversations(client_id=None, wa_id=None, limit=100):
     conn = get_db_connection()
@@ -225,6 +255,7 @@ def soft_delete_conversation(conversation_id):
         cursor = conn.cursor()
         cursor.execute("UPDATE conversations SET active = 0 WHERE id = ?", (conversation_id,))
         conn.commit()
+        conversation_history_cache.invalidate()
         logger.info(f"Conversation with ID {conversation_id} soft deleted (active set to 0).")
         return cursor.rowcount > 0
     except sqlite3.Error as e:
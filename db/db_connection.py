@@ -1,25 +1,163 @@
 # db/db_connection.py
+# Connections are long-lived and per-thread: get_db_connection() returns the calling thread's
+# PooledConnection, whose close() only ends the current unit of work. Connections run in WAL mode
+# with tuned pragmas, and transaction() groups several CRUD calls into one atomic commit.
 import sqlite3
 import logging
 import os
-from config import DATABASE_NAME, LOGGING_LEVEL, log_level_map
+import threading
+from contextlib import contextmanager
+from config import (
+    DATABASE_NAME, LOGGING_LEVEL, log_level_map, DB_POOL_ENABLED, DB_BUSY_TIMEOUT_MS,
+    DB_CACHE_SIZE_KB, DB_MMAP_SIZE_MB
+)
 
 logger = logging.getLogger(__name__)
 logger.setLevel(log_level_map.get(LOGGING_LEVEL, logging.INFO))
 
+_local = threading.local()
+
+
+class _PooledCursor(sqlite3.Cursor):
+    # CRUD functions log and swallow sqlite3 errors, so a failed statement must abort
+    # an enclosing transaction() here rather than rely on the caller noticing.
+    def execute(self, *args):
+        try:
+            return super().execute(*args)
+        except sqlite3.Error:
+            self.connection.abort_transaction()
+            raise
+
+    def executemany(self, *args):
+        try:
+            return super().executemany(*args)
+        except sqlite3.Error:
+            self.connection.abort_transaction()
+            raise
+
+
+class PooledConnection(sqlite3.Connection):
+    """
+    A connection that outlives the CRUD call using it. Inside transaction() commit() is deferred
+    to the outermost block, and a failed statement or rollback() aborts the whole block; close()
+    discards any uncommitted work (as closing a connection used to) but keeps the connection open.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.transaction_depth = 0
+        self.aborted = False
+
+    def abort_transaction(self):
+        if self.transaction_depth:
+            self.aborted = True
+
+    def cursor(self, factory=_PooledCursor):
+        return super().cursor(factory)
+
+    def execute(self, *args):
+        return self.cursor().execute(*args)
+
+    def executemany(self, *args):
+        return self.cursor().executemany(*args)
+
+    def commit(self):
+        if not self.transaction_depth:
+            super().commit()
+
+    def rollback(self):
+        self.abort_transaction()
+        super().rollback()
+
+    def close(self):
+        if not self.transaction_depth and self.in_transaction:
+            super().rollback()
+
+    def close_for_real(self):
+        super().close()
+
+
+def _connect(factory=sqlite3.Connection):
+    conn = sqlite3.connect(DATABASE_NAME, timeout=DB_BUSY_TIMEOUT_MS / 1000, factory=factory)
+    conn.row_factory = sqlite3.Row  # This allows access to columns by name
+    # Enable foreign key support in SQLite
+    conn.execute("PRAGMA foreign_keys = ON;")
+    conn.execute("PRAGMA journal_mode = WAL;")
+    conn.execute("PRAGMA synchronous = NORMAL;")  # Durable across app crashes; WAL keeps it consistent
+    conn.execute(f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS};")
+    conn.execute(f"PRAGMA cache_size = -{DB_CACHE_SIZE_KB};")
+    conn.execute(f"PRAGMA mmap_size = {DB_MMAP_SIZE_MB * 1024 * 1024};")
+    conn.execute("PRAGMA temp_store = MEMORY;")
+    return conn
+
 def get_db_connection():
-    """Establishes and returns a database connection."""
-    conn = None
+    """Returns the calling thread's database connection, opening it on first use."""
     try:
-        conn = sqlite3.connect(DATABASE_NAME)
-        conn.row_factory = sqlite3.Row  # This allows access to columns by name
-        # Enable foreign key support in SQLite
-        conn.execute("PRAGMA foreign_keys = ON;")
-        logger.debug(f"Successfully connected to database: {DATABASE_NAME}")
+        if not DB_POOL_ENABLED:
+            conn = _connect()
+            logger.debug(f"Successfully connected to database: {DATABASE_NAME}")
+            return conn
+        conn = getattr(_local, "conn", None)
+        # A forked worker must not share its parent's connection.
+        if conn is None or _local.pid != os.getpid():
+            conn = _local.conn = _connect(PooledConnection)
+            _local.pid = os.getpid()
+            logger.debug(f"Opened pooled connection to {DATABASE_NAME} for thread {threading.current_thread().name}.")
+        return conn
     except sqlite3.Error as e:
         logger.critical(f"Error connecting to database {DATABASE_NAME}: {e}")
         raise  # Re-raise the exception for the calling code to handle
-    return conn
+
+def close_db_connection():
+    """Closes the calling thread's pooled connection (e.g. before a thread exits or the DB file is replaced)."""
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        _local.conn = None
+        conn.close_for_real()
+
+@contextmanager
+def transaction():
+    """
+    Runs the CRUD calls made in the block (on this thread) as one transaction:
+
+        with transaction():
+            add_message(...)
+            add_message(...)
+
+    Commits when the outermost block exits; rolls back if it raises or if any CRUD call inside
+    rolled back, in which case sqlite3.OperationalError is raised.
+    """
+    if not DB_POOL_ENABLED:
+        raise RuntimeError("transaction() requires DB_POOL_ENABLED")
+    conn = get_db_connection()
+    if not conn.transaction_depth:
+        conn.aborted = False
+    conn.transaction_depth += 1
+    try:
+        yield conn
+    except BaseException:
+        conn.transaction_depth -= 1
+        if conn.transaction_depth:
+            conn.aborted = True  # No savepoints: a failed inner block fails the outer one.
+        else:
+            sqlite3.Connection.rollback(conn)
+        raise
+    conn.transaction_depth -= 1
+    if conn.transaction_depth:
+        return
+    if conn.aborted:
+        sqlite3.Connection.rollback(conn)
+        raise sqlite3.OperationalError("Transaction rolled back by a failed statement")
+    conn.commit()
+
+def ensure_columns(cursor, table, columns):
+    """Adds any missing columns (name -> SQL type) to an existing table."""
+    cursor.execute(f"PRAGMA table_info({table})")
+    existing = {row[1] for row in cursor.fetchall()}
+    for name, column_type in columns.items():
+        if name not in existing:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}")
+            logger.info(f"Added column '{name}' to '{table}' table.")
 
 def create_clients_table():
     """Creates the clients table and ensures necessary columns exist."""
@@ -116,11 +254,22 @@ def create_faqs_table():
                     client_id TEXT,
                     question TEXT NOT NULL,
                     answer TEXT NOT NULL,
-                    embedding TEXT,
+                    embedding BLOB,
+                    embedding_dtype TEXT,
+                    embedding_dim INTEGER,
+                    embedding_scale REAL,
+                    embedding_model TEXT,
                     active INTEGER DEFAULT 1,
                     FOREIGN KEY (client_id) REFERENCES clients(client_id)
                 );
             ''')
+            # Older databases stored embeddings as JSON TEXT without metadata columns.
+            ensure_columns(cursor, "faqs", {
+                "embedding_dtype": "TEXT",
+                "embedding_dim": "INTEGER",
+                "embedding_scale": "REAL",
+                "embedding_model": "TEXT",
+            })
             conn.commit()
             logger.info("Checked/Created 'faqs' table.")
         except sqlite3.Error as e:
@@ -130,9 +279,99 @@ def create_faqs_table():
     else:
         logger.error("Could not get database connection to create faqs table.")
 
+def create_faq_aliases_table():
+    """Creates the table of alternative phrasings that map straight to an FAQ."""
+    conn = get_db_connection()
+    if conn:
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS faq_aliases (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    faq_id INTEGER NOT NULL,
+                    client_id TEXT,
+                    alias TEXT NOT NULL,
+                    active INTEGER DEFAULT 1,
+                    FOREIGN KEY (faq_id) REFERENCES faqs(id),
+                    FOREIGN KEY (client_id) REFERENCES clients(client_id)
+                );
+            ''')
+            conn.commit()
+            logger.info("Checked/Created 'faq_aliases' table.")
+        except sqlite3.Error as e:
+            logger.error(f"Error creating faq_aliases table: {e}", exc_info=True)
+        finally:
+            conn.close()
+    else:
+        logger.error("Could not get database connection to create faq_aliases table.")
+
+def create_faq_import_jobs_table():
+    """Creates the table tracking bulk FAQ imports; each row is also the import's resume checkpoint."""
+    conn = get_db_connection()
+    if conn:
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS faq_import_jobs (
+                    job_id TEXT PRIMARY KEY,
+                    client_id TEXT NOT NULL,
+                    source_path TEXT NOT NULL,
+                    file_format TEXT NOT NULL, -- 'csv' or 'jsonl'
+                    status TEXT NOT NULL, -- 'pending', 'running', 'completed' or 'failed'
+                    rows_read INTEGER DEFAULT 0, -- data rows fully committed; resume point
+                    inserted INTEGER DEFAULT 0,
+                    duplicates INTEGER DEFAULT 0,
+                    failed INTEGER DEFAULT 0,
+                    error TEXT,
+                    created_at INTEGER NOT NULL,
+                    updated_at INTEGER NOT NULL,
+                    FOREIGN KEY (client_id) REFERENCES clients(client_id)
+                );
+            ''')
+            conn.commit()
+            logger.info("Checked/Created 'faq_import_jobs' table.")
+        except sqlite3.Error as e:
+            logger.error(f"Error creating faq_import_jobs table: {e}", exc_info=True)
+        finally:
+            conn.close()
+    else:
+        logger.error("Could not get database connection to create faq_import_jobs table.")
+
+def create_embedding_cache_table():
+    """
+    Creates the persistent query-embedding cache table.
+    Shared by every worker process on the host through the SQLite file.
+    """
+    conn = get_db_connection()
+    if conn:
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS embedding_cache (
+                    cache_key TEXT PRIMARY KEY, -- sha256 of model + normalised text
+                    model TEXT NOT NULL,
+                    embedding BLOB NOT NULL, -- float32, see db/embedding_codec.py
+                    created_at INTEGER NOT NULL
+                );
+            ''')
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_embedding_cache_created_at ON embedding_cache (created_at);")
+            conn.commit()
+            logger.info("Checked/Created 'embedding_cache' table.")
+        except sqlite3.Error as e:
+            logger.error(f"Error creating embedding_cache table: {e}", exc_info=True)
+        finally:
+            conn.close()
+    else:
+        logger.error("Could not get database connection to create embedding_cache table.")
+
 def init_db():
-    """Initializes all necessary database tables."""
+    """Initializes all necessary database tables, then applies pending schema migrations."""
+    from db.migrations import apply_migrations  # db.migrations imports this module
     create_clients_table()
     create_users_table()
     create_conversations_table()
     create_faqs_table()
+    create_faq_aliases_table()
+    create_faq_import_jobs_table()
+    create_embedding_cache_table()
+    apply_migrations()
@@ -0,0 +1,67 @@
+# db/embedding_cache_crud.py
+import sqlite3
+import logging
+import time
+from db.db_connection import get_db_connection
+from db.embedding_codec import encode_embedding, decode_embedding
+from config import LOGGING_LEVEL, log_level_map
+
+logger = logging.getLogger(__name__)
+logger.setLevel(log_level_map.get(LOGGING_LEVEL, logging.INFO))
+
+def get_cached_embedding(cache_key, min_created_at=0):
+    """Returns the cached float32 embedding for a key, or None if missing or older than min_created_at."""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT embedding FROM embedding_cache WHERE cache_key = ? AND created_at >= ?",
+            (cache_key, int(min_created_at))
+        )
+        row = cursor.fetchone()
+        return decode_embedding(row['embedding'], "float32") if row else None
+    except sqlite3.Error as e:
+        logger.error(f"Error reading embedding cache: {e}", exc_info=True)
+        return None
+    finally:
+        conn.close()
+
+def put_cached_embedding(cache_key, model, embedding):
+    conn = get_db_connection()
+    try:
+        blob = encode_embedding(embedding, "float32")[0]
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT OR REPLACE INTO embedding_cache (cache_key, model, embedding, created_at) VALUES (?, ?, ?, ?)",
+            (cache_key, model, blob, int(time.time()))
+        )
+        conn.commit()
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Error writing embedding cache: {e}", exc_info=True)
+        return False
+    finally:
+        conn.close()
+
+def prune_embedding_cache(ttl_seconds, max_rows):
+    """Deletes expired entries, then the oldest entries beyond max_rows. Returns rows deleted."""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM embedding_cache WHERE created_at < ?", (int(time.time() - ttl_seconds),))
+        deleted = cursor.rowcount
+        cursor.execute("""
+            DELETE FROM embedding_cache WHERE cache_key IN (
+                SELECT cache_key FROM embedding_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?
+            )
+        """, (max_rows,))
+        deleted += cursor.rowcount
+        conn.commit()
+        if deleted:
+            logger.info(f"Pruned {deleted} entries from the embedding cache.")
+        return deleted
+    except sqlite3.Error as e:
+        logger.error(f"Error pruning embedding cache: {e}", exc_info=True)
+        return 0
+    finally:
+        conn.close()
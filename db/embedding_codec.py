@@ -0,0 +1,80 @@
+# db/embedding_codec.py
+# Compact binary encoding for embedding vectors stored in SQLite BLOB columns.
+# float32 is the default; float16 halves the size again and int8 (symmetric, one scale per
+# vector) quarters it, at a small cost in similarity precision.
+
+import json
+import logging
+
+import numpy as np
+
+from config import LOGGING_LEVEL, log_level_map
+
+logger = logging.getLogger(__name__)
+logger.setLevel(log_level_map.get(LOGGING_LEVEL, logging.INFO))
+
+# Little-endian storage dtypes, keyed by the name stored in the embedding_dtype column.
+STORAGE_DTYPES = {
+    "float32": np.dtype("<f4"),
+    "float16": np.dtype("<f2"),
+    "int8": np.dtype("i1"),
+}
+
+
+def encode_embedding(vector, dtype="float32"):
+    """
+    Encodes a vector for storage.
+    Returns (blob, dtype_name, dim, scale); scale is only set for int8.
+    """
+    if dtype not in STORAGE_DTYPES:
+        raise ValueError(f"Unsupported embedding storage dtype: {dtype}")
+    vec = np.asarray(vector, dtype=np.float32).ravel()
+    scale = None
+    if dtype == "int8":
+        max_abs = float(np.max(np.abs(vec))) if vec.size else 0.0
+        scale = max_abs / 127.0 if max_abs else 1.0
+        vec = np.clip(np.rint(vec / scale), -127, 127)
+    blob = vec.astype(STORAGE_DTYPES[dtype]).tobytes()
+    return blob, dtype, int(vec.shape[0]), scale
+
+
+def decode_embedding(data, dtype=None, dim=None, scale=None):
+    """
+    Decodes a stored embedding to a 1-D float32 array, or None if it can't be read.
+    float32 BLOBs come back as a read-only np.frombuffer view of the row bytes (no copy).
+    Rows without a dtype are legacy JSON text and are parsed the old way.
+    """
+    if data is None:
+        return None
+    if dtype is None:
+        try:
+            values = json.loads(data)
+        except (TypeError, ValueError):
+            return None
+        return np.asarray(values, dtype=np.float32) if values else None
+    storage_dtype = STORAGE_DTYPES.get(dtype)
+    if storage_dtype is None or len(data) % storage_dtype.itemsize:
+        return None
+    vec = np.frombuffer(data, dtype=storage_dtype)
+    if dim is not None and vec.shape[0] != dim:
+        return None
+    if dtype == "float32":
+        return vec
+    vec = vec.astype(np.float32)
+    if dtype == "int8" and scale:
+        vec *= scale
+    return vec
+
+
+def decode_into(out, data, dtype, scale=None):
+    """
+    Decodes a BLOB straight into a preallocated float32 row (e.g. a matrix row),
+    avoiding an intermediate array. Returns False if the row can't be decoded.
+    """
+    storage_dtype = STORAGE_DTYPES.get(dtype)
+    if storage_dtype is None or data is None or len(data) != out.shape[0] * storage_dtype.itemsize:
+        return False
+    np.copyto(out, np.frombuffer(data, dtype=storage_dtype), casting="unsafe")
+    if dtype == "int8" and scale:
+        out *= scale
+    return True
@@ -0,0 +1,98 @@
+# db/faq_import_crud.py
+import sqlite3
+import logging
+import time
+import uuid
+from db.db_connection import get_db_connection
+from db.faqs_crud import embedding_column_values, EMBEDDING_COLUMNS
+from db.faq_lexical_index import faq_lexical_index
+from db.response_cache import response_cache
+from config import LOGGING_LEVEL, log_level_map
+
+logger = logging.getLogger(__name__)
+logger.setLevel(log_level_map.get(LOGGING_LEVEL, logging.INFO))
+
+def create_import_job(client_id, source_path, file_format):
+    """Registers a new import and returns its job_id."""
+    job_id = uuid.uuid4().hex
+    now = int(time.time())
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT INTO faq_import_jobs (job_id, client_id, source_path, file_format, status, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, 'pending', ?, ?)",
+            (job_id, client_id, source_path, file_format, now, now)
+        )
+        conn.commit()
+        return job_id
+    except sqlite3.Error as e:
+        logger.error(f"Error creating FAQ import job for client '{client_id}': {e}", exc_info=True)
+        return None
+    finally:
+        conn.close()
+
+def get_import_job(job_id, client_id=None):
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        query = "SELECT * FROM faq_import_jobs WHERE job_id = ?"
+        params = [job_id]
+        if client_id:
+            query += " AND client_id = ?"
+            params.append(client_id)
+        cursor.execute(query, tuple(params))
+        row = cursor.fetchone()
+        return dict(row) if row else None
+    except sqlite3.Error as e:
+        logger.error(f"Error fetching FAQ import job {job_id}: {e}", exc_info=True)
+        return None
+    finally:
+        conn.close()
+
+def set_import_job_status(job_id, status, error=None):
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            "UPDATE faq_import_jobs SET status = ?, error = ?, updated_at = ? WHERE job_id = ?",
+            (status, error, int(time.time()), job_id)
+        )
+        conn.commit()
+        return cursor.rowcount > 0
+    except sqlite3.Error as e:
+        logger.error(f"Error updating FAQ import job {job_id}: {e}", exc_info=True)
+        return False
+    finally:
+        conn.close()
+
+def commit_import_chunk(job_id, client_id, faqs, rows_read, duplicates, failed):
+    """
+    Inserts a chunk of (question, answer, embedding) rows with executemany and advances the
+    job's checkpoint counters in the same transaction, so a crash never double-imports rows.
+    Returns True on success.
+    """
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.executemany(
+            f"INSERT INTO faqs (question, answer, {EMBEDDING_COLUMNS}, client_id, active) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, 1)",
+            [(question, answer, *embedding_column_values(embedding), client_id) for question, answer, embedding in faqs]
+        )
+        cursor.execute(
+            "UPDATE faq_import_jobs SET rows_read = ?, inserted = inserted + ?, duplicates = duplicates + ?, "
+            "failed = failed + ?, updated_at = ? WHERE job_id = ?",
+            (rows_read, len(faqs), duplicates, failed, int(time.time()), job_id)
+        )
+        conn.commit()
+        if faqs:
+            faq_lexical_index.invalidate(client_id)
+            response_cache.invalidate(client_id)
+        return True
+    except sqlite3.Error as e:
+        conn.rollback()
+        logger.error(f"Error committing FAQ import chunk for job {job_id}: {e}", exc_info=True)
+        return False
+    finally:
+        conn.close()
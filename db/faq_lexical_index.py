@@ -0,0 +1,198 @@
+# db/faq_lexical_index.py
+# Per-client hash index from normalised FAQ question (and registered alias) text to the FAQ.
+# Messages that are literally an FAQ question, give or take case and punctuation, are answered
+# from here without any embedding or generation call. The CRUD functions in db/faqs_crud.py
+# keep loaded indexes in sync; clients are loaded lazily on first lookup. Like faq_cache, each
+# index remembers the faq_versions counter it matches and is reloaded when another process has
+# changed the client's FAQs, checked at most every FAQ_CACHE_VERSION_CHECK_SECONDS.
+
+import sqlite3
+import logging
+import threading
+import time
+from db.db_connection import get_db_connection
+from db.faq_versions_crud import get_faq_version
+from config import LOGGING_LEVEL, log_level_map, FAQ_CACHE_VERSION_CHECK_SECONDS
+from utils.text_normalization import normalize_text
+
+logger = logging.getLogger(__name__)
+logger.setLevel(log_level_map.get(LOGGING_LEVEL, logging.INFO))
+
+
+def _load_entries(client_id):
+    """Returns (faqs, aliases) for a client's active FAQs (all clients if None); aliases are (faq_id, alias)."""
+    conn = get_db_connection()
+    faqs, aliases = [], []
+    try:
+        cursor = conn.cursor()
+        client_filter = " AND f.client_id = ?" if client_id else ""
+        params = (client_id,) if client_id else ()
+        cursor.execute(
+            f"SELECT f.id, f.question, f.answer, f.client_id FROM faqs f WHERE f.active = 1{client_filter} ORDER BY f.id",
+            params
+        )
+        faqs = [dict(row) for row in cursor.fetchall()]
+        cursor.execute(
+            f"""SELECT a.faq_id, a.alias FROM faq_aliases a JOIN faqs f ON f.id = a.faq_id
+                WHERE a.active = 1 AND f.active = 1{client_filter} ORDER BY a.id""",
+            params
+        )
+        aliases = [(row['faq_id'], row['alias']) for row in cursor.fetchall()]
+    except sqlite3.Error as e:
+        logger.error(f"Error loading lexical FAQ index for client '{client_id}': {e}", exc_info=True)
+    finally:
+        conn.close()
+    return faqs, aliases
+
+
+class _ClientIndex:
+    def __init__(self, version=None):
+        self.by_text = {}   # normalised question/alias -> faq dict
+        self.faqs = {}      # faq id -> faq dict
+        self.aliases = {}   # faq id -> set of normalised aliases
+        self.version = version  # faq_versions counter this index matches
+        self.checked_at = time.monotonic()
+
+    def _register(self, key, faq):
+        # First FAQ registered for a text wins, matching lowest-id order on load.
+        if key and key not in self.by_text:
+            self.by_text[key] = faq
+
+    def add_faq(self, faq):
+        self.faqs[faq['id']] = faq
+        self._register(normalize_text(faq['question']), faq)
+
+    def add_alias(self, faq_id, alias):
+        faq = self.faqs.get(faq_id)
+        if faq is None:
+            return
+        key = normalize_text(alias)
+        self.aliases.setdefault(faq_id, set()).add(key)
+        self._register(key, faq)
+
+    def remove_faq(self, faq_id):
+        """Removes an FAQ and returns its normalised aliases."""
+        faq = self.faqs.pop(faq_id, None)
+        aliases = self.aliases.pop(faq_id, set())
+        if faq is not None:
+            for key in {normalize_text(faq['question'])} | aliases:
+                if self.by_text.get(key) is faq:
+                    del self.by_text[key]
+        return aliases
+
+
+class FaqLexicalIndex:
+    def __init__(self, loader=_load_entries, version_loader=get_faq_version,
+                 version_check_seconds=FAQ_CACHE_VERSION_CHECK_SECONDS):
+        self.loader = loader
+        self.version_loader = version_loader
+        self.version_check_seconds = version_check_seconds
+        self._clients = {}
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.lookups = 0
+        self.hits = 0
+        self.stale_reloads = 0
+
+    def _get(self, client_id):
+        with self._lock:
+            index = self._clients.get(client_id)
+            generation = self._generation
+        if index is not None and time.monotonic() - index.checked_at >= self.version_check_seconds:
+            index = self._check_version(client_id, index)
+        if index is not None:
+            return index
+        # Read the version first: a write landing during the load leaves the index behind it.
+        index = _ClientIndex(self.version_loader(client_id))
+        faqs, aliases = self.loader(client_id)
+        for faq in faqs:
+            index.add_faq(faq)
+        for faq_id, alias in aliases:
+            index.add_alias(faq_id, alias)
+        with self._lock:
+            # A load that raced with a CRUD change is used once but not kept.
+            if self._generation != generation:
+                return index
+            return self._clients.setdefault(client_id, index)
+
+    def _check_version(self, client_id, index):
+        """Returns the index if faq_versions still matches it, or None after dropping it."""
+        current = self.version_loader(client_id)
+        with self._lock:
+            if self._clients.get(client_id) is not index:
+                return index  # Dropped meanwhile; checked again on a later lookup.
+            if current is not None and current != index.version:
+                logger.info(f"FAQs for client '{client_id}' changed in another process: reloading the lexical index.")
+                self._generation += 1
+                del self._clients[client_id]
+                self.stale_reloads += 1
+                return None
+            index.checked_at = time.monotonic()
+            return index
+
+    def lookup(self, client_id, text):
+        """
+        Returns the FAQ whose question or alias matches `text` after normalisation, or None.
+        Falls back to all FAQs when the client has none, like find_relevant_faq.
+        """
+        key = normalize_text(text)
+        index = self._get(client_id)
+        if not index.faqs and client_id:
+            index = self._get(None)
+        faq = index.by_text.get(key) if key else None
+        with self._lock:
+            self.lookups += 1
+            if faq is not None:
+                self.hits += 1
+        return faq
+
+    # --- Maintenance hooks called by db/faqs_crud.py ---
+
+    def _patch(self, client_id, apply):
+        with self._lock:
+            self._generation += 1
+            self._clients.pop(None, None)  # The all-clients index is rebuilt on demand.
+            index = self._clients.get(client_id)
+            if index is not None:
+                apply(index)
+                # The write behind the patch bumped faq_versions by one.
+                if index.version is not None:
+                    index.version += 1
+
+    def faq_upserted(self, client_id, faq_id, question, answer):
+        def apply(index):
+            aliases = index.remove_faq(faq_id)
+            index.add_faq({'id': faq_id, 'question': question, 'answer': answer, 'client_id': client_id})
+            for alias in aliases:
+                index.add_alias(faq_id, alias)
+        self._patch(client_id, apply)
+
+    def faq_removed(self, client_id, faq_id):
+        self._patch(client_id, lambda index: index.remove_faq(faq_id))
+
+    def alias_added(self, client_id, faq_id, alias):
+        self._patch(client_id, lambda index: index.add_alias(faq_id, alias))
+
+    def invalidate(self, client_id=None):
+        with self._lock:
+            self._generation += 1
+            if client_id is None:
+                self._clients.clear()
+            else:
+                self._clients.pop(client_id, None)
+                self._clients.pop(None, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "clients": len(self._clients),
+                "entries": sum(len(i.by_text) for i in self._clients.values()),
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "stale_reloads": self.stale_reloads,
+                "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+                "gemini_calls_saved": self.hits,
+            }
+
+
+faq_lexical_index = FaqLexicalIndex()
@@ -0,0 +1,31 @@
+# db/faq_versions_crud.py
+# Reads the per-client FAQ change counters kept by the faq_versions triggers (migration 10).
+# The in-memory FAQ caches remember the version they loaded and compare it with this before
+# serving, so changes made by other processes are picked up.
+
+import sqlite3
+import logging
+from db.db_connection import get_db_connection
+from config import LOGGING_LEVEL, log_level_map
+
+logger = logging.getLogger(__name__)
+logger.setLevel(log_level_map.get(LOGGING_LEVEL, logging.INFO))
+
+ALL_CLIENTS = "*"
+
+def get_faq_version(client_id=None):
+    """
+    Returns the change counter for a client's FAQs and aliases (every client's if client_id is
+    None), 0 if they were never written, or None if it can't be read.
+    """
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT version FROM faq_versions WHERE client_id = ?", (client_id or ALL_CLIENTS,))
+        row = cursor.fetchone()
+        return row[0] if row else 0
+    except sqlite3.Error as e:
+        logger.error(f"Error reading FAQ version for client '{client_id}': {e}", exc_info=True)
+        return None
+    finally:
+        conn.close()
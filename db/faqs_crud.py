@@ -1,25 +1,56 @@
 # db/faqs_crud.py
 import sqlite3
 import logging
-import json
+import time
+import numpy as np
 from db.db_connection import get_db_connection
-from config import LOGGING_LEVEL, log_level_map
+from db.embedding_codec import encode_embedding, decode_embedding, decode_into
+from db.faq_lexical_index import faq_lexical_index
+from db.response_cache import response_cache
+from config import (
+    LOGGING_LEVEL, log_level_map, GEMINI_EMBEDDING_MODEL,
+    FAQ_EMBEDDING_STORAGE_DTYPE, FAQ_EMBEDDING_MIGRATION_BATCH_SIZE
+)
 
 logger = logging.getLogger(__name__)
 logger.setLevel(log_level_map.get(LOGGING_LEVEL, logging.INFO))
 
-def add_faq(question, answer, embedding, client_id, active=1):
+EMBEDDING_COLUMNS = "embedding, embedding_dtype, embedding_dim, embedding_scale, embedding_model"
+
+def embedding_column_values(embedding, model=None):
+    """Returns the values for the embedding columns (see EMBEDDING_COLUMNS), encoded with the configured storage dtype."""
+    if embedding is None:
+        return None, None, None, None, None
+    blob, dtype, dim, scale = encode_embedding(embedding, FAQ_EMBEDDING_STORAGE_DTYPE)
+    return blob, dtype, dim, scale, model or GEMINI_EMBEDDING_MODEL
+
+def _row_to_faq(row):
+    """Converts a DB row to an FAQ dict with a decoded float32 'embedding'."""
+    faq_item = dict(row)
+    dtype = faq_item.pop('embedding_dtype', None)
+    scale = faq_item.pop('embedding_scale', None)
+    if faq_item.get('embedding') is not None:
+        faq_item['embedding'] = decode_embedding(faq_item['embedding'], dtype, faq_item.get('embedding_dim'), scale)
+        if faq_item['embedding'] is None:
+            logger.warning(f"Could not decode embedding for FAQ ID {faq_item['id']}. Data might be corrupted.")
+    return faq_item
+
+def add_faq(question, answer, embedding, client_id, active=1, embedding_model=None):
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO faqs (question, answer, embedding, client_id, active)
-            VALUES (?, ?, ?, ?, ?)
-        """, (question, answer, embedding, client_id, active))
+        cursor.execute(f"""
+            INSERT INTO faqs (question, answer, {EMBEDDING_COLUMNS}, client_id, active)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (question, answer, *embedding_column_values(embedding, embedding_model), client_id, active))
         conn.commit()
-        return True
+        faq_id = cursor.lastrowid
+        if active:
+            faq_lexical_index.faq_upserted(client_id, faq_id, question, answer)
+            response_cache.invalidate(client_id)
+        return faq_id
     except Exception as e:
-        # your error handling...
+        logger.error(f"Error adding FAQ for client '{client_id}': {e}", exc_info=True)
         return False
     finally:
         conn.close()
@@ -28,7 +59,7 @@ def get_all_faqs(client_id=None):
     conn = get_db_connection()
     cursor = conn.cursor()
     faqs = []
-    query = "SELECT id, question, answer, embedding, client_id FROM faqs WHERE active = 1"
+    query = f"SELECT id, question, answer, {EMBEDDING_COLUMNS}, client_id FROM faqs WHERE active = 1"
     params = []
     if client_id:
         query += " AND client_id = ?"
@@ -36,14 +67,7 @@ def get_all_faqs(client_id=None):
     try:
         cursor.execute(query, tuple(params))
         for row in cursor.fetchall():
-            faq_item = dict(row)
-            if faq_item.get('embedding'):
-                try:
-                    faq_item['embedding'] = json.loads(faq_item['embedding'])
-                except json.JSONDecodeError:
-                    logger.warning(f"Could not decode embedding for FAQ ID {faq_item['id']}. Data might be corrupted.")
-                    faq_item['embedding'] = None
-            faqs.append(faq_item)
+            faqs.append(_row_to_faq(row))
         logger.debug(f"Retrieved {len(faqs)} FAQs from DB for client '{client_id if client_id else 'all'}'.")
     except sqlite3.Error as e:
         logger.error(f"Error retrieving all FAQs from DB: {e}", exc_info=True)
@@ -58,7 +82,7 @@ def get_faq_by_id(faq_id, client_id=None):
     conn = get_db_connection()
     cursor = conn.cursor()
     faq_item = None
-    query = "SELECT id, question, answer, embedding, client_id FROM faqs WHERE id = ? AND active = 1"
+    query = f"SELECT id, question, answer, {EMBEDDING_COLUMNS}, client_id FROM faqs WHERE id = ? AND active = 1"
     params = [faq_id]
     if client_id:
         query += " AND client_id = ?"
@@ -67,13 +91,7 @@ def get_faq_by_id(faq_id, client_id=None):
         cursor.execute(query, tuple(params))
         row = cursor.fetchone()
         if row:
-            faq_item = dict(row)
-            if faq_item.get('embedding'):
-                try:
-                    faq_item['embedding'] = json.loads(faq_item['embedding'])
-                except json.JSONDecodeError:
-                    logger.warning(f"Could not decode embedding for FAQ ID {faq_item['id']}. Data might be corrupted.")
-                    faq_item['embedding'] = None
+            faq_item = _row_to_faq(row)
             logger.debug(f"Retrieved FAQ ID {faq_id} for client '{client_id if client_id else 'N/A'}'.")
     except sqlite3.Error as e:
         logger.error(f"Error retrieving FAQ by ID {faq_id}: {e}", exc_info=True)
@@ -81,20 +99,22 @@ def get_faq_by_id(faq_id, client_id=None):
         conn.close()
     return faq_item
 
-def update_faq(faq_id, question, answer, embedding, client_id):
+def update_faq(faq_id, question, answer, embedding, client_id, embedding_model=None):
     if not client_id:
         logger.error("Cannot update FAQ without client_id. Operation aborted.")
         return False
     conn = get_db_connection()
     cursor = conn.cursor()
     try:
-        embedding_json = json.dumps(embedding)
         cursor.execute(
-            "UPDATE faqs SET question = ?, answer = ?, embedding = ? WHERE id = ? AND client_id = ? AND active = 1",
-            (question, answer, embedding_json, faq_id, client_id)
+            "UPDATE faqs SET question = ?, answer = ?, embedding = ?, embedding_dtype = ?, embedding_dim = ?, "
+            "embedding_scale = ?, embedding_model = ? WHERE id = ? AND client_id = ? AND active = 1",
+            (question, answer, *embedding_column_values(embedding, embedding_model), faq_id, client_id)
         )
         conn.commit()
         if cursor.rowcount > 0:
+            faq_lexical_index.faq_upserted(client_id, int(faq_id), question, answer)
+            response_cache.invalidate(client_id)
             logger.info(f"FAQ ID {faq_id} updated successfully for client '{client_id}'.")
             return True
         else:
@@ -118,6 +138,8 @@ def soft_delete_faq_by_id(faq_id, client_id=None):
         cursor.execute(query, tuple(params))
         conn.commit()
         if cursor.rowcount > 0:
+            faq_lexical_index.faq_removed(client_id, int(faq_id))
+            response_cache.invalidate(client_id)
             logger.info(f"FAQ with ID {faq_id} soft deleted (active set to 0) for client '{client_id}'.")
             return True
         else:
@@ -128,3 +150,198 @@ def soft_delete_faq_by_id(faq_id, client_id=None):
         return False
     finally:
         conn.close()
+
+def update_faq_embeddings(updates, embedding_model=None):
+    """
+    Bulk-replaces embeddings from (faq_id, embedding) pairs in one transaction.
+    Returns the number of rows updated.
+    """
+    if not updates:
+        return 0
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.executemany(
+            "UPDATE faqs SET embedding = ?, embedding_dtype = ?, embedding_dim = ?, embedding_scale = ?, "
+            "embedding_model = ? WHERE id = ? AND active = 1",
+            [(*embedding_column_values(embedding, embedding_model), faq_id) for faq_id, embedding in updates]
+        )
+        conn.commit()
+        return cursor.rowcount
+    except sqlite3.Error as e:
+        logger.error(f"Error bulk updating FAQ embeddings: {e}", exc_info=True)
+        return 0
+    finally:
+        conn.close()
+
+def get_faq_questions(client_id):
+    """Yields the question text of every active FAQ for a client, without loading embeddings."""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT question FROM faqs WHERE active = 1 AND client_id = ?", (client_id,))
+        for row in cursor:
+            yield row['question']
+    except sqlite3.Error as e:
+        logger.error(f"Error fetching FAQ questions for client '{client_id}': {e}", exc_info=True)
+    finally:
+        conn.close()
+
+def add_faq_alias(faq_id, alias, client_id):
+    """Registers an alternative phrasing that answers with the given FAQ. Returns the alias id."""
+    if not client_id or not alias or not alias.strip():
+        logger.error("Cannot add FAQ alias without client_id and alias text.")
+        return False
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT INTO faq_aliases (faq_id, client_id, alias, active) "
+            "SELECT id, client_id, ?, 1 FROM faqs WHERE id = ? AND client_id = ? AND active = 1",
+            (alias.strip(), faq_id, client_id)
+        )
+        conn.commit()
+        if cursor.rowcount == 0:
+            logger.warning(f"No FAQ found with ID {faq_id} for client '{client_id}' to alias.")
+            return False
+        faq_lexical_index.alias_added(client_id, int(faq_id), alias)
+        logger.info(f"Alias '{alias[:50]}' added to FAQ ID {faq_id} for client '{client_id}'.")
+        return cursor.lastrowid
+    except sqlite3.Error as e:
+        logger.error(f"Error adding alias to FAQ ID {faq_id}: {e}", exc_info=True)
+        return False
+    finally:
+        conn.close()
+
+def get_faq_aliases(faq_id, client_id=None):
+    conn = get_db_connection()
+    aliases = []
+    query = "SELECT id, faq_id, alias, client_id FROM faq_aliases WHERE faq_id = ? AND active = 1"
+    params = [faq_id]
+    if client_id:
+        query += " AND client_id = ?"
+        params.append(client_id)
+    try:
+        cursor = conn.cursor()
+        cursor.execute(query, tuple(params))
+        aliases = [dict(row) for row in cursor.fetchall()]
+    except sqlite3.Error as e:
+        logger.error(f"Error fetching aliases for FAQ ID {faq_id}: {e}", exc_info=True)
+    finally:
+        conn.close()
+    return aliases
+
+def soft_delete_faq_alias(alias_id, client_id):
+    if not client_id:
+        logger.error("Cannot delete FAQ alias without client_id. Operation aborted.")
+        return False
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("UPDATE faq_aliases SET active = 0 WHERE id = ? AND client_id = ?", (alias_id, client_id))
+        conn.commit()
+        if cursor.rowcount > 0:
+            # Other aliases may share the normalised text, so rebuild this client's index lazily.
+            faq_lexical_index.invalidate(client_id)
+            logger.info(f"FAQ alias ID {alias_id} soft deleted for client '{client_id}'.")
+            return True
+        logger.warning(f"No FAQ alias found with ID {alias_id} for client '{client_id}'.")
+        return False
+    except sqlite3.Error as e:
+        logger.error(f"Error soft deleting FAQ alias: {e}", exc_info=True)
+        return False
+    finally:
+        conn.close()
+
+def get_faq_embedding_matrix(client_id=None):
+    """
+    Loads a client's active FAQs as (faqs, matrix) for similarity search.
+    `faqs` are dicts without embeddings and `matrix` is an (n, d) float32 array with one
+    row per FAQ, decoded directly from the BLOBs into place. Rows that can't be decoded,
+    or whose dimension differs from the first row, are skipped.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    query = f"SELECT id, question, answer, client_id, {EMBEDDING_COLUMNS} FROM faqs WHERE active = 1 AND embedding IS NOT NULL"
+    params = []
+    if client_id:
+        query += " AND client_id = ?"
+        params.append(client_id)
+    faqs = []
+    matrix = np.empty((0, 0), dtype=np.float32)
+    try:
+        cursor.execute(query, tuple(params))
+        rows = cursor.fetchall()
+        # Take the dimension from the first binary row, or from a legacy JSON row if none is migrated yet.
+        dim = next((row['embedding_dim'] for row in rows if row['embedding_dtype']), None)
+        if dim is None:
+            dim = next((len(vec) for vec in (decode_embedding(row['embedding']) for row in rows) if vec is not None), 0)
+        matrix = np.empty((len(rows), dim), dtype=np.float32)
+        count = 0
+        for row in rows:
+            if row['embedding_dtype']:
+                ok = decode_into(matrix[count], row['embedding'], row['embedding_dtype'], row['embedding_scale'])
+            else:
+                vec = decode_embedding(row['embedding'])
+                ok = vec is not None and len(vec) == dim
+                if ok:
+                    matrix[count] = vec
+            if not ok:
+                logger.warning(f"Skipping FAQ ID {row['id']}: embedding missing, corrupted or not {dim}-dimensional.")
+                continue
+            faqs.append({'id': row['id'], 'question': row['question'], 'answer': row['answer'], 'client_id': row['client_id']})
+            count += 1
+        matrix = matrix[:count]
+        logger.debug(f"Loaded {count} FAQ embeddings ({dim} dims) for client '{client_id if client_id else 'all'}'.")
+    except sqlite3.Error as e:
+        logger.error(f"Error loading FAQ embedding matrix: {e}", exc_info=True)
+    finally:
+        conn.close()
+    return faqs, matrix
+
+def migrate_faq_embeddings(batch_size=FAQ_EMBEDDING_MIGRATION_BATCH_SIZE, pause_seconds=0.05):
+    """
+    Converts legacy JSON TEXT embeddings to BLOBs in small batches.
+    Each batch is its own short transaction, so the app keeps serving while this runs;
+    readers understand both formats in the meantime. Safe to re-run at any time.
+    Returns the number of rows converted.
+    """
+    converted = 0
+    while True:
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT id, embedding FROM faqs WHERE embedding_dtype IS NULL AND embedding IS NOT NULL LIMIT ?",
+                (batch_size,)
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            updates = []
+            for row in rows:
+                vec = decode_embedding(row['embedding'])
+                if vec is None:
+                    # Unreadable legacy value (e.g. 'null'): clear it so it isn't picked up again.
+                    logger.warning(f"Clearing unreadable legacy embedding for FAQ ID {row['id']}.")
+                    updates.append((None, None, None, None, row['id'], row['embedding']))
+                    continue
+                blob, dtype, dim, scale = encode_embedding(vec, FAQ_EMBEDDING_STORAGE_DTYPE)
+                updates.append((blob, dtype, dim, scale, row['id'], row['embedding']))
+            # Guard on the old value so a concurrent update_faq is never overwritten.
+            cursor.executemany(
+                "UPDATE faqs SET embedding = ?, embedding_dtype = ?, embedding_dim = ?, embedding_scale = ? "
+                "WHERE id = ? AND embedding_dtype IS NULL AND embedding = ?",
+                updates
+            )
+            conn.commit()
+            converted += len(updates)
+        except sqlite3.Error as e:
+            logger.error(f"Error migrating FAQ embeddings to BLOB storage: {e}", exc_info=True)
+            break
+        finally:
+            conn.close()
+        time.sleep(pause_seconds)
+    if converted:
+        logger.info(f"Migrated {converted} FAQ embeddings to {FAQ_EMBEDDING_STORAGE_DTYPE} BLOB storage.")
+    return converted
@@ -0,0 +1,309 @@
+# db/migrations.py
+# Versioned schema migrations. init_db() creates the base tables; the ordered steps below are
+# then applied once each and recorded in `schema_version`. Every step must be idempotent
+# (IF NOT EXISTS etc.) so a database whose tables were created by a newer init_db still migrates.
+# A step is an SQL string, or a callable taking the cursor (e.g. ensure_columns for new columns).
+# Add new schema changes as a new step at the end; never edit or reorder an applied step.
+#
+#   python -m db.migrations            # apply pending migrations
+#   python -m db.migrations --check    # show query plans for the hot queries, fail on table scans
+
+import argparse
+import logging
+import sqlite3
+import sys
+import time
+from db.db_connection import get_db_connection, ensure_columns
+from config import LOGGING_LEVEL, log_level_map
+
+logger = logging.getLogger(__name__)
+logger.setLevel(log_level_map.get(LOGGING_LEVEL, logging.INFO))
+
+def _faq_version_trigger(table, event, row):
+    """SQL for a trigger that bumps faq_versions for the client of each row written to `table`."""
+    return f"""CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_version AFTER {event} ON {table}
+        BEGIN
+            INSERT INTO faq_versions (client_id, version) VALUES (COALESCE({row}.client_id, ''), 1)
+                ON CONFLICT (client_id) DO UPDATE SET version = version + 1;
+            INSERT INTO faq_versions (client_id, version) VALUES ('*', 1)
+                ON CONFLICT (client_id) DO UPDATE SET version = version + 1;
+        END"""
+
+# (version, description, statements)
+MIGRATIONS = [
+    (1, "Index conversations for history, latest-per-user and recent listings", [
+        # get_conversation_history_by_whatsapp_id, get_recent_conversations(wa_id, client_id),
+        # and the GROUP BY wa_id / MAX(timestamp) subquery of get_all_conversations
+        "CREATE INDEX IF NOT EXISTS idx_conversations_wa_client_ts ON conversations (wa_id, client_id, timestamp) WHERE active = 1",
+        # get_all_conversations / get_recent_conversations / counts filtered by client
+        "CREATE INDEX IF NOT EXISTS idx_conversations_client_wa_ts ON conversations (client_id, wa_id, timestamp) WHERE active = 1",
+        "CREATE INDEX IF NOT EXISTS idx_conversations_client_ts ON conversations (client_id, timestamp) WHERE active = 1",
+        # get_recent_conversations without filters
+        "CREATE INDEX IF NOT EXISTS idx_conversations_ts ON conversations (timestamp) WHERE active = 1",
+    ]),
+    (2, "Index FAQ loads and aliases by client", [
+        # get_all_faqs, get_faq_embedding_matrix, get_faq_questions, lexical index loads
+        "CREATE INDEX IF NOT EXISTS idx_faqs_client ON faqs (client_id) WHERE active = 1",
+        # migrate_faq_embeddings: rows still holding legacy JSON embeddings
+        "CREATE INDEX IF NOT EXISTS idx_faqs_legacy_embedding ON faqs (id) WHERE embedding_dtype IS NULL",
+        "CREATE INDEX IF NOT EXISTS idx_faq_aliases_faq ON faq_aliases (faq_id) WHERE active = 1",
+    ]),
+    (3, "Index client lookup by phone number and users by client", [
+        "CREATE INDEX IF NOT EXISTS idx_clients_phone ON clients (whatsapp_phone_number_id) WHERE active = 1",
+        "CREATE INDEX IF NOT EXISTS idx_users_client ON users (client_id) WHERE active = 1",
+    ]),
+    (4, "Add the outbound message outbox", [
+        """CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            client_id TEXT NOT NULL,
+            conversation_id INTEGER, -- the conversations row this reply answers
+            phone_number_id TEXT, -- sending business number; NULL = deployment default
+            to_number TEXT NOT NULL,
+            message_body TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending', -- 'pending', 'sending', 'sent' or 'failed'
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at INTEGER NOT NULL, -- when pending: retry time; when sending: lease expiry
+            last_error TEXT,
+            graph_message_id TEXT,
+            created_at INTEGER NOT NULL,
+            updated_at INTEGER NOT NULL,
+            FOREIGN KEY (conversation_id) REFERENCES conversations(id)
+        )""",
+        # The dispatcher only ever looks at undelivered rows.
+        "CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (next_attempt_at) WHERE status IN ('pending', 'sending')",
+    ]),
+    (5, "Add the processed message ids table for webhook deduplication", [
+        """CREATE TABLE IF NOT EXISTS processed_messages (
+            message_id TEXT PRIMARY KEY, -- WhatsApp "wamid" of the inbound message
+            client_id TEXT,
+            received_at INTEGER NOT NULL
+        ) WITHOUT ROWID""",
+        # TTL pruning
+        "CREATE INDEX IF NOT EXISTS idx_processed_messages_received_at ON processed_messages (received_at)",
+    ]),
+    (6, "Add per-client inbound rate limits", [
+        # NULL = RATE_LIMIT_SECONDS / RATE_LIMIT_BURST
+        lambda cursor: ensure_columns(cursor, "clients", {"rate_limit_seconds": "REAL", "rate_limit_burst": "INTEGER"}),
+    ]),
+    (7, "Add per-client message coalescing windows", [
+        # NULL = MESSAGE_COALESCE_WINDOW_MS; 0 turns coalescing off for the client
+        lambda cursor: ensure_columns(cursor, "clients", {"coalesce_window_ms": "INTEGER"}),
+    ]),
+    (8, "Add rolling conversation summaries", [
+        """CREATE TABLE IF NOT EXISTS conversation_summaries (
+            client_id TEXT NOT NULL,
+            wa_id TEXT NOT NULL,
+            summary TEXT NOT NULL,
+            last_message_id INTEGER NOT NULL, -- newest conversations.id folded into the summary
+            message_count INTEGER NOT NULL DEFAULT 0,
+            updated_at INTEGER NOT NULL,
+            PRIMARY KEY (client_id, wa_id)
+        ) WITHOUT ROWID""",
+    ]),
+    (9, "Add the semantic response cache", [
+        """CREATE TABLE IF NOT EXISTS response_cache (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            client_id TEXT NOT NULL,
+            model TEXT NOT NULL,
+            query_text TEXT,
+            embedding BLOB NOT NULL, -- normalised float32 query embedding, see db/embedding_codec.py
+            answer TEXT NOT NULL,
+            created_at INTEGER NOT NULL
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_response_cache_client_created ON response_cache (client_id, created_at)",
+    ]),
+    (10, "Count FAQ changes per client so every process can tell when its FAQ caches are stale", [
+        # Bumped by triggers rather than by the CRUD functions, so writes from seed_db,
+        # import_faqs.py, reembed_faqs and other workers are all counted. Every row written bumps
+        # its client ('' for FAQs without one) by one, and '*' (all clients) by one.
+        """CREATE TABLE IF NOT EXISTS faq_versions (
+            client_id TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        ) WITHOUT ROWID""",
+        _faq_version_trigger("faqs", "INSERT", "NEW"),
+        _faq_version_trigger("faqs", "UPDATE", "NEW"),
+        _faq_version_trigger("faqs", "DELETE", "OLD"),
+        _faq_version_trigger("faq_aliases", "INSERT", "NEW"),
+        _faq_version_trigger("faq_aliases", "UPDATE", "NEW"),
+        _faq_version_trigger("faq_aliases", "DELETE", "OLD"),
+    ]),
+]
+
+# Queries from db/*_crud.py that run per message or per dashboard load, with sample parameters.
+# check_query_plans() asserts none of them falls back to a full table scan.
+HOT_QUERIES = {
+    "conversation_history": (
+        "SELECT * FROM conversations WHERE wa_id = ? AND active = 1 AND client_id = ? ORDER BY timestamp DESC LIMIT ?",
+        ("wa", "client", 5)),
+    "latest_per_user": (
+        """SELECT c.*, cl.client_name FROM conversations c LEFT JOIN clients cl ON c.client_id = cl.client_id
+           INNER JOIN (SELECT wa_id, MAX(timestamp) as last_timestamp FROM conversations
+                       WHERE active = 1 GROUP BY wa_id) sub
+           ON c.wa_id = sub.wa_id AND c.timestamp = sub.last_timestamp
+           WHERE c.active = 1 ORDER BY c.timestamp DESC LIMIT ?""",
+        (100,)),
+    "latest_per_user_by_client": (
+        """SELECT c.*, cl.client_name FROM conversations c LEFT JOIN clients cl ON c.client_id = cl.client_id
+           INNER JOIN (SELECT wa_id, MAX(timestamp) as last_timestamp FROM conversations
+                       WHERE active = 1 AND client_id = ? GROUP BY wa_id) sub
+           ON c.wa_id = sub.wa_id AND c.timestamp = sub.last_timestamp
+           WHERE c.active = 1 AND c.client_id = ? ORDER BY c.timestamp DESC LIMIT ?""",
+        ("client", "client", 100)),
+    "recent_conversations": (
+        "SELECT * FROM conversations WHERE active = 1 ORDER BY timestamp DESC LIMIT ?", (20,)),
+    "recent_conversations_by_client": (
+        "SELECT * FROM conversations WHERE active = 1 AND client_id = ? ORDER BY timestamp DESC LIMIT ?",
+        ("client", 20)),
+    "conversation_count_by_client": (
+        "SELECT COUNT(*) FROM conversations WHERE active = 1 AND client_id = ?", ("client",)),
+    "faq_matrix": (
+        "SELECT id, question, answer, client_id, embedding FROM faqs WHERE active = 1 AND embedding IS NOT NULL AND client_id = ?",
+        ("client",)),
+    "faq_questions": (
+        "SELECT question FROM faqs WHERE active = 1 AND client_id = ?", ("client",)),
+    "faq_lexical_aliases": (
+        """SELECT a.faq_id, a.alias FROM faq_aliases a JOIN faqs f ON f.id = a.faq_id
+           WHERE a.active = 1 AND f.active = 1 AND f.client_id = ? ORDER BY a.id""",
+        ("client",)),
+    "faq_version": (
+        "SELECT version FROM faq_versions WHERE client_id = ?", ("client",)),
+    "faq_legacy_embeddings": (
+        "SELECT id, embedding FROM faqs WHERE embedding_dtype IS NULL AND embedding IS NOT NULL LIMIT ?", (200,)),
+    "client_by_phone": (
+        "SELECT client_id FROM clients WHERE whatsapp_phone_number_id = ? AND active = 1", ("phone",)),
+    "outbox_due": (
+        "SELECT * FROM outbox WHERE status IN ('pending', 'sending') AND next_attempt_at <= ? ORDER BY next_attempt_at, id LIMIT ?",
+        (0, 50)),
+    "processed_messages_expired": (
+        "SELECT message_id FROM processed_messages WHERE received_at < ?", (0,)),
+    "conversation_summary": (
+        "SELECT * FROM conversation_summaries WHERE client_id = ? AND wa_id = ?", ("client", "wa")),
+    "messages_since_summary": (
+        "SELECT id, sender, message_text, response_text FROM conversations "
+        "WHERE wa_id = ? AND client_id = ? AND active = 1 AND id > ? ORDER BY id LIMIT ?",
+        ("wa", "client", 0, 50)),
+    "latest_messages_for_summary": (
+        "SELECT id, sender, message_text, response_text FROM conversations "
+        "WHERE wa_id = ? AND client_id = ? AND active = 1 ORDER BY id DESC LIMIT ?",
+        ("wa", "client", 50)),
+    "response_cache_load": (
+        "SELECT id, model, embedding, answer, created_at FROM response_cache "
+        "WHERE client_id = ? AND created_at >= ? ORDER BY created_at DESC, id DESC LIMIT ?",
+        ("client", 0, 1000)),
+    "users_by_client": (
+        "SELECT id FROM users WHERE client_id = ? AND active = 1", ("client",)),
+}
+
+
+def create_schema_version_table(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at INTEGER NOT NULL
+        );
+    ''')
+
+def get_schema_version():
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        create_schema_version_table(cursor)
+        cursor.execute("SELECT MAX(version) FROM schema_version")
+        return cursor.fetchone()[0] or 0
+    finally:
+        conn.close()
+
+def apply_migrations():
+    """Applies pending migrations in order, each in its own transaction. Returns the schema version."""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        create_schema_version_table(cursor)
+        for version, description, statements in MIGRATIONS:
+            # IMMEDIATE takes the write lock first, so concurrent workers apply each step once.
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                cursor.execute("SELECT 1 FROM schema_version WHERE version = ?", (version,))
+                if cursor.fetchone():
+                    conn.rollback()
+                    continue
+                for statement in statements:
+                    if callable(statement):
+                        statement(cursor)
+                    else:
+                        cursor.execute(statement)
+                cursor.execute(
+                    "INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                    (version, description, int(time.time()))
+                )
+                conn.commit()
+                logger.info(f"Applied schema migration {version}: {description}")
+            except sqlite3.Error as e:
+                conn.rollback()
+                logger.error(f"Schema migration {version} failed: {e}", exc_info=True)
+                raise
+        # Refresh planner statistics so the new indexes are chosen over scans.
+        cursor.execute("PRAGMA optimize")
+        cursor.execute("SELECT MAX(version) FROM schema_version")
+        return cursor.fetchone()[0] or 0
+    finally:
+        conn.close()
+
+def explain_query_plan(sql, params=()):
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+        return [row[3] for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
+def check_query_plans():
+    """
+    Returns {query name: plan lines} for every HOT_QUERIES entry whose plan contains a full
+    table scan ("SCAN <table>" without an index). An empty dict means all queries use indexes.
+    """
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+        tables = {row[0] for row in cursor.fetchall()}
+    finally:
+        conn.close()
+
+    regressions = {}
+    for name, (sql, params) in HOT_QUERIES.items():
+        plan = explain_query_plan(sql, params)
+        for line in plan:
+            words = line.split()
+            if len(words) >= 2 and words[0] == "SCAN" and words[1] in tables and "INDEX" not in line:
+                regressions[name] = plan
+                break
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply schema migrations.")
+    parser.add_argument("--check", action="store_true", help="Check hot query plans for table scans")
+    args = parser.parse_args(argv)
+
+    from db.db_connection import init_db
+    init_db()
+    print(f"Schema version: {get_schema_version()}")
+    if not args.check:
+        return 0
+    for name, (sql, params) in HOT_QUERIES.items():
+        print(f"{name}:")
+        for line in explain_query_plan(sql, params):
+            print(f"    {line}")
+    regressions = check_query_plans()
+    if regressions:
+        print(f"Full table scans in: {', '.join(regressions)}")
+        return 1
+    print("All hot queries use indexes.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+# db/outbox_crud.py
+# Durable queue of outbound replies. A reply is stored together with its conversation row,
+# and the outbox dispatcher delivers it later (at least once), recording the outcome here.
+import sqlite3
+import logging
+import time
+from db.db_connection import get_db_connection
+from db.conversation_history_cache import conversation_history_cache
+from config import LOGGING_LEVEL, log_level_map
+
+logger = logging.getLogger(__name__)
+logger.setLevel(log_level_map.get(LOGGING_LEVEL, logging.INFO))
+
+def add_message_with_reply(wa_id, message_text, client_id, response_text, phone_number_id=None):
+    """
+    Stores an inbound message with its reply and queues the reply for delivery, in one
+    transaction. Returns (conversation_id, outbox_id), or (None, None) on failure.
+    """
+    conn = get_db_connection()
+    now = int(time.time())
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT INTO conversations (wa_id, timestamp, message_text, sender, response_text, client_id, active) VALUES (?, ?, ?, 'user', ?, ?, 1)",
+            (wa_id, now, message_text, response_text, client_id)
+        )
+        conversation_id = cursor.lastrowid
+        cursor.execute(
+            "INSERT INTO outbox (client_id, conversation_id, phone_number_id, to_number, message_body, status, next_attempt_at, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, 'pending', ?, ?, ?)",
+            (client_id, conversation_id, phone_number_id, wa_id, response_text, now, now, now)
+        )
+        outbox_id = cursor.lastrowid
+        conn.commit()
+        conversation_history_cache.record(wa_id, client_id, 'user', message_text)
+        logger.info(f"Message added to DB from user (Client: {client_id}) with reply queued as outbox #{outbox_id}.")
+        return conversation_id, outbox_id
+    except sqlite3.Error as e:
+        conn.rollback()
+        logger.error(f"Error storing message and queuing reply for {wa_id}: {e}", exc_info=True)
+        return None, None
+    finally:
+        conn.close()
+
+def claim_outbox_batch(limit, lease_seconds):
+    """
+    Claims up to `limit` due messages for delivery: pending rows whose retry time has come, and
+    'sending' rows whose lease expired (the process died mid-send). Claimed rows are leased for
+    `lease_seconds`. Returns them as dicts.
+    """
+    conn = get_db_connection()
+    now = int(time.time())
+    try:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute(
+            "SELECT * FROM outbox WHERE status IN ('pending', 'sending') AND next_attempt_at <= ? "
+            "ORDER BY next_attempt_at, id LIMIT ?",
+            (now, limit)
+        )
+        rows = [dict(row) for row in cursor.fetchall()]
+        if rows:
+            cursor.executemany(
+                "UPDATE outbox SET status = 'sending', attempts = attempts + 1, next_attempt_at = ?, updated_at = ? WHERE id = ?",
+                [(now + lease_seconds, now, row['id']) for row in rows]
+            )
+        conn.commit()
+        for row in rows:
+            row['attempts'] += 1
+        return rows
+    except sqlite3.Error as e:
+        conn.rollback()
+        logger.error(f"Error claiming outbox batch: {e}", exc_info=True)
+        return []
+    finally:
+        conn.close()
+
+def mark_outbox_sent(outbox_id, graph_message_id):
+    return _set_outbox_status(outbox_id, 'sent', None, graph_message_id=graph_message_id)
+
+def mark_outbox_retry(outbox_id, error, next_attempt_at):
+    return _set_outbox_status(outbox_id, 'pending', error, next_attempt_at=next_attempt_at)
+
+def mark_outbox_failed(outbox_id, error):
+    return _set_outbox_status(outbox_id, 'failed', error)
+
+def _set_outbox_status(outbox_id, status, error, graph_message_id=None, next_attempt_at=None):
+    conn = get_db_connection()
+    now = int(time.time())
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            "UPDATE outbox SET status = ?, last_error = ?, graph_message_id = COALESCE(?, graph_message_id), "
+            "next_attempt_at = COALESCE(?, next_attempt_at), updated_at = ? WHERE id = ?",
+            (status, error, graph_message_id, next_attempt_at, now, outbox_id)
+        )
+        conn.commit()
+        return cursor.rowcount > 0
+    except sqlite3.Error as e:
+        logger.error(f"Error updating outbox #{outbox_id} to '{status}': {e}", exc_info=True)
+        return False
+    finally:
+        conn.close()
+
+def get_outbox_counts():
+    """Returns {status: count} over the outbox, plus the age in seconds of the oldest undelivered row."""
+    conn = get_db_connection()
+    counts = {"pending": 0, "sending": 0, "sent": 0, "failed": 0, "oldest_undelivered_seconds": 0}
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT status, COUNT(*) AS count FROM outbox GROUP BY status")
+        for row in cursor.fetchall():
+            counts[row['status']] = row['count']
+        cursor.execute("SELECT MIN(created_at) FROM outbox WHERE status IN ('pending', 'sending')")
+        oldest = cursor.fetchone()[0]
+        if oldest:
+            counts["oldest_undelivered_seconds"] = int(time.time()) - oldest
+    except sqlite3.Error as e:
+        logger.error(f"Error counting outbox rows: {e}", exc_info=True)
+    finally:
+        conn.close()
+    return counts
+
+def prune_outbox(retention_seconds):
+    """Deletes delivered (and finally failed) rows older than the retention window."""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            "DELETE FROM outbox WHERE status IN ('sent', 'failed') AND updated_at < ?",
+            (int(time.time() - retention_seconds),)
+        )
+        conn.commit()
+        return cursor.rowcount
+    except sqlite3.Error as e:
+        logger.error(f"Error pruning outbox: {e}", exc_info=True)
+        return 0
+    finally:
+        conn.close()
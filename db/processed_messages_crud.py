@@ -0,0 +1,63 @@
+# db/processed_messages_crud.py
+import sqlite3
+import logging
+import time
+from db.db_connection import get_db_connection
+from config import LOGGING_LEVEL, log_level_map
+
+logger = logging.getLogger(__name__)
+logger.setLevel(log_level_map.get(LOGGING_LEVEL, logging.INFO))
+
+def claim_message_id(message_id, client_id=None, ttl_seconds=None):
+    """
+    Records an inbound message id. Returns True if it is new (or its previous record expired),
+    False if it was already processed, and None on a database error.
+    """
+    conn = get_db_connection()
+    now = int(time.time())
+    expired_before = now - ttl_seconds if ttl_seconds else 0
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT INTO processed_messages (message_id, client_id, received_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (message_id) DO UPDATE SET client_id = excluded.client_id, received_at = excluded.received_at "
+            "WHERE processed_messages.received_at < ?",
+            (message_id, client_id, now, expired_before)
+        )
+        conn.commit()
+        return cursor.rowcount > 0
+    except sqlite3.Error as e:
+        logger.error(f"Error recording processed message {message_id}: {e}", exc_info=True)
+        return None
+    finally:
+        conn.close()
+
+def prune_processed_messages(ttl_seconds):
+    """Deletes message ids older than the TTL. Returns rows deleted."""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM processed_messages WHERE received_at < ?", (int(time.time() - ttl_seconds),))
+        conn.commit()
+        if cursor.rowcount:
+            logger.info(f"Pruned {cursor.rowcount} expired processed message ids.")
+        return cursor.rowcount
+    except sqlite3.Error as e:
+        logger.error(f"Error pruning processed messages: {e}", exc_info=True)
+        return 0
+    finally:
+        conn.close()
+
+def release_message_id(message_id):
+    """Forgets a message id so a redelivery of it is processed. Returns True if a row was deleted."""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM processed_messages WHERE message_id = ?", (message_id,))
+        conn.commit()
+        return cursor.rowcount > 0
+    except sqlite3.Error as e:
+        logger.error(f"Error releasing processed message {message_id}: {e}", exc_info=True)
+        return False
+    finally:
+        conn.close()
@@ -0,0 +1,222 @@
+# db/response_cache.py
+# Per-client semantic cache of generative answers (RESPONSE_CACHE_ENABLED).
+# When a query matches no FAQ and its conversation has no prior context, a previously generated
+# answer to a near-identical query (cosine similarity >= RESPONSE_CACHE_SIMILARITY, same model)
+# is served instead of calling the text model again. Entries live in the `response_cache` table
+# and are held per client as one normalised float32 matrix, like faq_cache. Entries expire after
+# RESPONSE_CACHE_TTL_SECONDS, the oldest are evicted beyond RESPONSE_CACHE_MAX_ENTRIES per
+# client, and a client's entries are dropped when its FAQs or system instruction change.
+
+import sqlite3
+import logging
+import threading
+import time
+
+import numpy as np
+
+from db.db_connection import get_db_connection
+from db.embedding_codec import encode_embedding, decode_embedding
+from config import (
+    LOGGING_LEVEL, log_level_map, RESPONSE_CACHE_ENABLED, RESPONSE_CACHE_SIMILARITY,
+    RESPONSE_CACHE_TTL_SECONDS, RESPONSE_CACHE_MAX_ENTRIES
+)
+
+logger = logging.getLogger(__name__)
+logger.setLevel(log_level_map.get(LOGGING_LEVEL, logging.INFO))
+
+
+def _normalize(vector):
+    vec = np.asarray(vector, dtype=np.float32).ravel()
+    norm = np.linalg.norm(vec)
+    if not norm or not np.isfinite(norm):
+        return None
+    return vec / norm
+
+
+def _load_entries(client_id, min_created_at, limit):
+    """Returns the client's newest unexpired entries, oldest first."""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT id, model, embedding, answer, created_at FROM response_cache "
+            "WHERE client_id = ? AND created_at >= ? ORDER BY created_at DESC, id DESC LIMIT ?",
+            (client_id, int(min_created_at), limit)
+        )
+        return [dict(row) for row in cursor.fetchall()][::-1]
+    except sqlite3.Error as e:
+        logger.error(f"Error loading response cache for client '{client_id}': {e}", exc_info=True)
+        return []
+    finally:
+        conn.close()
+
+
+def _insert_entry(client_id, model, query_text, embedding, answer):
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT INTO response_cache (client_id, model, query_text, embedding, answer, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (client_id, model, query_text, encode_embedding(embedding, "float32")[0], answer, int(time.time()))
+        )
+        conn.commit()
+        return cursor.lastrowid
+    except sqlite3.Error as e:
+        logger.error(f"Error writing response cache for client '{client_id}': {e}", exc_info=True)
+        return None
+    finally:
+        conn.close()
+
+
+def _delete_entries(client_id=None, before=None, keep_newest=None):
+    """Deletes a client's entries (all clients if None): all, those created before `before`, or all but the newest N."""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        client_filter, params = ("client_id = ?", [client_id]) if client_id is not None else ("1 = 1", [])
+        if keep_newest is not None:
+            cursor.execute(
+                f"DELETE FROM response_cache WHERE {client_filter} AND id NOT IN ("
+                f"SELECT id FROM response_cache WHERE {client_filter} ORDER BY created_at DESC, id DESC LIMIT ?)",
+                params + params + [keep_newest]
+            )
+        elif before is not None:
+            cursor.execute(f"DELETE FROM response_cache WHERE {client_filter} AND created_at < ?", params + [int(before)])
+        else:
+            cursor.execute(f"DELETE FROM response_cache WHERE {client_filter}", params)
+        conn.commit()
+        return cursor.rowcount
+    except sqlite3.Error as e:
+        logger.error(f"Error deleting response cache entries for client '{client_id}': {e}", exc_info=True)
+        return 0
+    finally:
+        conn.close()
+
+
+class _ClientEntries:
+    def __init__(self, rows):
+        vectors = [_normalize(decode_embedding(row['embedding'], "float32")) for row in rows]
+        keep = [i for i, vec in enumerate(vectors) if vec is not None]
+        self.models = [rows[i]['model'] for i in keep]
+        self.answers = [rows[i]['answer'] for i in keep]
+        self.created = [rows[i]['created_at'] for i in keep]
+        self.matrix = np.vstack([vectors[i] for i in keep]) if keep else None
+
+    def append(self, model, vector, answer, created_at, max_entries):
+        # Copy-on-write, so a lookup holding the previous lists and matrix stays consistent.
+        start = max(0, self.size + 1 - max_entries)
+        self.models = self.models[start:] + [model]
+        self.answers = self.answers[start:] + [answer]
+        self.created = self.created[start:] + [created_at]
+        self.matrix = vector[np.newaxis, :] if self.matrix is None else np.vstack([self.matrix[start:], vector])
+
+    def snapshot(self):
+        return self.matrix, self.models, self.answers, self.created
+
+    @property
+    def size(self):
+        return len(self.answers)
+
+
+class ResponseCache:
+    def __init__(self, similarity=RESPONSE_CACHE_SIMILARITY, ttl_seconds=RESPONSE_CACHE_TTL_SECONDS,
+                 max_entries=RESPONSE_CACHE_MAX_ENTRIES):
+        self.similarity = similarity
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._clients = {}
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.invalidations = 0
+
+    def _get(self, client_id):
+        with self._lock:
+            entries = self._clients.get(client_id)
+            generation = self._generation
+        if entries is not None:
+            return entries
+        entries = _ClientEntries(_load_entries(client_id, time.time() - self.ttl_seconds, self.max_entries))
+        with self._lock:
+            # A load that raced with an invalidation is used once but not kept.
+            if self._generation != generation:
+                return entries
+            return self._clients.setdefault(client_id, entries)
+
+    def lookup(self, client_id, model, query_embedding):
+        """Returns (answer, similarity) for the best unexpired match at or above the threshold, else (None, best)."""
+        if not RESPONSE_CACHE_ENABLED:
+            return None, 0.0
+        query = _normalize(query_embedding)
+        entries = self._get(client_id)
+        with self._lock:
+            matrix, models, answers, created = entries.snapshot()
+        answer, best = None, 0.0
+        if query is not None and matrix is not None and matrix.shape[1] == query.shape[0]:
+            scores = matrix @ query
+            best = float(scores.max())
+            min_created_at = time.time() - self.ttl_seconds
+            for index in np.argsort(scores)[::-1]:
+                if scores[index] < self.similarity:
+                    break
+                if models[index] == model and created[index] >= min_created_at:
+                    answer, best = answers[index], float(scores[index])
+                    break
+        with self._lock:
+            if answer is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return answer, best
+
+    def store(self, client_id, model, query_text, query_embedding, answer):
+        if not RESPONSE_CACHE_ENABLED:
+            return
+        vector = _normalize(query_embedding)
+        if vector is None or not answer:
+            return
+        entries = self._get(client_id)  # Loaded before the insert, so the new row isn't added twice.
+        if _insert_entry(client_id, model, query_text, vector, answer) is None:
+            return
+        with self._lock:
+            self.stores += 1
+            if self._clients.get(client_id) is entries and (entries.matrix is None or entries.matrix.shape[1] == vector.shape[0]):
+                entries.append(model, vector, answer, int(time.time()), self.max_entries)
+            trim = self.stores % 100 == 0
+        if trim:
+            _delete_entries(client_id, before=time.time() - self.ttl_seconds)
+            _delete_entries(client_id, keep_newest=self.max_entries)
+
+    def invalidate(self, client_id=None):
+        """Drops a client's cached answers (every client's if None, e.g. after global FAQs changed)."""
+        if not RESPONSE_CACHE_ENABLED:
+            return
+        with self._lock:
+            self._generation += 1
+            self.invalidations += 1
+            if client_id is None:
+                self._clients.clear()
+            else:
+                self._clients.pop(client_id, None)
+        deleted = _delete_entries(client_id)
+        if deleted:
+            logger.info(f"Invalidated {deleted} cached responses for client '{client_id if client_id else 'all'}'.")
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": RESPONSE_CACHE_ENABLED,
+                "clients_loaded": len(self._clients),
+                "entries": sum(entries.size for entries in self._clients.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "invalidations": self.invalidations,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+response_cache = ResponseCache()
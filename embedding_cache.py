@@ -0,0 +1,95 @@
+# embedding_cache.py
+# Two-tier cache for query embeddings, keyed by embedding model and normalised text.
+# Tier 1 is an in-process LRU; tier 2 is the `embedding_cache` SQLite table, which survives
+# restarts and is shared by all worker processes. Repeated messages ("hi", "price?") then
+# skip the Gemini embedding round trip entirely.
+
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from config import (
+    LOGGING_LEVEL, log_level_map, EMBEDDING_CACHE_ENABLED, EMBEDDING_CACHE_MEMORY_SIZE,
+    EMBEDDING_CACHE_TTL_SECONDS, EMBEDDING_CACHE_MAX_ROWS, EMBEDDING_CACHE_PRUNE_EVERY
+)
+from db.embedding_cache_crud import get_cached_embedding, put_cached_embedding, prune_embedding_cache
+from utils.text_normalization import normalize_text
+
+logger = logging.getLogger(__name__)
+logger.setLevel(log_level_map.get(LOGGING_LEVEL, logging.INFO))
+
+
+def cache_key(model, text):
+    return hashlib.sha256(f"{model}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+class QueryEmbeddingCache:
+    def __init__(self, memory_size=EMBEDDING_CACHE_MEMORY_SIZE, ttl_seconds=EMBEDDING_CACHE_TTL_SECONDS,
+                 max_rows=EMBEDDING_CACHE_MAX_ROWS, prune_every=EMBEDDING_CACHE_PRUNE_EVERY):
+        self.memory_size = memory_size
+        self.ttl_seconds = ttl_seconds
+        self.max_rows = max_rows
+        self.prune_every = prune_every
+        self._memory = OrderedDict()  # key -> (embedding, created_at)
+        self._lock = threading.Lock()
+        self._puts_since_prune = 0
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    def get(self, model, text):
+        """Returns the cached embedding (float32 array) or None."""
+        key = cache_key(model, text)
+        now = time.time()
+        with self._lock:
+            cached = self._memory.get(key)
+            if cached is not None and now - cached[1] < self.ttl_seconds:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return cached[0]
+            if cached is not None:
+                del self._memory[key]
+
+        embedding = get_cached_embedding(key, min_created_at=now - self.ttl_seconds)
+        with self._lock:
+            if embedding is None:
+                self.misses += 1
+                return None
+            self.db_hits += 1
+            self._remember(key, embedding, now)
+        return embedding
+
+    def put(self, model, text, embedding):
+        key = cache_key(model, text)
+        with self._lock:
+            self._remember(key, embedding, time.time())
+            self._puts_since_prune += 1
+            prune = self._puts_since_prune >= self.prune_every
+            if prune:
+                self._puts_since_prune = 0
+        put_cached_embedding(key, model, embedding)
+        if prune:
+            prune_embedding_cache(self.ttl_seconds, self.max_rows)
+
+    def _remember(self, key, embedding, created_at):
+        self._memory[key] = (embedding, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.memory_hits + self.db_hits + self.misses
+            return {
+                "enabled": EMBEDDING_CACHE_ENABLED,
+                "memory_entries": len(self._memory),
+                "memory_hits": self.memory_hits,
+                "db_hits": self.db_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.db_hits) / lookups if lookups else 0.0,
+            }
+
+
+query_embedding_cache = QueryEmbeddingCache()
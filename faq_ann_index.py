@@ -0,0 +1,172 @@
+# faq_ann_index.py
+# Pure-NumPy inverted-file (IVF) index for approximate nearest-neighbour FAQ search.
+# FAQ vectors are clustered with spherical k-means; a query only scores the FAQs in the
+# `nprobe` clusters whose centroids are closest to it. The index stores just the centroids
+# and each row's cluster, so it sits alongside a client's FaqMatrix (see faq_cache) and is
+# persisted to disk so restarts reuse the trained centroids instead of re-clustering.
+
+import logging
+import os
+import re
+
+import numpy as np
+
+from config import (
+    LOGGING_LEVEL, log_level_map, FAQ_ANN_INDEX_DIR, FAQ_ANN_NLIST,
+    FAQ_ANN_NPROBE, FAQ_ANN_TRAIN_ITERATIONS, FAQ_ANN_RETRAIN_DRIFT
+)
+
+logger = logging.getLogger(__name__)
+logger.setLevel(log_level_map.get(LOGGING_LEVEL, logging.INFO))
+
+# Rows scored per block when assigning vectors to centroids, to bound temporary memory.
+_ASSIGN_BLOCK_ROWS = 4096
+# k-means is trained on at most this many rows per cluster.
+_TRAIN_ROWS_PER_LIST = 256
+
+
+def default_nlist(size):
+    """Number of clusters for a collection of `size` rows (about 4 * sqrt(n))."""
+    if FAQ_ANN_NLIST > 0:
+        return min(FAQ_ANN_NLIST, size)
+    return max(1, min(size, int(4 * np.sqrt(size))))
+
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class IvfIndex:
+    """
+    Centroids plus a cluster assignment for every row of the matching matrix.
+    Rows are referenced by position, so the index must be kept aligned with its matrix.
+    """
+
+    def __init__(self, centroids, assignments):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.assignments = np.asarray(assignments, dtype=np.int32)
+        # Row positions grouped by cluster: cluster c owns order[offsets[c]:offsets[c + 1]].
+        self._order = np.argsort(self.assignments, kind="stable")
+        counts = np.bincount(self.assignments, minlength=self.nlist)
+        self._offsets = np.concatenate(([0], np.cumsum(counts)))
+
+    @property
+    def nlist(self):
+        return self.centroids.shape[0]
+
+    @property
+    def nbytes(self):
+        return self.centroids.nbytes + self.assignments.nbytes + self._order.nbytes + self._offsets.nbytes
+
+    @classmethod
+    def train(cls, matrix, nlist=None, iterations=FAQ_ANN_TRAIN_ITERATIONS, seed=0):
+        """Clusters unit-length rows with spherical k-means and assigns every row."""
+        size = matrix.shape[0]
+        nlist = min(nlist or default_nlist(size), size)
+        rng = np.random.default_rng(seed)
+        sample_size = min(size, nlist * _TRAIN_ROWS_PER_LIST)
+        sample = matrix[rng.choice(size, sample_size, replace=False)] if sample_size < size else matrix
+        centroids = sample[rng.choice(sample.shape[0], nlist, replace=False)].copy()
+        for _ in range(iterations):
+            labels = _assign(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            counts = np.bincount(labels, minlength=nlist)
+            empty = counts == 0
+            if empty.any():
+                # Re-seed empty clusters with random sample rows.
+                sums[empty] = sample[rng.choice(sample.shape[0], int(empty.sum()), replace=False)]
+            centroids = _normalize_rows(sums)
+        return cls(centroids, _assign(matrix, centroids))
+
+    def assign(self, vectors):
+        """Returns the nearest cluster for each row of `vectors`."""
+        return _assign(np.atleast_2d(vectors), self.centroids)
+
+    def search(self, matrix, query_vec, top_k=1, nprobe=FAQ_ANN_NPROBE):
+        """
+        Scores only the rows in the `nprobe` closest clusters.
+        Returns (row_positions, scores), best first. Larger nprobe trades latency for recall.
+        """
+        nprobe = max(1, min(nprobe, self.nlist))
+        centroid_scores = self.centroids @ query_vec
+        probe = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe] if nprobe < self.nlist else range(self.nlist)
+        rows = np.concatenate([self._order[self._offsets[c]:self._offsets[c + 1]] for c in probe])
+        if not rows.size:
+            return rows, np.empty(0, dtype=np.float32)
+        scores = matrix[rows] @ query_vec
+        top_k = min(top_k, rows.size)
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        best = best[np.argsort(-scores[best])]
+        return rows[best], scores[best]
+
+    def appended(self, vector):
+        """Returns an index with one more row, assigned to its nearest cluster."""
+        return IvfIndex(self.centroids, np.append(self.assignments, self.assign(vector)))
+
+    def subset(self, keep):
+        """Returns an index for the rows selected by the boolean mask `keep`."""
+        return IvfIndex(self.centroids, self.assignments[keep])
+
+
+def _assign(vectors, centroids):
+    labels = np.empty(vectors.shape[0], dtype=np.int32)
+    for start in range(0, vectors.shape[0], _ASSIGN_BLOCK_ROWS):
+        block = vectors[start:start + _ASSIGN_BLOCK_ROWS]
+        labels[start:start + block.shape[0]] = np.argmax(block @ centroids.T, axis=1)
+    return labels
+
+
+def index_path(client_id):
+    """File holding the persisted index for a client (None is the global index)."""
+    name = re.sub(r"[^A-Za-z0-9_.-]", "_", client_id) if client_id else "_global"
+    return os.path.join(FAQ_ANN_INDEX_DIR, f"{name}.npz")
+
+
+def save_index(client_id, index, ids):
+    """Writes centroids and per-FAQ-id assignments atomically."""
+    try:
+        os.makedirs(FAQ_ANN_INDEX_DIR, exist_ok=True)
+        path = index_path(client_id)
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, centroids=index.centroids, ids=np.asarray(ids, dtype=np.int64),
+                 assignments=index.assignments)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.error(f"Could not persist FAQ index for client '{client_id}': {e}", exc_info=True)
+
+
+def load_or_build_index(client_id, matrix, ids):
+    """
+    Returns an IvfIndex aligned with (matrix, ids).
+    A persisted index is reused when its dimension matches: FAQs it already knows keep
+    their cluster, new FAQs are assigned to the nearest centroid, and deleted FAQs drop
+    out. It is retrained when more than FAQ_ANN_RETRAIN_DRIFT of the rows are new.
+    """
+    path = index_path(client_id)
+    if os.path.exists(path):
+        try:
+            with np.load(path) as saved:
+                centroids, saved_ids, saved_assignments = saved["centroids"], saved["ids"], saved["assignments"]
+            if centroids.shape[1] == matrix.shape[1]:
+                known = dict(zip(saved_ids.tolist(), saved_assignments.tolist()))
+                assignments = np.array([known.get(int(i), -1) for i in ids], dtype=np.int32)
+                new_rows = assignments < 0
+                if new_rows.mean() <= FAQ_ANN_RETRAIN_DRIFT:
+                    if new_rows.any():
+                        assignments[new_rows] = _assign(matrix[new_rows], centroids)
+                    index = IvfIndex(centroids, assignments)
+                    if new_rows.any() or len(known) != len(ids):
+                        save_index(client_id, index, ids)
+                    logger.info(f"Loaded FAQ index for client '{client_id}' from disk ({index.nlist} lists, {int(new_rows.sum())} new rows).")
+                    return index
+            logger.info(f"Persisted FAQ index for client '{client_id}' is stale. Retraining.")
+        except (OSError, KeyError, ValueError) as e:
+            logger.warning(f"Could not load FAQ index for client '{client_id}': {e}. Retraining.")
+
+    index = IvfIndex.train(matrix)
+    save_index(client_id, index, ids)
+    logger.info(f"Trained FAQ index for client '{client_id}': {matrix.shape[0]} rows, {index.nlist} lists.")
+    return index
@@ -0,0 +1,279 @@
+# faq_cache.py
+# In-memory, per-client FAQ embedding matrices used for similarity search.
+# Each client's active FAQs are held as one pre-normalised, contiguous float32 matrix with an
+# id/answer side-table, so scoring a query is a single matrix-vector product.
+# Clients with at least FAQ_ANN_MIN_SIZE FAQs also get an IVF index (see faq_ann_index)
+# and are searched approximately; smaller clients are always searched exactly.
+# Writes made in this process patch the cached matrices directly. Each entry also remembers the
+# faq_versions counter it was loaded at and is reloaded when the counter moves on, checked at
+# most every FAQ_CACHE_VERSION_CHECK_SECONDS, so writes by other processes are picked up too.
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from config import (
+    LOGGING_LEVEL, log_level_map, FAQ_CACHE_MAX_BYTES, FAQ_ANN_MIN_SIZE, FAQ_CACHE_VERSION_CHECK_SECONDS
+)
+from db.faqs_crud import get_faq_embedding_matrix
+from db.faq_versions_crud import get_faq_version
+from faq_ann_index import load_or_build_index, save_index
+
+logger = logging.getLogger(__name__)
+logger.setLevel(log_level_map.get(LOGGING_LEVEL, logging.INFO))
+
+# Fields kept in the side-table; embeddings live only in the matrix.
+_FAQ_FIELDS = ("id", "question", "answer", "client_id")
+
+
+def normalize_vector(vector):
+    """Returns the vector as a unit-length float32 array, or None if it has no length."""
+    vec = np.asarray(vector, dtype=np.float32).ravel()
+    norm = np.linalg.norm(vec)
+    if not norm or not np.isfinite(norm):
+        return None
+    return vec / norm
+
+
+class FaqMatrix:
+    """A client's FAQs: an (n, d) unit-row matrix plus the FAQ rows in the same order."""
+
+    def __init__(self, matrix, faqs, index=None):
+        self.matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        self.faqs = faqs
+        self.ids = np.array([faq["id"] for faq in faqs], dtype=np.int64)
+        self.index = index
+
+    @classmethod
+    def from_rows(cls, faqs, matrix):
+        """Builds from get_faq_embedding_matrix output, normalising rows in place."""
+        if len(faqs):
+            norms = np.linalg.norm(matrix, axis=1)
+            keep = (norms > 0) & np.isfinite(norms)
+            if not keep.all():
+                logger.warning(f"Skipping {int((~keep).sum())} FAQs with zero-length embeddings.")
+                matrix, norms = matrix[keep], norms[keep]
+                faqs = [faq for faq, k in zip(faqs, keep) if k]
+            matrix /= norms[:, np.newaxis]
+        return cls(matrix, faqs)
+
+    @property
+    def size(self):
+        return len(self.faqs)
+
+    @property
+    def dim(self):
+        return self.matrix.shape[1] if self.size else 0
+
+    @property
+    def nbytes(self):
+        # Matrix plus a rough allowance for the text side-table.
+        text_bytes = sum(len(f.get("question") or "") + len(f.get("answer") or "") for f in self.faqs)
+        index_bytes = self.index.nbytes if self.index is not None else 0
+        return self.matrix.nbytes + self.ids.nbytes + index_bytes + text_bytes
+
+    @property
+    def approximate(self):
+        """True when searches go through the IVF index rather than a full scan."""
+        return self.index is not None and self.size >= FAQ_ANN_MIN_SIZE
+
+    def search(self, query_vec, top_k=1):
+        """Returns up to top_k (faq, score) pairs for a unit-length query, best first."""
+        if not self.size or query_vec is None or query_vec.shape[0] != self.dim:
+            return []
+        if self.approximate:
+            rows, scores = self.index.search(self.matrix, query_vec, top_k)
+            return [(self.faqs[i], float(score)) for i, score in zip(rows, scores)]
+        scores = self.matrix @ query_vec
+        top_k = min(top_k, self.size)
+        if top_k == 1:
+            best = [int(np.argmax(scores))]
+        else:
+            best = np.argpartition(-scores, top_k - 1)[:top_k]
+            best = best[np.argsort(-scores[best])]
+        return [(self.faqs[i], float(scores[i])) for i in best]
+
+    def upserted(self, faq):
+        """Returns a copy with the FAQ added or replaced, or None if it can't be patched in."""
+        vec = normalize_vector(faq["embedding"]) if faq.get("embedding") is not None else None
+        if vec is None or (self.size and vec.shape[0] != self.dim):
+            return None
+        remaining = self.removed(faq["id"])
+        row = {field: faq.get(field) for field in _FAQ_FIELDS}
+        matrix = np.vstack([remaining.matrix, vec]) if remaining.size else vec[np.newaxis, :]
+        index = remaining.index.appended(vec) if remaining.index is not None else None
+        return FaqMatrix(matrix, remaining.faqs + [row], index)
+
+    def removed(self, faq_id):
+        """Returns a copy without the given FAQ id."""
+        keep = self.ids != int(faq_id)
+        if keep.all():
+            return self
+        faqs = [faq for faq, k in zip(self.faqs, keep) if k]
+        index = self.index.subset(keep) if self.index is not None else None
+        return FaqMatrix(self.matrix[keep], faqs, index)
+
+
+class FaqEmbeddingCache:
+    """
+    LRU of per-client FaqMatrix objects bounded by a memory budget.
+    The key None holds every active FAQ and backs the global fallback.
+    """
+
+    def __init__(self, loader=get_faq_embedding_matrix, max_bytes=FAQ_CACHE_MAX_BYTES,
+                 version_loader=get_faq_version, version_check_seconds=FAQ_CACHE_VERSION_CHECK_SECONDS):
+        self.loader = loader
+        self.max_bytes = max_bytes
+        self.version_loader = version_loader
+        self.version_check_seconds = version_check_seconds
+        self._entries = OrderedDict()
+        self._versions = {}  # client_id -> (faq_versions counter the entry matches, monotonic time last checked)
+        self._generations = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stale_reloads = 0
+
+    def get(self, client_id):
+        with self._lock:
+            entry = self._entries.get(client_id)
+            version, checked_at = self._versions.get(client_id, (None, 0.0))
+        if entry is not None and time.monotonic() - checked_at >= self.version_check_seconds:
+            entry = self._check_version(client_id, entry, version)
+
+        with self._lock:
+            if entry is not None:
+                if client_id in self._entries:
+                    self._entries.move_to_end(client_id)
+                self.hits += 1
+                return entry
+            self.misses += 1
+            generation = self._generations.get(client_id, 0)
+
+        # Read the version first: a write landing during the load leaves the entry behind it.
+        version = self.version_loader(client_id)
+        entry = FaqMatrix.from_rows(*self.loader(client_id))
+        if entry.size >= FAQ_ANN_MIN_SIZE:
+            entry.index = load_or_build_index(client_id, entry.matrix, entry.ids)
+        logger.debug(f"Loaded FAQ matrix for client '{client_id}': {entry.size} rows, {entry.nbytes} bytes.")
+
+        with self._lock:
+            # Don't cache a load that raced with an invalidation or patch.
+            if self._generations.get(client_id, 0) == generation:
+                self._entries[client_id] = entry
+                self._entries.move_to_end(client_id)
+                self._versions[client_id] = (version, time.monotonic())
+                self._evict()
+        return entry
+
+    def _check_version(self, client_id, entry, version):
+        """Returns the entry if faq_versions still matches it, or None after dropping it."""
+        current = self.version_loader(client_id)
+        with self._lock:
+            if self._entries.get(client_id) is not entry:
+                return entry  # Patched or dropped meanwhile; checked again on a later lookup.
+            if current is not None and current != version:
+                logger.info(f"FAQs for client '{client_id}' changed in another process: reloading the FAQ matrix.")
+                self._bump(client_id)
+                self._entries.pop(client_id)
+                self._versions.pop(client_id, None)
+                self.stale_reloads += 1
+                return None
+            self._versions[client_id] = (version, time.monotonic())
+            return entry
+
+    def _evict(self):
+        total = sum(e.nbytes for e in self._entries.values())
+        while total > self.max_bytes and len(self._entries) > 1:
+            client_id, entry = self._entries.popitem(last=False)
+            self._versions.pop(client_id, None)
+            total -= entry.nbytes
+            self.evictions += 1
+            logger.info(f"Evicted FAQ matrix for client '{client_id}' ({entry.nbytes} bytes) from cache.")
+
+    def search(self, client_id, query_embedding, top_k=1):
+        """Returns up to top_k (faq, score) pairs for the client, best first."""
+        return self.get(client_id).search(normalize_vector(query_embedding), top_k)
+
+    def _bump(self, client_id):
+        self._generations[client_id] = self._generations.get(client_id, 0) + 1
+
+    def invalidate(self, client_id=None):
+        """Drops the cached matrix for a client, or for every client if client_id is None."""
+        with self._lock:
+            if client_id is None:
+                for key in list(self._entries) + list(self._generations):
+                    self._bump(key)
+                self._entries.clear()
+                self._versions.clear()
+                return
+            self._bump(client_id)
+            self._drop(client_id)
+            # The global entry contains every client's FAQs.
+            self._bump(None)
+            self._drop(None)
+
+    def _drop(self, client_id):
+        self._entries.pop(client_id, None)
+        self._versions.pop(client_id, None)
+
+    def _patched(self, client_id, entry):
+        """
+        Stores a patched entry. The write behind the patch bumped faq_versions by one, so the
+        entry stays current unless another process has written too.
+        """
+        self._entries[client_id] = entry
+        version, checked_at = self._versions.get(client_id, (None, 0.0))
+        self._versions[client_id] = (version + 1 if version is not None else None, checked_at)
+
+    def upsert(self, client_id, faq):
+        """Patches an added or updated FAQ (with 'embedding') into a cached matrix."""
+        with self._lock:
+            entry = self._entries.get(client_id)
+            patched = entry.upserted(faq) if entry is not None else None
+            self._bump(None)
+            self._drop(None)
+            self._bump(client_id)
+            if patched is None or (patched.index is None and patched.size >= FAQ_ANN_MIN_SIZE):
+                # Can't patch, or the client just grew past the ANN threshold: rebuild on next use.
+                self._drop(client_id)
+                return
+            self._patched(client_id, patched)
+            self._evict()
+        if patched.index is not None:
+            save_index(client_id, patched.index, patched.ids)
+
+    def remove(self, client_id, faq_id):
+        """Removes a deleted FAQ from a cached matrix."""
+        with self._lock:
+            entry = self._entries.get(client_id)
+            self._bump(None)
+            self._drop(None)
+            self._bump(client_id)
+            if entry is None:
+                return
+            patched = entry.removed(faq_id)
+            self._patched(client_id, patched)
+        if patched.index is not None and patched is not entry:
+            save_index(client_id, patched.index, patched.ids)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "clients": len(self._entries),
+                "rows": sum(e.size for e in self._entries.values()),
+                "approximate_clients": sum(1 for e in self._entries.values() if e.approximate),
+                "bytes": sum(e.nbytes for e in self._entries.values()),
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "stale_reloads": self.stale_reloads,
+            }
+
+
+faq_cache = FaqEmbeddingCache()
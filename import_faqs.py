@@ -0,0 +1,206 @@
+# import_faqs.py
+# Streaming bulk FAQ import from CSV or JSONL.
+#
+# The file is read row by row (constant memory), rows whose normalised question already exists
+# for the client are skipped, embeddings are generated in batches, and rows are inserted with
+# executemany in chunked transactions. Each chunk commit also advances the job's checkpoint in
+# `faq_import_jobs`, so an interrupted import can be resumed where it stopped. If some rows can't
+# be embedded, the checkpoint stops just before the first of them and the job fails, so resuming
+# retries them.
+#
+# CSV files need `question` and `answer` columns; JSONL lines need "question" and "answer" keys.
+#
+# Usage:
+#   python import_faqs.py faqs.csv --client-id client_one
+#   python import_faqs.py --resume <job_id>
+
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+import threading
+
+from config import LOGGING_LEVEL, log_level_map, FAQ_IMPORT_CHUNK_SIZE
+from db.faq_import_crud import create_import_job, get_import_job, set_import_job_status, commit_import_chunk
+from db.faqs_crud import get_faq_questions
+from utils.text_normalization import normalize_text
+
+logger = logging.getLogger(__name__)
+logger.setLevel(log_level_map.get(LOGGING_LEVEL, logging.INFO))
+
+SUPPORTED_FORMATS = ("csv", "jsonl")
+
+
+def detect_format(path):
+    extension = os.path.splitext(path)[1].lower().lstrip(".")
+    return "jsonl" if extension in ("jsonl", "ndjson", "json") else "csv"
+
+
+def iter_faq_rows(path, file_format):
+    """Yields (question, answer) per data row; malformed rows yield (None, None)."""
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        if file_format == "csv":
+            reader = csv.DictReader(f)
+            for row in reader:
+                row = {(k or "").strip().lower(): (v or "").strip() for k, v in row.items()}
+                yield row.get("question") or None, row.get("answer") or None
+        else:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                    yield (str(row.get("question") or "").strip() or None,
+                           str(row.get("answer") or "").strip() or None)
+                except (ValueError, AttributeError):
+                    yield None, None
+
+
+def run_import(job_id, chunk_size=FAQ_IMPORT_CHUNK_SIZE, progress=None):
+    """
+    Runs (or resumes) an import job to completion and returns its final status row.
+    `progress`, if given, is called with the job row after every committed chunk.
+    """
+    # Imported here so the module can be loaded without initialising the Gemini client.
+    from ai_utils import generate_embeddings, faq_embedding_text
+    from faq_cache import faq_cache
+
+    job = get_import_job(job_id)
+    if not job:
+        raise ValueError(f"Unknown FAQ import job: {job_id}")
+    if job["status"] == "completed":
+        return job
+
+    client_id = job["client_id"]
+    resume_from = job["rows_read"]
+    set_import_job_status(job_id, "running")
+    logger.info(f"Importing FAQs for client '{client_id}' from {job['source_path']} (job {job_id}, resuming at row {resume_from}).")
+
+    # Hashes of normalised questions keep the dedupe set small even for large knowledge bases.
+    # Only questions that are in the database go in `seen`; the current chunk's are in chunk_keys.
+    seen = {hash(normalize_text(q)) for q in get_faq_questions(client_id)}
+
+    def flush(chunk, skipped, rows_read):
+        """
+        Commits `chunk` ((row, question, answer, key) tuples) and the `skipped` (row, reason)
+        counts, checkpointing at rows_read, or just before the first row that couldn't be embedded.
+        """
+        embeddings = generate_embeddings(faq_embedding_text(q, a) for _, q, a, _ in chunk)
+        unembedded = [row for (row, *_), e in zip(chunk, embeddings) if e is None]
+        checkpoint = unembedded[0] - 1 if unembedded else rows_read
+        committed = [(item, e) for item, e in zip(chunk, embeddings) if item[0] <= checkpoint]
+        duplicates = sum(1 for row, reason in skipped if row <= checkpoint and reason == "duplicate")
+        failed = sum(1 for row, reason in skipped if row <= checkpoint and reason == "invalid")
+        if not commit_import_chunk(job_id, client_id, [(q, a, e) for (_, q, a, _), e in committed],
+                                   checkpoint, duplicates, failed):
+            raise RuntimeError(f"Could not commit rows up to {checkpoint}")
+        seen.update(key for (_, _, _, key), _ in committed)
+        if progress:
+            progress(get_import_job(job_id))
+        if unembedded:
+            raise RuntimeError(f"Could not embed {len(unembedded)} of {len(chunk)} FAQs (first at row {unembedded[0]}); "
+                               f"resume the import to retry from there.")
+
+    try:
+        chunk, chunk_keys, skipped, rows_read = [], set(), [], 0
+        for rows_read, (question, answer) in enumerate(iter_faq_rows(job["source_path"], job["file_format"]), start=1):
+            if rows_read <= resume_from:
+                continue
+            if not question or not answer:
+                logger.warning(f"Import job {job_id}: row {rows_read} has no question or answer. Skipping.")
+                skipped.append((rows_read, "invalid"))
+            else:
+                key = hash(normalize_text(question))
+                if key in seen or key in chunk_keys:
+                    skipped.append((rows_read, "duplicate"))
+                else:
+                    chunk_keys.add(key)
+                    chunk.append((rows_read, question, answer, key))
+            if len(chunk) >= chunk_size:
+                flush(chunk, skipped, rows_read)
+                chunk, chunk_keys, skipped = [], set(), []
+        if rows_read > resume_from:
+            flush(chunk, skipped, rows_read)
+        set_import_job_status(job_id, "completed")
+    except Exception as e:
+        logger.error(f"FAQ import job {job_id} failed: {e}", exc_info=True)
+        set_import_job_status(job_id, "failed", str(e))
+    finally:
+        faq_cache.invalidate(client_id)
+
+    job = get_import_job(job_id)
+    logger.info(f"FAQ import job {job_id} {job['status']}: {job['inserted']} inserted, "
+                f"{job['duplicates']} duplicates, {job['failed']} failed, {job['rows_read']} rows read.")
+    return job
+
+
+def start_import(client_id, path, file_format=None, background=False, remove_when_done=False):
+    """
+    Creates an import job for a file and runs it, in a background thread if requested. Returns the job_id.
+    With remove_when_done the file is deleted once the job completes or fails (e.g. an upload).
+    """
+    file_format = file_format or detect_format(path)
+    if file_format not in SUPPORTED_FORMATS:
+        raise ValueError(f"Unsupported FAQ import format: {file_format}")
+    job_id = create_import_job(client_id, os.path.abspath(path), file_format)
+    if not job_id:
+        return None
+
+    def run():
+        try:
+            run_import(job_id)
+        finally:
+            if remove_when_done:
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    logger.warning(f"Could not remove FAQ import file {path}: {e}")
+
+    if background:
+        threading.Thread(target=run, name=f"faq-import-{job_id[:8]}", daemon=True).start()
+    else:
+        run()
+    return job_id
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import FAQs from a CSV or JSONL file.")
+    parser.add_argument("path", nargs="?", help="CSV or JSONL file to import")
+    parser.add_argument("--client-id", help="Client the FAQs belong to")
+    parser.add_argument("--format", choices=SUPPORTED_FORMATS, help="File format (default: from extension)")
+    parser.add_argument("--resume", metavar="JOB_ID", help="Resume an interrupted import job")
+    parser.add_argument("--chunk-size", type=int, default=FAQ_IMPORT_CHUNK_SIZE, help="Rows per transaction")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=log_level_map.get(LOGGING_LEVEL, logging.INFO),
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+    import google.generativeai as genai
+    from config import GEMINI_API_KEY
+    from db.db_connection import init_db
+    genai.configure(api_key=GEMINI_API_KEY)
+    init_db()
+
+    def report(job):
+        print(f"[{job['job_id']}] rows read: {job['rows_read']}, inserted: {job['inserted']}, "
+              f"duplicates: {job['duplicates']}, failed: {job['failed']}", flush=True)
+
+    if args.resume:
+        job_id = args.resume
+    elif args.path and args.client_id:
+        job_id = create_import_job(args.client_id, os.path.abspath(args.path), args.format or detect_format(args.path))
+        if not job_id:
+            return 1
+        print(f"Started import job {job_id}", flush=True)
+    else:
+        parser.error("either PATH and --client-id, or --resume JOB_ID, is required")
+
+    job = run_import(job_id, chunk_size=args.chunk_size, progress=report)
+    report(job)
+    print(f"Import {job['status']}." + (f" Error: {job['error']}" if job["error"] else ""))
+    return 0 if job["status"] == "completed" else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
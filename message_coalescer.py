@@ -0,0 +1,166 @@
+# message_coalescer.py
+# Debounce window for rapid consecutive text messages from the same sender.
+# People often split one request over several messages ("hi" / "I need help" / "with my order").
+# The first message opens a batch for its sender; messages arriving within the window join it
+# and push the deadline back, up to a maximum wait or message count. The batch is then handed
+# to `on_flush` once, so the AI is called once for the whole batch instead of per message.
+
+import atexit
+import logging
+import threading
+import time
+
+from config import (
+    LOGGING_LEVEL, log_level_map, MESSAGE_COALESCE_MAX_WAIT_MS, MESSAGE_COALESCE_MAX_MESSAGES
+)
+
+logger = logging.getLogger(__name__)
+logger.setLevel(log_level_map.get(LOGGING_LEVEL, logging.INFO))
+
+
+class _Batch:
+    __slots__ = ("messages", "client_id", "client_config", "window", "opened_at", "deadline")
+
+    def __init__(self, client_id, client_config, window, now):
+        self.messages = []
+        self.client_id = client_id
+        self.client_config = client_config
+        self.window = window
+        self.opened_at = now
+        self.deadline = now + window
+
+
+def merge_messages(messages):
+    """Combines a batch of text messages into one, keeping the first message's id and metadata."""
+    if len(messages) == 1:
+        return messages[0]
+    merged = dict(messages[0])
+    merged["text"] = {"body": "\n".join(m["text"]["body"] for m in messages)}
+    merged["coalesced_ids"] = [m.get("id") for m in messages]
+    return merged
+
+
+class MessageCoalescer:
+    """
+    on_flush(key, batch) is called from the coalescer thread with the closed batch
+    (batch.messages in arrival order, batch.client_id, batch.client_config).
+    """
+
+    def __init__(self, on_flush, max_wait_ms=MESSAGE_COALESCE_MAX_WAIT_MS,
+                 max_messages=MESSAGE_COALESCE_MAX_MESSAGES):
+        self.on_flush = on_flush
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_messages = max(1, max_messages)
+        self._batches = {}
+        self._cond = threading.Condition()
+        # Held from closing batches until they are emitted, so flush() returns only once any
+        # batch of the sender closed by the timer has been handed to on_flush.
+        self._emit_lock = threading.Lock()
+        self._thread = None
+        self.batches = 0
+        self.messages = 0
+
+    def start(self):
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="message-coalescer", daemon=True)
+            self._thread.start()
+
+    def join(self, key, message):
+        """Adds `message` to the sender's open batch. Returns False if there is none."""
+        return self._add(key, message, None, None, None)
+
+    def add(self, key, message, client_id, client_config, window_seconds):
+        """Adds `message` to the sender's open batch, opening one with the given window if needed."""
+        self._add(key, message, client_id, client_config, window_seconds)
+
+    def _add(self, key, message, client_id, client_config, window):
+        if self._thread is None:
+            self.start()
+        now = time.monotonic()
+        with self._cond:
+            batch = self._batches.get(key)
+            if batch is None:
+                if window is None:
+                    return False
+                batch = self._batches[key] = _Batch(client_id, client_config, window, now)
+            batch.messages.append(message)
+            self.messages += 1
+            # Each message extends the window, but never past max_wait from the first one.
+            batch.deadline = min(now + batch.window, batch.opened_at + self.max_wait)
+            if len(batch.messages) >= self.max_messages:
+                batch.deadline = now
+            self._cond.notify()
+        return True
+
+    def has_pending(self, key):
+        with self._cond:
+            return key in self._batches
+
+    def flush(self, key=None):
+        """
+        Closes the sender's batch (or every batch) now, e.g. before a non-text message from them.
+        Returns the number of batches closed; on return every closed batch has been handed to on_flush.
+        """
+        with self._emit_lock:
+            with self._cond:
+                keys = [key] if key is not None else list(self._batches)
+                closed = [(k, self._batches.pop(k)) for k in keys if k in self._batches]
+                self.batches += len(closed)
+            for k, batch in closed:
+                self._emit(k, batch)
+        return len(closed)
+
+    def _emit(self, key, batch):
+        try:
+            self.on_flush(key, batch)
+        except Exception as e:
+            logger.error(f"Error flushing coalesced messages for {key}: {e}", exc_info=True)
+
+    def _run(self):
+        while True:
+            with self._emit_lock:
+                with self._cond:
+                    now = time.monotonic()
+                    due = [k for k, b in self._batches.items() if b.deadline <= now]
+                    closed = [(k, self._batches.pop(k)) for k in due]
+                    self.batches += len(closed)
+                for key, batch in closed:
+                    self._emit(key, batch)
+            if closed:
+                continue
+            with self._cond:
+                now = time.monotonic()
+                next_deadline = min((b.deadline for b in self._batches.values()), default=None)
+                if next_deadline is None or next_deadline > now:
+                    self._cond.wait(None if next_deadline is None else next_deadline - now)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "pending_batches": len(self._batches),
+                "pending_messages": sum(len(b.messages) for b in self._batches.values()),
+                "batches": self.batches,
+                "messages": self.messages,
+                # Messages answered as part of another message's batch: AI calls not made.
+                "saved_ai_calls": max(0, self.messages - self.batches - sum(len(b.messages) for b in self._batches.values())),
+            }
+
+
+_coalescers = []
+
+
+def _flush_coalescers():
+    for coalescer in _coalescers:
+        coalescer.flush()
+
+
+def create_coalescer(on_flush, **kwargs):
+    """Creates a coalescer whose open batches are flushed when the process exits."""
+    coalescer = MessageCoalescer(on_flush, **kwargs)
+    _coalescers.append(coalescer)
+    return coalescer
+
+
+atexit.register(_flush_coalescers)
@@ -0,0 +1,103 @@
+# message_dedup.py
+# Idempotency store for inbound WhatsApp messages, keyed by message["id"].
+# Meta redelivers a webhook whenever it is not acknowledged quickly, so the same message can
+# arrive two or three times. Tier 1 is a bounded in-process LRU of recently seen ids; tier 2 is
+# the `processed_messages` SQLite table, which survives restarts and is shared by all worker
+# processes. The first delivery claims the id; redeliveries are acknowledged without any AI work.
+# A claim is released if the message then fails or can't be queued, so Meta's redelivery is processed.
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from config import (
+    LOGGING_LEVEL, log_level_map, MESSAGE_DEDUP_ENABLED, MESSAGE_DEDUP_MEMORY_SIZE,
+    MESSAGE_DEDUP_TTL_SECONDS, MESSAGE_DEDUP_PRUNE_EVERY
+)
+from db.processed_messages_crud import claim_message_id, prune_processed_messages, release_message_id
+
+logger = logging.getLogger(__name__)
+logger.setLevel(log_level_map.get(LOGGING_LEVEL, logging.INFO))
+
+
+class MessageDeduplicator:
+    def __init__(self, memory_size=MESSAGE_DEDUP_MEMORY_SIZE, ttl_seconds=MESSAGE_DEDUP_TTL_SECONDS,
+                 prune_every=MESSAGE_DEDUP_PRUNE_EVERY):
+        self.memory_size = memory_size
+        self.ttl_seconds = ttl_seconds
+        self.prune_every = prune_every
+        self._memory = OrderedDict()  # message_id -> first seen at
+        self._lock = threading.Lock()
+        self._claims_since_prune = 0
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.claimed = 0
+        self.released = 0
+        self.errors = 0
+
+    def claim(self, message_id, client_id=None):
+        """
+        Returns True if this is the first delivery of `message_id` (the caller should process it),
+        False if it is a duplicate. Ids that can't be checked (no id, DB error) count as new.
+        """
+        if not MESSAGE_DEDUP_ENABLED or not message_id:
+            return True
+        now = time.time()
+        with self._lock:
+            seen_at = self._memory.get(message_id)
+            if seen_at is not None and now - seen_at < self.ttl_seconds:
+                self._memory.move_to_end(message_id)
+                self.memory_hits += 1
+                return False
+
+        claimed = claim_message_id(message_id, client_id, self.ttl_seconds)
+        with self._lock:
+            if claimed is None:
+                # Better to risk a duplicate reply than to drop a customer's message.
+                self.errors += 1
+                return True
+            self._remember(message_id, now)
+            if not claimed:
+                self.db_hits += 1
+                return False
+            self.claimed += 1
+            self._claims_since_prune += 1
+            prune = self._claims_since_prune >= self.prune_every
+            if prune:
+                self._claims_since_prune = 0
+        if prune:
+            prune_processed_messages(self.ttl_seconds)
+        return True
+
+    def release(self, message_id):
+        """Undoes a claim after the message failed, so its next delivery is processed."""
+        if not MESSAGE_DEDUP_ENABLED or not message_id:
+            return
+        with self._lock:
+            self._memory.pop(message_id, None)
+            self.released += 1
+        release_message_id(message_id)
+        logger.info(f"Released claim on message {message_id}; a redelivery will be processed.")
+
+    def _remember(self, message_id, seen_at):
+        self._memory[message_id] = seen_at
+        self._memory.move_to_end(message_id)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": MESSAGE_DEDUP_ENABLED,
+                "memory_entries": len(self._memory),
+                "claimed": self.claimed,
+                "duplicates": self.memory_hits + self.db_hits,
+                "memory_hits": self.memory_hits,
+                "db_hits": self.db_hits,
+                "released": self.released,
+                "errors": self.errors,
+            }
+
+
+message_deduplicator = MessageDeduplicator()
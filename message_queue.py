@@ -0,0 +1,174 @@
+# message_queue.py
+# Keyed worker pool used by the webhook to process inbound messages off the request thread.
+# Every key (a WhatsApp ID) is pinned to one worker, so messages from the same sender are
+# handled in arrival order while different senders are processed in parallel.
+
+import atexit
+import logging
+import queue
+import threading
+import time
+import zlib
+
+from config import LOGGING_LEVEL, log_level_map
+
+logger = logging.getLogger(__name__)
+logger.setLevel(log_level_map.get(LOGGING_LEVEL, logging.INFO))
+
+_STOP = object()
+
+
+class KeyedWorkerPool:
+    """
+    A fixed pool of worker threads, each draining its own FIFO queue.
+    Items are routed to a worker by a stable hash of their key.
+    """
+
+    def __init__(self, handler, num_workers=4, maxsize=0, name="worker"):
+        self.handler = handler
+        self.num_workers = max(1, int(num_workers))
+        self.name = name
+        self._queues = [queue.Queue(maxsize=maxsize) for _ in range(self.num_workers)]
+        self._threads = []
+        self._lock = threading.Lock()
+        self._aborting = False
+        self._busy = [False] * self.num_workers
+        self._busy_seconds = [0.0] * self.num_workers
+        self._started_at = None
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            self._aborting = False
+            self._started_at = time.monotonic()
+            for index in range(self.num_workers):
+                thread = threading.Thread(
+                    target=self._run, args=(index,), name=f"{self.name}-{index}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+        logger.info(f"Started worker pool '{self.name}' with {self.num_workers} workers.")
+
+    def _worker_index(self, key):
+        return zlib.crc32(str(key).encode("utf-8")) % self.num_workers
+
+    def submit(self, key, item, timeout=None):
+        """
+        Enqueues an item for the worker owning `key`.
+        Returns False if the worker's queue stayed full for `timeout` seconds.
+        """
+        if not self._threads:
+            self.start()
+        try:
+            self._queues[self._worker_index(key)].put(item, timeout=timeout)
+        except queue.Full:
+            with self._lock:
+                self._rejected += 1
+            logger.error(f"Worker pool '{self.name}' queue full. Rejected item for key {key}.")
+            return False
+        with self._lock:
+            self._submitted += 1
+        return True
+
+    def _run(self, index):
+        work_queue = self._queues[index]
+        while True:
+            item = work_queue.get()
+            if item is _STOP or self._aborting:
+                work_queue.task_done()
+                return
+            started = time.monotonic()
+            with self._lock:
+                self._busy[index] = True
+            try:
+                self.handler(item)
+                with self._lock:
+                    self._completed += 1
+            except Exception as e:
+                logger.error(f"Worker {self.name}-{index} failed to process item: {e}", exc_info=True)
+                with self._lock:
+                    self._failed += 1
+            finally:
+                with self._lock:
+                    self._busy[index] = False
+                    self._busy_seconds[index] += time.monotonic() - started
+                work_queue.task_done()
+
+    def join(self):
+        """Blocks until every queued item has been processed."""
+        for work_queue in self._queues:
+            work_queue.join()
+
+    def shutdown(self, timeout=5.0):
+        """
+        Lets the workers finish queued items for up to `timeout` seconds, then stops them.
+        Items still queued after that are dropped, so a full queue can't hang process exit.
+        """
+        with self._lock:
+            threads, self._threads = self._threads, []
+        if not threads:
+            return
+        deadline = time.monotonic() + timeout
+        for work_queue in self._queues:
+            try:
+                work_queue.put(_STOP, timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Full:
+                pass  # Still full at the deadline: the worker is stopped through _aborting below.
+        for thread in threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        if not any(thread.is_alive() for thread in threads):
+            logger.info(f"Worker pool '{self.name}' stopped.")
+            return
+        # Workers check _aborting before each item; the extra _STOP wakes any blocked on an empty queue.
+        self._aborting = True
+        dropped = sum(work_queue.qsize() for work_queue in self._queues)
+        for work_queue in self._queues:
+            try:
+                work_queue.put_nowait(_STOP)
+            except queue.Full:
+                pass
+        logger.warning(f"Worker pool '{self.name}' did not drain within {timeout}s; dropping {dropped} queued items.")
+
+    def stats(self):
+        """Returns queue depth and worker utilisation figures."""
+        with self._lock:
+            uptime = time.monotonic() - self._started_at if self._started_at else 0.0
+            busy_workers = sum(self._busy)
+            busy_seconds = sum(self._busy_seconds)
+            depths = [q.qsize() for q in self._queues]
+            return {
+                "workers": self.num_workers,
+                "running": bool(self._threads),
+                "queue_depth": sum(depths),
+                "max_worker_queue_depth": max(depths),
+                "busy_workers": busy_workers,
+                "utilisation_now": busy_workers / self.num_workers,
+                "utilisation_avg": (busy_seconds / (uptime * self.num_workers)) if uptime else 0.0,
+                "submitted": self._submitted,
+                "completed": self._completed,
+                "failed": self._failed,
+                "rejected": self._rejected,
+            }
+
+
+_pools = []
+
+
+def _shutdown_pools():
+    for pool in _pools:
+        pool.shutdown()
+
+
+def create_pool(handler, num_workers, maxsize=0, name="worker"):
+    """Creates a pool that is drained and stopped when the process exits."""
+    pool = KeyedWorkerPool(handler, num_workers=num_workers, maxsize=maxsize, name=name)
+    _pools.append(pool)
+    return pool
+
+
+atexit.register(_shutdown_pools)
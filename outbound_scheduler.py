@@ -0,0 +1,297 @@
+# outbound_scheduler.py
+# Throughput governor for outbound WhatsApp sends.
+# The Cloud API limits both messages per second per business number and messages per
+# recipient ("pair rate"). Sends are queued per phone number id and released by a token
+# bucket per number and one per (number, recipient) pair, so bursts wait instead of
+# failing with 429s. Replies to the same recipient keep their order.
+
+import atexit
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from config import LOGGING_LEVEL, log_level_map
+
+logger = logging.getLogger(__name__)
+logger.setLevel(log_level_map.get(LOGGING_LEVEL, logging.INFO))
+
+# Queued items scanned per number when looking for a recipient whose pair budget is free.
+_LOOKAHEAD = 1000
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(max(1.0, burst))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """Seconds until a token is available (0 if one is available now)."""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else float("inf")
+
+    def consume(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def drain(self, now):
+        """Empties the bucket, e.g. after the server says we are over the limit."""
+        self._refill(now)
+        self.tokens = min(self.tokens, 0.0)
+
+    def is_full(self, now):
+        self._refill(now)
+        return self.tokens >= self.burst
+
+
+class _Item:
+    __slots__ = ("recipient", "send", "future", "enqueued_at")
+
+    def __init__(self, recipient, send):
+        self.recipient = recipient
+        self.send = send
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+class _Lane:
+    """Queue, buckets and counters for one business phone number."""
+
+    def __init__(self, rate, burst):
+        self.items = deque()
+        self.bucket = TokenBucket(rate, burst)
+        self.pairs = {}         # recipient -> TokenBucket
+        self.in_flight = set()  # recipients with a send in progress
+        self.client_id = None
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.throttled = 0
+        self.released = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+
+class OutboundScheduler:
+    """
+    submit() queues a send for a phone number and recipient and returns a Future that
+    resolves to the send function's result. A dispatcher thread releases items as the
+    number's and the pair's token buckets allow, onto a pool of sender threads.
+    Items that wait longer than `max_wait` or arrive at a full queue are dropped.
+    """
+
+    def __init__(self, rate, burst, pair_rate, pair_burst, max_wait=120.0, max_queue=10000,
+                 workers=16, is_throttled=None, failed_result=None, name="outbound"):
+        self.rate = rate
+        self.burst = burst
+        self.pair_rate = pair_rate
+        self.pair_burst = pair_burst
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self.workers = workers
+        # is_throttled(result) -> True if the server rejected the send as over the limit.
+        self.is_throttled = is_throttled or (lambda result: False)
+        # failed_result(reason) -> the value a dropped item's Future resolves to.
+        self.failed_result = failed_result or (lambda reason: None)
+        self.name = name
+        self._lanes = {}
+        self._cond = threading.Condition()
+        self._executor = None
+        self._thread = None
+        self._stopping = False
+        self._aborting = False
+
+    def start(self):
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._stopping = False
+            self._aborting = False
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"{self.name}-send")
+            self._thread = threading.Thread(target=self._run, name=f"{self.name}-dispatcher", daemon=True)
+            self._thread.start()
+        logger.info(f"Started outbound scheduler '{self.name}' ({self.rate}/s per number, {self.pair_rate}/s per recipient).")
+
+    def submit(self, phone_number_id, recipient, send, client_id=None):
+        """Queues `send()` (a zero-argument callable) and returns a Future for its result."""
+        if self._thread is None:
+            self.start()
+        item = _Item(recipient, send)
+        with self._cond:
+            lane = self._lanes.get(phone_number_id)
+            if lane is None:
+                lane = self._lanes[phone_number_id] = _Lane(self.rate, self.burst)
+            lane.client_id = client_id or lane.client_id
+            if len(lane.items) >= self.max_queue:
+                lane.dropped += 1
+                logger.error(f"Outbound queue for {phone_number_id} is full. Dropping send to {recipient}.")
+                item.future.set_result(self.failed_result("outbound queue full"))
+                return item.future
+            lane.items.append(item)
+            self._cond.notify()
+        return item.future
+
+    def _pair(self, lane, recipient):
+        bucket = lane.pairs.get(recipient)
+        if bucket is None:
+            bucket = lane.pairs[recipient] = TokenBucket(self.pair_rate, self.pair_burst)
+        return bucket
+
+    def _collect_ready(self, now):
+        """Pops every item that can be sent now; returns (items, seconds until the next may be ready)."""
+        ready = []
+        next_wait = None
+        for phone_number_id, lane in self._lanes.items():
+            while lane.items and now - lane.items[0].enqueued_at > self.max_wait:
+                self._drop(phone_number_id, lane, lane.items.popleft(), "waited too long")
+            blocked = set()
+            index = 0
+            while index < min(len(lane.items), _LOOKAHEAD):
+                item = lane.items[index]
+                if item.recipient in blocked or item.recipient in lane.in_flight:
+                    blocked.add(item.recipient)  # Keep per-recipient order.
+                    index += 1
+                    continue
+                wait = lane.bucket.wait_time(now)
+                if wait > 0:
+                    next_wait = wait if next_wait is None else min(next_wait, wait)
+                    break
+                pair_wait = self._pair(lane, item.recipient).wait_time(now)
+                if pair_wait > 0:
+                    next_wait = pair_wait if next_wait is None else min(next_wait, pair_wait)
+                    blocked.add(item.recipient)
+                    index += 1
+                    continue
+                lane.bucket.consume(now)
+                lane.pairs[item.recipient].consume(now)
+                lane.in_flight.add(item.recipient)
+                del lane.items[index]
+                waited = now - item.enqueued_at
+                lane.released += 1
+                lane.wait_total += waited
+                lane.wait_max = max(lane.wait_max, waited)
+                ready.append((phone_number_id, lane, item))
+            if lane.items:
+                # Re-check expiry of the oldest item even if no bucket frees up before then.
+                expires = self.max_wait - (now - lane.items[0].enqueued_at)
+                next_wait = expires if next_wait is None else min(next_wait, max(0.0, expires))
+            if len(lane.pairs) > 1000:
+                lane.pairs = {r: b for r, b in lane.pairs.items() if r in lane.in_flight or not b.is_full(now)}
+        return ready, next_wait
+
+    def _drop(self, phone_number_id, lane, item, reason):
+        lane.dropped += 1
+        logger.error(f"Dropping outbound send from {phone_number_id} to {item.recipient}: {reason}.")
+        item.future.set_result(self.failed_result(reason))
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._aborting or (self._stopping and not any(lane.items for lane in self._lanes.values())):
+                    return
+                ready, next_wait = self._collect_ready(time.monotonic())
+                if not ready:
+                    self._cond.wait(timeout=next_wait)
+                    continue
+            for item in ready:
+                self._executor.submit(self._send, *item)
+
+    def _send(self, phone_number_id, lane, item):
+        try:
+            result = item.send()
+        except Exception as e:
+            logger.error(f"Outbound send from {phone_number_id} to {item.recipient} raised: {e}", exc_info=True)
+            result = self.failed_result(str(e))
+        with self._cond:
+            lane.in_flight.discard(item.recipient)
+            if self.is_throttled(result) and time.monotonic() - item.enqueued_at < self.max_wait:
+                # Over Meta's limit despite our budget: back off the whole number and retry in order.
+                lane.throttled += 1
+                lane.bucket.drain(time.monotonic())
+                lane.items.appendleft(item)
+                self._cond.notify()
+                return
+            if result is not None and getattr(result, "ok", True):
+                lane.sent += 1
+            else:
+                lane.failed += 1
+            self._cond.notify()
+        item.future.set_result(result)
+
+    def shutdown(self, timeout=10.0):
+        """
+        Sends what is queued (up to `timeout`), then stops. Items still queued after that
+        resolve to failed_result("shutdown").
+        """
+        with self._cond:
+            thread = self._thread
+            if thread is None:
+                return
+            self._stopping = True
+            self._cond.notify()
+        thread.join(timeout)
+        # The dispatcher must be gone before the executor is shut down, or it may still submit to it.
+        with self._cond:
+            self._aborting = True
+            self._cond.notify()
+        thread.join()
+        self._executor.shutdown(wait=True)
+        with self._cond:
+            # Left over after the timeout, or requeued by a throttled send that finished meanwhile.
+            for phone_number_id, lane in self._lanes.items():
+                while lane.items:
+                    self._drop(phone_number_id, lane, lane.items.popleft(), "shutdown")
+            self._thread = None
+        logger.info(f"Outbound scheduler '{self.name}' stopped.")
+
+    def stats(self):
+        """Per-number queue depth, wait times and outcome counts."""
+        with self._cond:
+            numbers = {}
+            for phone_number_id, lane in self._lanes.items():
+                oldest = time.monotonic() - lane.items[0].enqueued_at if lane.items else 0.0
+                numbers[phone_number_id] = {
+                    "client_id": lane.client_id,
+                    "queued": len(lane.items),
+                    "in_flight": len(lane.in_flight),
+                    "sent": lane.sent,
+                    "failed": lane.failed,
+                    "dropped": lane.dropped,
+                    "throttled": lane.throttled,
+                    "wait_ms_avg": lane.wait_total / lane.released * 1000 if lane.released else 0.0,
+                    "wait_ms_max": lane.wait_max * 1000,
+                    "oldest_queued_ms": oldest * 1000,
+                }
+            return {
+                "running": self._thread is not None,
+                "queued": sum(n["queued"] for n in numbers.values()),
+                "dropped": sum(n["dropped"] for n in numbers.values()),
+                "numbers": numbers,
+            }
+
+
+_schedulers = []
+
+
+def _shutdown_schedulers():
+    for scheduler in _schedulers:
+        scheduler.shutdown()
+
+
+def create_scheduler(**kwargs):
+    """Creates a scheduler that flushes its queue and stops when the process exits."""
+    scheduler = OutboundScheduler(**kwargs)
+    _schedulers.append(scheduler)
+    return scheduler
+
+
+atexit.register(_shutdown_schedulers)
@@ -0,0 +1,160 @@
+# outbox_dispatcher.py
+# Background thread that delivers replies queued in the `outbox` table (see db/outbox_crud.py).
+# Rows are claimed in batches under a lease, sent through the outbound scheduler (or directly),
+# and marked sent with their Graph message id, rescheduled with backoff, or failed for good
+# after OUTBOX_MAX_ATTEMPTS. Each row is recorded when its own send completes, so a throttled
+# recipient doesn't hold up other rows; up to OUTBOX_MAX_IN_FLIGHT rows wait on sends at once.
+# A crash mid-send leaves the lease to expire, so the row is sent again: delivery is at least once.
+
+import logging
+import random
+import threading
+import time
+
+from config import (
+    LOGGING_LEVEL, log_level_map, OUTBOX_BATCH_SIZE, OUTBOX_POLL_INTERVAL_SECONDS, OUTBOX_MAX_ATTEMPTS,
+    OUTBOX_RETRY_BACKOFF_SECONDS, OUTBOX_LEASE_SECONDS, OUTBOX_RETENTION_SECONDS, OUTBOX_MAX_IN_FLIGHT
+)
+from db.outbox_crud import (
+    claim_outbox_batch, mark_outbox_sent, mark_outbox_retry, mark_outbox_failed, get_outbox_counts, prune_outbox
+)
+from db.client_config_cache import client_config_cache
+from whatsapp_api_utils import queue_whatsapp_message
+
+logger = logging.getLogger(__name__)
+logger.setLevel(log_level_map.get(LOGGING_LEVEL, logging.INFO))
+
+_PRUNE_INTERVAL_SECONDS = 3600
+
+
+class OutboxDispatcher:
+    def __init__(self, batch_size=OUTBOX_BATCH_SIZE, poll_interval=OUTBOX_POLL_INTERVAL_SECONDS,
+                 max_attempts=OUTBOX_MAX_ATTEMPTS, lease_seconds=OUTBOX_LEASE_SECONDS,
+                 max_in_flight=OUTBOX_MAX_IN_FLIGHT):
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._last_prune = 0.0
+        self.in_flight = 0
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="outbox-dispatcher", daemon=True)
+            self._thread.start()
+        logger.info("Started outbox dispatcher.")
+
+    def notify(self):
+        """Wakes the dispatcher after a reply was queued, instead of waiting for the next poll."""
+        if self._thread is None:
+            self.start()
+        self._wake.set()
+
+    def stop(self, timeout=10.0):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._stop.set()
+        self._wake.set()
+        thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                delivered = self.dispatch_once()
+            except Exception as e:
+                logger.error(f"Outbox dispatch failed: {e}", exc_info=True)
+                delivered = 0
+            if time.monotonic() - self._last_prune > _PRUNE_INTERVAL_SECONDS:
+                self._last_prune = time.monotonic()
+                prune_outbox(OUTBOX_RETENTION_SECONDS)
+            if delivered < self.batch_size:
+                # A full batch means there is probably more due; otherwise wait for new work.
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+    def _send(self, row):
+        """Queues the send for a row with the sending client's token; returns a Future of its SendResult."""
+        client_config = client_config_cache.get(row['phone_number_id']) if row['phone_number_id'] else None
+        access_token = (client_config or {}).get('whatsapp_api_token')
+        return queue_whatsapp_message(row['to_number'], row['message_body'], row['phone_number_id'],
+                                      access_token, client_id=row['client_id'])
+
+    def dispatch_once(self):
+        """
+        Claims one batch and queues its sends without waiting for them; each row is recorded
+        when its send completes. Returns the number of rows claimed.
+        """
+        with self._lock:
+            limit = min(self.batch_size, self.max_in_flight - self.in_flight)
+        if limit <= 0:
+            return 0
+        rows = claim_outbox_batch(limit, self.lease_seconds)
+        for row in rows:
+            with self._lock:
+                self.in_flight += 1
+            try:
+                future = self._send(row)
+            except Exception:
+                self._finish()
+                raise
+            future.add_done_callback(lambda f, row=row: self._on_done(row, f))
+        return len(rows)
+
+    def _on_done(self, row, future):
+        try:
+            self._record(row, future.result())
+        except Exception as e:
+            # The row stays leased and is sent again once the lease expires.
+            logger.error(f"Error recording outbox #{row['id']}: {e}", exc_info=True)
+        finally:
+            self._finish()
+
+    def _finish(self):
+        with self._lock:
+            freed_capacity = self.in_flight == self.max_in_flight
+            self.in_flight -= 1
+        if freed_capacity:
+            self._wake.set()
+
+    def _record(self, row, result):
+        if result.ok:
+            mark_outbox_sent(row['id'], result.message_id)
+            with self._lock:
+                self.sent += 1
+            return
+        error = f"{result.status_code or ''} {result.error or ''}".strip()[:500]
+        # 4xx other than 429 (bad number, bad token...) will not succeed on retry.
+        permanent = result.status_code is not None and 400 <= result.status_code < 500 and result.status_code != 429
+        if permanent or row['attempts'] >= self.max_attempts:
+            mark_outbox_failed(row['id'], error)
+            with self._lock:
+                self.failed += 1
+            logger.error(f"Giving up on outbox #{row['id']} to {row['to_number']} after {row['attempts']} attempts: {error}")
+            return
+        delay = OUTBOX_RETRY_BACKOFF_SECONDS * (2 ** (row['attempts'] - 1)) * (1 + random.random())
+        mark_outbox_retry(row['id'], error, int(time.time() + delay))
+        with self._lock:
+            self.retried += 1
+        logger.warning(f"Outbox #{row['id']} to {row['to_number']} failed ({error}); retrying in {delay:.0f}s.")
+
+    def stats(self):
+        with self._lock:
+            counters = {"running": self._thread is not None, "in_flight": self.in_flight,
+                        "sent": self.sent, "retried": self.retried, "failed": self.failed}
+        return {**counters, "rows": get_outbox_counts()}
+
+
+outbox_dispatcher = OutboxDispatcher()
@@ -0,0 +1,177 @@
+# rate_limiter.py
+# Inbound per-sender rate limiting for the webhook.
+# Each sender key gets a token bucket that refills one token every `interval` seconds up to
+# `burst` tokens, so with burst 1 a sender may send one message per interval (the original
+# RATE_LIMIT_SECONDS behaviour). A bucket that has been idle long enough to refill completely
+# is indistinguishable from a new one, so it is evicted; memory stays bounded by active senders.
+#
+# Backends (RATE_LIMIT_BACKEND):
+#   memory - per process, O(1) dict lookups with LRU/idle eviction.
+#   sqlite - one small SQLite file shared by every worker process on the host, so the limit
+#            holds under gunicorn with N workers. Each check is one atomic UPSERT on the key.
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from config import (
+    LOGGING_LEVEL, log_level_map, DB_BUSY_TIMEOUT_MS, RATE_LIMIT_BACKEND, RATE_LIMIT_SQLITE_PATH,
+    RATE_LIMIT_MAX_KEYS
+)
+
+logger = logging.getLogger(__name__)
+logger.setLevel(log_level_map.get(LOGGING_LEVEL, logging.INFO))
+
+
+class RateLimiter:
+    """allow(key, interval, burst) -> True if the sender may send now (and uses up a token)."""
+
+    name = "base"
+
+    def __init__(self):
+        self._stats_lock = threading.Lock()
+        self.allowed = 0
+        self.limited = 0
+        self.errors = 0
+
+    def allow(self, key, interval, burst=1):
+        if not interval or interval <= 0:
+            return True
+        allowed = self._check(key, float(interval), max(1, int(burst or 1)), time.time())
+        with self._stats_lock:
+            if allowed is None:
+                # Backend failure: let the message through rather than drop it.
+                self.errors += 1
+                allowed = True
+            if allowed:
+                self.allowed += 1
+            else:
+                self.limited += 1
+        return allowed
+
+    def _check(self, key, interval, burst, now):
+        raise NotImplementedError
+
+    def stats(self):
+        with self._stats_lock:
+            return {"backend": self.name, "allowed": self.allowed, "limited": self.limited, "errors": self.errors}
+
+
+class MemoryRateLimiter(RateLimiter):
+    name = "memory"
+
+    def __init__(self, max_keys=RATE_LIMIT_MAX_KEYS):
+        super().__init__()
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> [tokens, updated_at, full_after_seconds], least recently used first
+        self._lock = threading.Lock()
+        self.evicted = 0
+
+    def _check(self, key, interval, burst, now):
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [float(burst), now, interval * burst]
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(float(burst), bucket[0] + (now - bucket[1]) / interval)
+                bucket[1] = now
+                bucket[2] = interval * burst
+            allowed = bucket[0] >= 1
+            if allowed:
+                bucket[0] -= 1
+            self._evict(now)
+            return allowed
+
+    def _evict(self, now):
+        # The front is the least recently used; each call removes at most what has expired there.
+        while self._buckets:
+            key, (tokens, updated_at, full_after) = next(iter(self._buckets.items()))
+            if len(self._buckets) > self.max_keys or now - updated_at >= full_after:
+                del self._buckets[key]
+                self.evicted += 1
+            else:
+                break
+
+    def stats(self):
+        with self._lock:
+            keys, evicted = len(self._buckets), self.evicted
+        return {**super().stats(), "keys": keys, "evicted": evicted}
+
+
+class SQLiteRateLimiter(RateLimiter):
+    name = "sqlite"
+
+    _PRUNE_EVERY = 1000
+
+    def __init__(self, path=RATE_LIMIT_SQLITE_PATH):
+        super().__init__()
+        self.path = path
+        self._local = threading.local()
+        self._checks = 0
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=DB_BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+            conn.execute("PRAGMA journal_mode = WAL;")
+            # Limiter state is disposable: losing the last writes in a power cut only loosens limits briefly.
+            conn.execute("PRAGMA synchronous = OFF;")
+            conn.execute(f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS};")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS rate_limits (
+                    key TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    expires_at REAL NOT NULL -- when the bucket is full again and can be forgotten
+                ) WITHOUT ROWID
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_rate_limits_expires_at ON rate_limits (expires_at)")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _check(self, key, interval, burst, now):
+        try:
+            conn = self._connection()
+            # Refill-and-take in one statement; the WHERE leaves the row untouched (rowcount 0) when empty.
+            cursor = conn.execute(
+                """
+                INSERT INTO rate_limits (key, tokens, updated_at, expires_at) VALUES (?1, ?2 - 1, ?3, ?3 + ?4)
+                ON CONFLICT (key) DO UPDATE SET
+                    tokens = MIN(?2, tokens + (?3 - updated_at) / ?5) - 1,
+                    updated_at = ?3,
+                    expires_at = ?3 + ?4
+                WHERE MIN(?2, tokens + (?3 - updated_at) / ?5) >= 1
+                """,
+                (key, burst, now, interval * burst, interval)
+            )
+            allowed = cursor.rowcount > 0
+            self._checks += 1
+            if self._checks % self._PRUNE_EVERY == 0:
+                conn.execute("DELETE FROM rate_limits WHERE expires_at < ?", (now,))
+            return allowed
+        except sqlite3.Error as e:
+            logger.error(f"Rate limiter check failed for {key}: {e}")
+            return None
+
+    def stats(self):
+        try:
+            keys = self._connection().execute("SELECT COUNT(*) FROM rate_limits").fetchone()[0]
+        except sqlite3.Error:
+            keys = None
+        return {**super().stats(), "keys": keys, "path": self.path}
+
+
+def create_rate_limiter(backend=RATE_LIMIT_BACKEND):
+    if backend == "sqlite":
+        return SQLiteRateLimiter()
+    if backend != "memory":
+        logger.warning(f"Unknown RATE_LIMIT_BACKEND '{backend}'. Using the in-memory limiter.")
+    return MemoryRateLimiter()
+
+
+rate_limiter = create_rate_limiter()
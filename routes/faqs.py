@@ -1,11 +1,17 @@
 # routes/faqs.py
 
 import logging
-from flask import Blueprint, render_template, flash, request, redirect, url_for
+import os
+import uuid
+from flask import Blueprint, render_template, flash, request, redirect, url_for, jsonify
 from flask_login import login_required, current_user
 from db.faqs_crud import add_faq, get_all_faqs
+from db.faq_import_crud import get_import_job
 from db.clients_crud import get_all_clients
-from ai_utils import generate_embedding
+from ai_utils import generate_embedding, faq_embedding_text
+from faq_cache import faq_cache
+from import_faqs import start_import, detect_format, SUPPORTED_FORMATS
+from config import FAQ_IMPORT_UPLOAD_DIR
 
 faqs_bp = Blueprint('faqs_routes', __name__, template_folder='../templates')
 logger = logging.getLogger(__name__)
@@ -26,10 +32,15 @@ def manage_faqs():
         if current_user.role == 'client':
             question = request.form.get('question')
             answer = request.form.get('answer')
-            embedding = generate_embedding(f"{question} {answer}")
+            embedding = generate_embedding(faq_embedding_text(question, answer))
             if embedding is not None:
-                add_faq(question, answer, embedding, client_id, 1)
-                flash("FAQ added.", "success")
+                faq_id = add_faq(question, answer, embedding, client_id, 1)
+                if faq_id:
+                    faq_cache.upsert(client_id, {"id": faq_id, "question": question, "answer": answer,
+                                                 "client_id": client_id, "embedding": embedding})
+                    flash("FAQ added.", "success")
+                else:
+                    flash("Failed to save FAQ.", "danger")
             else:
                 flash("Failed to generate embedding. FAQ not added.", "danger")
         else:
@@ -45,3 +56,56 @@ def manage_faqs():
         client_id=client_id,
         current_user=current_user
     )
+
+def _wants_json():
+    """True for API and XHR callers; the manage_faqs form gets flashes and a redirect instead."""
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        return True
+    return request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json'
+
+@faqs_bp.route('/manage_faqs/import', methods=['POST'])
+@login_required
+def import_faqs_upload():
+    """Accepts a CSV/JSONL upload and imports it in the background; returns or flashes the job id."""
+    def fail(message, status):
+        if _wants_json():
+            return jsonify({"error": message}), status
+        flash(message, "danger")
+        return redirect(url_for('faqs_routes.manage_faqs'))
+
+    if current_user.role != 'client':
+        return fail("Only clients can import FAQs", 403)
+    client_id = current_user.client_id
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        return fail("No file uploaded", 400)
+    file_format = request.form.get('format') or detect_format(upload.filename)
+    if file_format not in SUPPORTED_FORMATS:
+        return fail(f"Unsupported format '{file_format}'", 400)
+
+    # Saved to disk (streamed, not held in memory) so the job can be resumed after a restart, and
+    # removed when it completes or fails. Uploading the file again retries a failed import:
+    # questions already imported are skipped as duplicates.
+    os.makedirs(FAQ_IMPORT_UPLOAD_DIR, exist_ok=True)
+    path = os.path.join(FAQ_IMPORT_UPLOAD_DIR, f"{uuid.uuid4().hex}.{file_format}")
+    upload.save(path)
+    job_id = start_import(client_id, path, file_format, background=True, remove_when_done=True)
+    if not job_id:
+        os.remove(path)
+        return fail("Failed to start import", 500)
+    logger.info(f"Started FAQ import job {job_id} for client '{client_id}'.")
+    status_url = url_for('faqs_routes.import_faqs_status', job_id=job_id)
+    if _wants_json():
+        return jsonify({"job_id": job_id, "status_url": status_url}), 202
+    flash(f"Import job {job_id} started. Progress: {status_url}", "success")
+    return redirect(url_for('faqs_routes.manage_faqs'))
+
+@faqs_bp.route('/manage_faqs/import/<job_id>', methods=['GET'])
+@login_required
+def import_faqs_status(job_id):
+    client_id = None if current_user.role == 'super_admin' else current_user.client_id
+    job = get_import_job(job_id, client_id)
+    if not job:
+        return jsonify({"error": "Import job not found"}), 404
+    job.pop('source_path', None)
+    return jsonify(job)
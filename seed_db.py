@@ -28,7 +28,7 @@ from db.db_connection import (
 from db.faqs_crud import add_faq as add_faq_to_db, get_all_faqs
 from db.clients_crud import add_client, get_client_by_id
 from db.users_crud import add_user, get_user_by_email
-from ai_utils import generate_embedding
+from ai_utils import generate_embeddings, faq_embedding_text
 
 logger.setLevel(log_level_map.get(LOGGING_LEVEL, logging.INFO))
 
@@ -146,9 +146,10 @@ def seed_initial_data():
     for client in clients:
         client_id = client["client_id"]
         if not get_all_faqs(client_id):
-            for question, answer in faqs_to_add:
-                embedding = generate_embedding(question + " " + answer)
-                if embedding:
+            # One batched embedding call per client instead of one call per FAQ
+            embeddings = generate_embeddings(faq_embedding_text(q, a) for q, a in faqs_to_add)
+            for (question, answer), embedding in zip(faqs_to_add, embeddings):
+                if embedding is not None:
                     try:
                         add_faq_to_db(question, answer, embedding, client_id, 1)  # If active=1 allowed
                     except TypeError:
@@ -0,0 +1,77 @@
+# single_flight.py
+# Collapses concurrent identical upstream calls into one.
+# When many users send the same message at once, the first request for a key (the leader)
+# makes the call; requests for the same key arriving while it is in flight wait for it and
+# share its result or exception instead of making their own call.
+
+import logging
+import threading
+
+from config import LOGGING_LEVEL, log_level_map
+
+logger = logging.getLogger(__name__)
+logger.setLevel(log_level_map.get(LOGGING_LEVEL, logging.INFO))
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.upstream_calls = 0
+
+    def do(self, key, fn):
+        """
+        Runs fn() once per key among concurrent callers. Returns (result, shared), where shared
+        is True for callers that got the leader's result instead of calling fn themselves.
+        """
+        with self._lock:
+            self.requests += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.upstream_calls += 1
+            else:
+                call.waiters += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+            if call.waiters:
+                logger.debug(f"Single-flight '{self.name}': {call.waiters} callers shared one call.")
+        return call.result, False
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "upstream_calls": self.upstream_calls,
+                "shared": self.requests - self.upstream_calls,
+                "in_flight": len(self._calls),
+                # Requests served per upstream call; 1.0 means no coalescing happened.
+                "fan_in": self.requests / self.upstream_calls if self.upstream_calls else 1.0,
+            }
@@ -0,0 +1,19 @@
+# tests/conftest.py
+import os
+import sys
+
+import pytest
+
+# The app modules are imported from the repository root, as app.py does.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def temp_db(tmp_path, monkeypatch):
+    """Points the database layer at a fresh file for the test and returns its path."""
+    import db.db_connection as db_connection
+    path = str(tmp_path / "test.db")
+    db_connection.close_db_connection()
+    monkeypatch.setattr(db_connection, "DATABASE_NAME", path)
+    yield path
+    db_connection.close_db_connection()
@@ -0,0 +1,38 @@
+# tests/test_query_plans.py
+# Every hot query must be served by an index on a freshly migrated database.
+
+import pytest
+
+from db.db_connection import init_db, get_db_connection
+from db.migrations import HOT_QUERIES, explain_query_plan, check_query_plans
+
+
+@pytest.fixture
+def migrated_db(temp_db):
+    init_db()
+    return temp_db
+
+
+def _tables():
+    conn = get_db_connection()
+    try:
+        return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize("name", sorted(HOT_QUERIES))
+def test_hot_query_uses_an_index(migrated_db, name):
+    sql, params = HOT_QUERIES[name]
+    plan = explain_query_plan(sql, params)
+    tables = _tables()
+
+    assert any("USING" in line and ("INDEX" in line or "PRIMARY KEY" in line) for line in plan), plan
+    for line in plan:
+        words = line.split()
+        full_scan = len(words) >= 2 and words[0] == "SCAN" and words[1] in tables and "INDEX" not in line
+        assert not full_scan, f"{name} scans a whole table: {plan}"
+
+
+def test_check_query_plans_reports_no_regressions(migrated_db):
+    assert check_query_plans() == {}
@@ -0,0 +1,149 @@
+# tests/test_whatsapp_api_utils.py
+# post_message against a local stub of the Graph API (WHATSAPP_API_BASE_URL pointed at it).
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import whatsapp_api_utils
+from whatsapp_api_utils import post_message, SendMetrics
+
+
+class StubGraphAPI:
+    """Answers each POST with the next scripted (status, headers, body); 200 with a wamid once they run out."""
+
+    def __init__(self):
+        self.responses = []
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                stub.requests.append((self.path, json.loads(self.rfile.read(length) or b"{}")))
+                status, headers, body = stub.responses.pop(0) if stub.responses else (
+                    200, {}, {"messages": [{"id": "wamid.default"}]})
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self._thread = threading.Thread(target=self.server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def graph_api(monkeypatch):
+    stub = StubGraphAPI()
+    monkeypatch.setattr(whatsapp_api_utils, "WHATSAPP_API_BASE_URL", stub.url)
+    yield stub
+    stub.close()
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Records backoff delays instead of sleeping."""
+    delays = []
+    monkeypatch.setattr(whatsapp_api_utils.time, "sleep", delays.append)
+    return delays
+
+
+@pytest.fixture
+def metrics(monkeypatch):
+    fresh = SendMetrics()
+    monkeypatch.setattr(whatsapp_api_utils, "send_metrics", fresh)
+    return fresh
+
+
+def _payload():
+    return {"messaging_product": "whatsapp", "to": "15550001111", "type": "text", "text": {"body": "hi"}}
+
+
+def test_success_parses_message_id(graph_api, sleeps, metrics):
+    graph_api.responses.append((200, {}, {"messages": [{"id": "wamid.ABC"}]}))
+
+    result = post_message("PHONE1", "token", _payload())
+
+    assert result.ok and result.status_code == 200
+    assert result.message_id == "wamid.ABC"
+    assert result.attempts == 1
+    assert graph_api.requests == [("/PHONE1/messages", _payload())]
+    assert sleeps == []
+
+
+def test_429_honours_retry_after(graph_api, sleeps, metrics, monkeypatch):
+    monkeypatch.setattr(whatsapp_api_utils, "WHATSAPP_SEND_MAX_BACKOFF_SECONDS", 60.0)
+    graph_api.responses.append((429, {"Retry-After": "7"}, {"error": {"message": "throttled"}}))
+
+    result = post_message("PHONE1", "token", _payload(), max_retries=3)
+
+    assert result.ok and result.attempts == 2
+    assert sleeps == [7.0]
+
+
+def test_5xx_retried_up_to_max_retries(graph_api, sleeps, metrics):
+    graph_api.responses.extend([(503, {}, {"error": {}})] * 5)
+
+    result = post_message("PHONE1", "token", _payload(), max_retries=2)
+
+    assert not result.ok and result.retryable
+    assert result.status_code == 503
+    assert result.attempts == 3
+    assert len(graph_api.requests) == 3
+    assert len(sleeps) == 2
+
+
+def test_4xx_not_retried(graph_api, sleeps, metrics):
+    graph_api.responses.append((400, {}, {"error": {"message": "invalid recipient"}}))
+
+    result = post_message("PHONE1", "token", _payload(), max_retries=3)
+
+    assert not result.ok and not result.retryable
+    assert result.status_code == 400
+    assert "invalid recipient" in result.error
+    assert result.attempts == 1
+    assert len(graph_api.requests) == 1
+    assert sleeps == []
+
+
+def test_429_returned_at_once_without_retry_throttled(graph_api, sleeps, metrics):
+    graph_api.responses.append((429, {"Retry-After": "7"}, {"error": {}}))
+
+    result = post_message("PHONE1", "token", _payload(), max_retries=3, retry_throttled=False)
+
+    assert not result.ok and result.status_code == 429
+    assert result.attempts == 1
+    assert len(graph_api.requests) == 1
+    assert sleeps == []
+
+
+def test_send_metrics_updated(graph_api, sleeps, metrics):
+    graph_api.responses.extend([(500, {}, {}), (200, {}, {"messages": [{"id": "wamid.1"}]}), (400, {}, {})])
+
+    post_message("PHONE1", "token", _payload(), max_retries=1)
+    post_message("PHONE1", "token", _payload(), max_retries=1)
+
+    stats = metrics.stats()
+    assert stats["calls"] == 3
+    assert stats["sent"] == 1
+    assert stats["failed"] == 1
+    assert stats["retries"] == 1
+    assert stats["status_counts"] == {"500": 1, "200": 1, "400": 1}
+    assert stats["latency_ms"]["p50"] is not None
@@ -0,0 +1,19 @@
+# utils/text_normalization.py
+import re
+import unicodedata
+
+_PUNCTUATION_RE = re.compile(r"[^\w\s]", re.UNICODE)
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    """
+    Canonical form of a short user message for cache and lookup keys:
+    Unicode NFKC, case-folded, punctuation removed and whitespace collapsed.
+    "  What are your Opening-Hours?? " -> "what are your openinghours"
+    """
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKC", text).casefold()
+    text = _PUNCTUATION_RE.sub("", text)
+    return _WHITESPACE_RE.sub(" ", text).strip()
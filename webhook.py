@@ -1,24 +1,39 @@
 # webhook.py
 import json
 import logging
-import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from flask import Blueprint, request, jsonify
-from config import VERIFY_TOKEN, RATE_LIMIT_SECONDS, WHATSAPP_PHONE_NUMBER_ID, LOGGING_LEVEL, log_level_map
+from config import (
+    VERIFY_TOKEN, RATE_LIMIT_SECONDS, RATE_LIMIT_BURST, WHATSAPP_PHONE_NUMBER_ID, LOGGING_LEVEL, log_level_map,
+    WEBHOOK_ASYNC_ENABLED, WEBHOOK_WORKER_COUNT, WEBHOOK_QUEUE_MAXSIZE, WEBHOOK_ENQUEUE_TIMEOUT_SECONDS,
+    WEBHOOK_BATCH_CONCURRENCY, OUTBOX_ENABLED, MESSAGE_COALESCE_WINDOW_MS, MESSAGE_DEDUP_ENABLED
+)
 
 # --- START MODIFICATION FOR DB REFACTORING ---
 from db.conversations_crud import add_message, get_conversation_history_by_whatsapp_id
-from db.clients_crud import get_client_config_by_whatsapp_id  # CHANGED FROM tenants_crud
+from db.client_config_cache import client_config_cache
+from db.outbox_crud import add_message_with_reply
 # --- END MODIFICATION FOR DB REFACTORING ---
 
-from whatsapp_api_utils import send_whatsapp_message
+from whatsapp_api_utils import queue_whatsapp_message
+from outbox_dispatcher import outbox_dispatcher
+from message_dedup import message_deduplicator
+from rate_limiter import rate_limiter
 from ai_utils import generate_ai_reply
+from conversation_summarizer import conversation_summarizer
+from message_queue import create_pool
+from message_coalescer import create_coalescer, merge_messages
 
 webhook_bp = Blueprint('webhook', __name__)
 logger = logging.getLogger(__name__)
 logger.setLevel(log_level_map.get(LOGGING_LEVEL, logging.INFO))
 
-# Dictionary to store last message timestamp for rate limiting
-last_message_time = {}
+# Worker pool for async ingestion, created on first use
+_message_pool = None
+
+# Executor used to fan out a batch across senders when processing inline
+_batch_executor = ThreadPoolExecutor(max_workers=WEBHOOK_BATCH_CONCURRENCY, thread_name_prefix="webhook-batch")
 
 @webhook_bp.route("/webhook", methods=["GET"])
 def verify_webhook():
@@ -42,84 +57,305 @@ def verify_webhook():
         )
         return "Verification failed", 403
 
+def _send_reply(to_number, message_body, client_config):
+    """
+    Sends from the client's own number with its own token (deployment defaults if it has none).
+    With the outbound scheduler enabled the reply is queued under the number's rate budget
+    and sent in the background.
+    """
+    client_config = client_config or {}
+    return queue_whatsapp_message(
+        to_number, message_body,
+        phone_number_id=client_config.get('whatsapp_phone_number_id'),
+        access_token=client_config.get('whatsapp_api_token'),
+        client_id=client_config.get('client_id')
+    )
+
+def _store_and_reply(wa_id, user_message, current_client_id, response_message, client_config):
+    """
+    Records the message with its reply and delivers the reply. With the outbox enabled both are
+    written in one transaction and the outbox dispatcher sends the reply, so it survives send
+    failures and restarts; if the write fails the reply is sent directly and the message stored
+    on its own, as without the outbox.
+    """
+    if OUTBOX_ENABLED:
+        phone_number_id = (client_config or {}).get('whatsapp_phone_number_id')
+        _, outbox_id = add_message_with_reply(wa_id, user_message, current_client_id, response_message, phone_number_id)
+        if outbox_id:
+            outbox_dispatcher.notify()
+        else:
+            _send_reply(wa_id, response_message, client_config)
+            add_message(wa_id, user_message, 'user', current_client_id, response_message)
+    else:
+        _send_reply(wa_id, response_message, client_config)
+        add_message(wa_id, user_message, 'user', current_client_id, response_message)
+    conversation_summarizer.note_message(wa_id, current_client_id)
+
+def process_message(message, current_client_id, client_config=None):
+    """
+    Runs the reply pipeline for a single inbound message: AI generation, send and storage.
+    `client_config` is the config resolved by the webhook, carried through so it isn't looked up again.
+    """
+    from_number = message["from"]
+    message_type = message["type"]
+    wa_id = from_number
+
+    user_message_to_save = ""
+    response_message = ""
+
+    if message_type == "text":
+        user_message_content = message["text"]["body"]
+        user_message_to_save = user_message_content
+        logger.info(
+            f"Received text message from {from_number} (Client: `{current_client_id}`): '{user_message_content}'"
+        )
+
+        # Generate AI reply
+        ai_response_data = generate_ai_reply(user_message_content, wa_id, current_client_id, client_config)
+        response_message = ai_response_data.get("response", "I'm sorry, I couldn't generate a response.")
+
+        # Store both user message and AI response, and deliver the response
+        _store_and_reply(wa_id, user_message_to_save, current_client_id, response_message, client_config)
+
+    elif message_type == "button":
+        button_payload = message["button"]["payload"]
+        user_message_to_save = f"Button click: {button_payload}"
+
+        if button_payload:
+            logger.info(
+                f"Received button message from {from_number} with payload '{button_payload}' (Client: `{current_client_id}`).")
+
+            response_message = f"You clicked: {button_payload}"
+            _store_and_reply(wa_id, user_message_to_save, current_client_id, response_message, client_config)
+        else:
+            logger.warning(
+                f"Received button message from {from_number} but no payload found (Client: `{current_client_id}`).")
+            add_message(wa_id, user_message_to_save, 'user', current_client_id, 'No action for button')
+
+    else:  # Handle other message types that are not text or button
+        user_message_to_save = f"Unhandled type: {message_type}"
+        logger.info(
+            f"Received unhandled message type '{message_type}' from {from_number} (Client: `{current_client_id}`).")
+        add_message(wa_id, user_message_to_save, 'user', current_client_id, 'Unsupported message type')
+
+    logger.info(f"Processed and responded to {from_number} (Client: `{current_client_id}`).")
+
+
+def _release_claims(message):
+    """Releases the dedup claim on a message (every id of a coalesced one) that was not handled."""
+    for message_id in message.get("coalesced_ids") or [message.get("id")]:
+        message_deduplicator.release(message_id)
+
+
+def _process_queued_message(item):
+    """Worker pool handler for messages enqueued by the webhook."""
+    try:
+        process_message(item["message"], item["client_id"], item["client_config"])
+    except Exception:
+        _release_claims(item["message"])
+        raise
+
+
+def get_message_pool():
+    """Returns the async ingestion worker pool, starting it on first use."""
+    global _message_pool
+    if _message_pool is None:
+        _message_pool = create_pool(
+            _process_queued_message,
+            num_workers=WEBHOOK_WORKER_COUNT,
+            maxsize=WEBHOOK_QUEUE_MAXSIZE,
+            name="webhook-worker"
+        )
+        _message_pool.start()
+    return _message_pool
+
+
+def _coalesce_window_seconds(client_config):
+    window_ms = client_config.get('coalesce_window_ms')
+    if window_ms is None:
+        window_ms = MESSAGE_COALESCE_WINDOW_MS
+    return window_ms / 1000.0
+
+
+def _flush_coalesced(sender_key, batch):
+    """Hands a closed batch of a sender's text messages to the worker pool as one message."""
+    if len(batch.messages) > 1:
+        logger.info(f"Coalesced {len(batch.messages)} messages from {sender_key[1]} into one reply (Client: `{batch.client_id}`).")
+    queued = get_message_pool().submit(
+        sender_key,
+        {"message": merge_messages(batch.messages), "client_id": batch.client_id, "client_config": batch.client_config},
+        timeout=WEBHOOK_ENQUEUE_TIMEOUT_SECONDS
+    )
+    if not queued:
+        logger.error(f"Could not queue {len(batch.messages)} coalesced messages from {sender_key[1]}.")
+        for message in batch.messages:
+            _release_claims(message)
+
+
+message_coalescer = create_coalescer(_flush_coalesced)
+
+
+def get_coalescing_stats():
+    return {"default_window_ms": MESSAGE_COALESCE_WINDOW_MS, **message_coalescer.stats()}
+
+
+def get_ingestion_stats():
+    """Returns queue depth and worker utilisation for the async ingestion pool."""
+    if _message_pool is None:
+        return {"async_enabled": WEBHOOK_ASYNC_ENABLED, "running": False}
+    return {"async_enabled": WEBHOOK_ASYNC_ENABLED, **_message_pool.stats()}
+
+
+def _iter_messages(data):
+    """
+    Yields (message, phone_number_id) for every message in a webhook payload, across all
+    entries and changes. phone_number_id is the business number the message was sent to.
+    """
+    for entry in data.get("entry", []):
+        for change in entry.get("changes", []):
+            value = change.get("value") or {}
+            phone_number_id = (value.get("metadata") or {}).get("phone_number_id") or WHATSAPP_PHONE_NUMBER_ID
+            for message in value.get("messages", []):
+                yield message, phone_number_id
+
+
+def _process_sender_messages(items):
+    """
+    Processes one sender's messages in order.
+    Returns (processed, failed) counts; a failure does not stop later messages.
+    """
+    processed = failed = 0
+    for message, client_id, client_config in items:
+        try:
+            process_message(message, client_id, client_config)
+            processed += 1
+        except Exception as e:
+            failed += 1
+            logger.error(f"Error processing message {message.get('id')} from {message.get('from')}: {e}", exc_info=True)
+            _release_claims(message)
+    return processed, failed
+
+
 @webhook_bp.route("/webhook", methods=["POST"])
 def handle_webhook():
     """
     Handles incoming WhatsApp messages from the Meta Webhooks.
     All references use client/client_id/client_config/clients_crud only.
+    Each message is routed to the client owning the business number it was sent to
+    (value.metadata.phone_number_id), so one deployment serves many numbers.
+    Every message of every change in the POST is handled: different senders run
+    concurrently while each sender's messages keep their order.
+    With WEBHOOK_ASYNC_ENABLED, messages are only checked and enqueued here and
+    the reply pipeline runs on the worker pool, so Meta gets its 200 immediately.
+    Redelivered messages (same message id) are acknowledged without being processed again.
+    A message that fails or can't be queued has its claim released and the POST gets a 500, so
+    Meta redelivers it; the messages that did succeed are then skipped as duplicates.
+    With a coalescing window, text messages are held briefly so a burst from one sender is
+    answered once; those batches, and the sender's other messages with them, run on the worker
+    pool so the sender's order is kept.
     """
+    summary = {"received": 0, "processed": 0, "queued": 0, "coalesced": 0, "skipped": 0, "duplicates": 0, "failed": 0}
     if request.method == 'POST':
+        unsettled = {}  # message id -> message, claimed in this request but not yet processed or handed off
         try:
             data = request.get_json()
             logger.debug(f"Received webhook event: {json.dumps(data, indent=2)}")
 
             # Check if the webhook event is a message from a WhatsApp Business Account
             if "object" in data and "entry" in data:
-                for entry in data["entry"]:
-                    for change in entry["changes"]:
-                        if "value" in change and "messages" in change["value"]:
-                            message = change["value"]["messages"][0]
-                            from_number = message["from"]
-                            message_type = message["type"]
-                            wa_id = from_number
-
-                            # Get client_id from client_config based on WHATSAPP_PHONE_NUMBER_ID
-                            client_config = get_client_config_by_whatsapp_id(WHATSAPP_PHONE_NUMBER_ID)
-                            current_client_id = client_config['client_id'] if client_config else 'default_client'
-                            logger.info(f"Processing message for client: `{current_client_id}` (WA ID: {wa_id})")
-
-                            # Implement basic rate limiting
-                            now = time.time()
-                            if wa_id in last_message_time and (now - last_message_time[wa_id] < RATE_LIMIT_SECONDS):
-                                logger.warning(f"Rate limit exceeded for client {wa_id}. Ignoring message.")
-                                return jsonify({"status": "ignored", "message": "Rate limit exceeded"}), 200
-                            last_message_time[wa_id] = now
-
-                            user_message_to_save = ""
-                            response_message = ""
-
-                            if message_type == "text":
-                                user_message_content = message["text"]["body"]
-                                user_message_to_save = user_message_content
-                                logger.info(
-                                    f"Received text message from {from_number} (Client: `{current_client_id}`): '{user_message_content}'"
-                                )
-
-                                # Generate AI reply
-                                ai_response_data = generate_ai_reply(user_message_content, wa_id, current_client_id)
-                                response_message = ai_response_data.get("response", "I'm sorry, I couldn't generate a response.")
-
-                                send_whatsapp_message(from_number, response_message)
-
-                                # Store both user message and AI response
-                                add_message(wa_id, user_message_to_save, 'user', current_client_id, response_message)
-
-                            elif message_type == "button":
-                                button_payload = message["button"]["payload"]
-                                user_message_to_save = f"Button click: {button_payload}"
-
-                                if button_payload:
-                                    logger.info(
-                                        f"Received button message from {from_number} with payload '{button_payload}' (Client: `{current_client_id}`).")
-
-                                    response_message = f"You clicked: {button_payload}"
-                                    send_whatsapp_message(from_number, response_message)
-                                    add_message(wa_id, user_message_to_save, 'user', current_client_id, response_message)
-                                else:
-                                    logger.warning(
-                                        f"Received button message from {from_number} but no payload found (Client: `{current_client_id}`).")
-                                    add_message(wa_id, user_message_to_save, 'user', current_client_id, 'No action for button')
-
-                            else:  # Handle other message types that are not text or button
-                                user_message_to_save = f"Unhandled type: {message_type}"
-                                logger.info(
-                                    f"Received unhandled message type '{message_type}' from {from_number} (Client: `{current_client_id}`).")
-                                add_message(wa_id, user_message_to_save, 'user', current_client_id, 'Unsupported message type')
-
-                            logger.info(f"Processed and responded to {from_number} (Client: `{current_client_id}`).")
+                # Messages grouped per (business number, sender), in payload order
+                by_sender = OrderedDict()
+                client_configs = {}  # phone_number_id -> client_config, resolved once per request
+
+                for message, phone_number_id in _iter_messages(data):
+                    summary["received"] += 1
+                    wa_id = message.get("from")
+                    if not wa_id or "type" not in message:
+                        logger.warning(f"Skipping malformed message in webhook payload: {message}")
+                        summary["skipped"] += 1
+                        continue
+
+                    # Get client_config for the receiving business number (cached, no DB hit)
+                    if phone_number_id not in client_configs:
+                        client_configs[phone_number_id] = client_config_cache.get(phone_number_id) or {}
+                        if not client_configs[phone_number_id]:
+                            logger.warning(f"No active client for phone_number_id {phone_number_id}. Using defaults.")
+                    client_config = client_configs[phone_number_id]
+                    current_client_id = client_config.get('client_id') or 'default_client'
+
+                    # Meta redelivers webhooks it thinks we missed; only the first delivery is processed
+                    if not message_deduplicator.claim(message.get("id"), current_client_id):
+                        logger.info(f"Ignoring duplicate delivery of message {message.get('id')} from {wa_id}.")
+                        summary["duplicates"] += 1
+                        continue
+                    unsettled[message.get("id")] = message
+                    logger.info(f"Processing message for client: `{current_client_id}` (WA ID: {wa_id})")
+
+                    sender_key = (phone_number_id, wa_id)
+                    client_window = _coalesce_window_seconds(client_config)
+                    coalesce_window = client_window if message["type"] == "text" else 0
+                    ends_batch = False
+                    if coalesce_window > 0:
+                        # Follow-ups in an open window join it; they cost no AI call and no rate limit token
+                        if message_coalescer.join(sender_key, message):
+                            summary["coalesced"] += 1
+                            unsettled.pop(message.get("id"), None)
+                            continue
+                    elif client_window > 0 or message_coalescer.has_pending(sender_key):
+                        # Keep the sender's order: their held text goes to the workers before this
+                        # message, which follows it through the same worker. It ends the burst the
+                        # batch already paid a rate limit token for.
+                        ends_batch = message_coalescer.flush(sender_key) > 0
+
+                    # Rate limiting per sender and business number, with the client's own limit if it has one
+                    interval = client_config.get('rate_limit_seconds')
+                    if interval is None:
+                        interval = RATE_LIMIT_SECONDS
+                    burst = client_config.get('rate_limit_burst') or RATE_LIMIT_BURST
+                    if not ends_batch and not rate_limiter.allow(f"{phone_number_id}:{wa_id}", interval, burst):
+                        logger.warning(f"Rate limit exceeded for client {wa_id}. Ignoring message.")
+                        summary["skipped"] += 1
+                        unsettled.pop(message.get("id"), None)
+                        continue
+
+                    if coalesce_window > 0:
+                        message_coalescer.add(sender_key, message, current_client_id, client_config, coalesce_window)
+                        summary["queued"] += 1
+                        unsettled.pop(message.get("id"), None)
+                    elif WEBHOOK_ASYNC_ENABLED or client_window > 0 or ends_batch:
+                        queued = get_message_pool().submit(
+                            sender_key,
+                            {"message": message, "client_id": current_client_id, "client_config": client_config},
+                            timeout=WEBHOOK_ENQUEUE_TIMEOUT_SECONDS
+                        )
+                        if queued:
+                            summary["queued"] += 1
+                            logger.info(f"Queued message from {wa_id} (Client: `{current_client_id}`).")
+                        else:
+                            summary["failed"] += 1
+                            _release_claims(message)
+                        unsettled.pop(message.get("id"), None)
+                    else:
+                        by_sender.setdefault(sender_key, []).append((message, current_client_id, client_config))
+
+                # Inline mode: one task per sender, all senders in parallel
+                futures = [_batch_executor.submit(_process_sender_messages, items) for items in by_sender.values()]
+                for future in futures:
+                    processed, failed = future.result()
+                    summary["processed"] += processed
+                    summary["failed"] += failed
+                # Inline failures released their own claims
+                unsettled.clear()
+
+            logger.info(f"Webhook batch summary: {summary}")
+            if summary["failed"] and MESSAGE_DEDUP_ENABLED:
+                # Have Meta redeliver: failed messages were released, the rest are now duplicates.
+                return jsonify({"status": "error", "message": "Some messages failed", "summary": summary}), 500
 
         except Exception as e:
             logger.error(f"Error processing webhook event: {e}", exc_info=True)
-            return jsonify({"status": "error", "message": "Internal server error"}), 500
+            for message in unsettled.values():
+                _release_claims(message)
+            return jsonify({"status": "error", "message": "Internal server error", "summary": summary}), 500
 
-    return jsonify({"status": "success"}), 200
+    return jsonify({"status": "success", "summary": summary}), 200
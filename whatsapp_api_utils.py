@@ -1,6 +1,21 @@
 import requests
 import os
 import logging
+import random
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import Future
+from email.utils import parsedate_to_datetime
+from requests.adapters import HTTPAdapter
+from config import (
+    WHATSAPP_API_BASE_URL, WHATSAPP_HTTP_POOL_SIZE, WHATSAPP_CONNECT_TIMEOUT_SECONDS, WHATSAPP_READ_TIMEOUT_SECONDS,
+    WHATSAPP_SEND_MAX_RETRIES, WHATSAPP_SEND_BACKOFF_SECONDS, WHATSAPP_SEND_MAX_BACKOFF_SECONDS,
+    WHATSAPP_NUMBER_RATE_PER_SECOND, WHATSAPP_NUMBER_BURST, WHATSAPP_PAIR_RATE_PER_SECOND, WHATSAPP_PAIR_BURST,
+    WHATSAPP_OUTBOUND_MAX_WAIT_SECONDS, WHATSAPP_OUTBOUND_QUEUE_MAXSIZE, WHATSAPP_OUTBOUND_WORKERS,
+    WHATSAPP_OUTBOUND_SCHEDULER_ENABLED
+)
+from outbound_scheduler import create_scheduler
 # from dotenv import load_dotenv # REMOVED: Loaded globally in config.py
 
 # Configure logging for this module
@@ -13,34 +28,254 @@ logger = logging.getLogger(__name__) # Use specific logger for this module
 WHATSAPP_ACCESS_TOKEN = os.getenv("WHATSAPP_ACCESS_TOKEN")
 WHATSAPP_PHONE_NUMBER_ID = os.getenv("WHATSAPP_PHONE_NUMBER_ID")
 
-def send_whatsapp_message(to_number, message_body):
+# Status codes worth retrying: rate limited, or a transient Graph API/proxy failure.
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Outcome of one logical send (including retries). message_id is the Graph API "wamid" on success.
+SendResult = namedtuple("SendResult", ["ok", "status_code", "message_id", "error", "attempts", "retryable"])
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Returns the process-wide keep-alive session; connections to graph.facebook.com are reused."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                # Retries are done by post_message so Retry-After and metrics are handled in one place.
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=WHATSAPP_HTTP_POOL_SIZE, max_retries=0)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+class SendMetrics:
+    """Per-call latency and outcome counters for Graph API sends, reported by /api/status."""
+
+    def __init__(self, window=1000):
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.status_counts = {}
+
+    def record_call(self, latency, status_code):
+        with self._lock:
+            self.calls += 1
+            self._latencies.append(latency)
+            key = str(status_code) if status_code else "error"
+            self.status_counts[key] = self.status_counts.get(key, 0) + 1
+
+    def record_result(self, result):
+        with self._lock:
+            if result.ok:
+                self.sent += 1
+            else:
+                self.failed += 1
+            self.retries += result.attempts - 1
+
+    def stats(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            calls, sent, failed, retries = self.calls, self.sent, self.failed, self.retries
+            status_counts = dict(self.status_counts)
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else None
+
+        return {
+            "calls": calls,
+            "sent": sent,
+            "failed": failed,
+            "retries": retries,
+            "status_counts": status_counts,
+            "latency_ms": {
+                "mean": sum(latencies) / len(latencies) * 1000 if latencies else None,
+                "p50": percentile(0.5),
+                "p95": percentile(0.95),
+                "p99": percentile(0.99),
+            },
+        }
+
+
+send_metrics = SendMetrics()
+
+
+def _retry_after_seconds(response):
+    """Parses a Retry-After header (seconds or HTTP date); None if absent or invalid."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _backoff_seconds(attempt, response=None):
+    retry_after = _retry_after_seconds(response) if response is not None else None
+    if retry_after is not None:
+        delay = retry_after
+    else:
+        delay = WHATSAPP_SEND_BACKOFF_SECONDS * (2 ** attempt) * (1 + random.random())
+    return min(delay, WHATSAPP_SEND_MAX_BACKOFF_SECONDS)
+
+
+def post_message(phone_number_id, access_token, payload, max_retries=WHATSAPP_SEND_MAX_RETRIES,
+                 retry_throttled=True):
     """
-    Sends a WhatsApp message using the WhatsApp Cloud API.
+    POSTs a message payload to the Graph API over the pooled session.
+    429/5xx responses and connection errors/timeouts are retried with jittered exponential
+    backoff (or the server's Retry-After). Returns a SendResult; never raises.
+    With retry_throttled=False a 429 is returned at once for the caller to reschedule.
     """
-    if not WHATSAPP_ACCESS_TOKEN or not WHATSAPP_PHONE_NUMBER_ID:
-        logger.error("WhatsApp API access token or phone number ID not set in environment variables.") # Changed to logger.error
-        return False
-
-    url = f"https://graph.facebook.com/v19.0/{WHATSAPP_PHONE_NUMBER_ID}/messages"
+    url = f"{WHATSAPP_API_BASE_URL}/{phone_number_id}/messages"
     headers = {
-        "Authorization": f"Bearer {WHATSAPP_ACCESS_TOKEN}",
+        "Authorization": f"Bearer {access_token}",
         "Content-Type": "application/json"
     }
-    data = {
+    timeout = (WHATSAPP_CONNECT_TIMEOUT_SECONDS, WHATSAPP_READ_TIMEOUT_SECONDS)
+    session = get_session()
+    result = None
+    for attempt in range(max_retries + 1):
+        response = None
+        start = time.perf_counter()
+        try:
+            response = session.post(url, headers=headers, json=payload, timeout=timeout)
+            send_metrics.record_call(time.perf_counter() - start, response.status_code)
+            if response.ok:
+                try:
+                    message_id = (response.json().get("messages") or [{}])[0].get("id")
+                except ValueError:
+                    message_id = None
+                result = SendResult(True, response.status_code, message_id, None, attempt + 1, False)
+                break
+            retryable = response.status_code in RETRYABLE_STATUS_CODES
+            result = SendResult(False, response.status_code, None, response.text[:500], attempt + 1, retryable)
+            if response.status_code == 429 and not retry_throttled:
+                break
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            send_metrics.record_call(time.perf_counter() - start, None)
+            result = SendResult(False, None, None, str(e), attempt + 1, True)
+        except Exception as e:
+            send_metrics.record_call(time.perf_counter() - start, None)
+            result = SendResult(False, None, None, str(e), attempt + 1, False)
+
+        if not result.retryable or attempt == max_retries:
+            break
+        delay = _backoff_seconds(attempt, response)
+        logger.warning(f"Graph API send to {phone_number_id} failed ({result.status_code or result.error}); "
+                       f"retrying in {delay:.2f}s (attempt {attempt + 1}/{max_retries}).")
+        time.sleep(delay)
+
+    send_metrics.record_result(result)
+    return result
+
+
+def _text_payload(to_number, message_body):
+    return {
         "messaging_product": "whatsapp",
         "to": to_number,
         "type": "text",
         "text": {"body": message_body}
     }
 
-    try:
-        response = requests.post(url, headers=headers, json=data)
-        response.raise_for_status()  # Raise HTTPError for bad responses (4xx or 5xx)
+
+def _log_send_result(result, to_number, message_body):
+    if result.ok:
         logger.info(f"Message sent to {to_number}: {message_body[:50]}...") # Changed to logger.info
         return True
-    except requests.exceptions.HTTPError as http_err:
-        logger.error(f"HTTP error sending message to {to_number}: {http_err} - {response.text}", exc_info=True)
+    if result.status_code:
+        logger.error(f"HTTP error sending message to {to_number}: {result.status_code} - {result.error} (after {result.attempts} attempts)")
+    else:
+        logger.error(f"Other error sending message to {to_number}: {result.error} (after {result.attempts} attempts)")
+    return False
+
+
+def send_whatsapp_message(to_number, message_body, phone_number_id=None, access_token=None):
+    """
+    Sends a WhatsApp message using the WhatsApp Cloud API.
+    phone_number_id/access_token are the sending client's credentials; the environment
+    defaults are used when they are not given.
+    """
+    phone_number_id = phone_number_id or WHATSAPP_PHONE_NUMBER_ID
+    access_token = access_token or WHATSAPP_ACCESS_TOKEN
+    if not access_token or not phone_number_id:
+        logger.error("WhatsApp API access token or phone number ID not set for client or in environment variables.") # Changed to logger.error
         return False
-    except Exception as e:
-        logger.error(f"Other error sending message to {to_number}: {e}", exc_info=True)
-        return False
\ No newline at end of file
+
+    result = post_message(phone_number_id, access_token, _text_payload(to_number, message_body))
+    return _log_send_result(result, to_number, message_body)
+
+
+_outbound_scheduler = None
+_outbound_scheduler_lock = threading.Lock()
+
+
+def get_outbound_scheduler():
+    """Returns the per-number outbound throughput governor, starting it on first use."""
+    global _outbound_scheduler
+    if _outbound_scheduler is None:
+        with _outbound_scheduler_lock:
+            if _outbound_scheduler is None:
+                _outbound_scheduler = create_scheduler(
+                    rate=WHATSAPP_NUMBER_RATE_PER_SECOND,
+                    burst=WHATSAPP_NUMBER_BURST,
+                    pair_rate=WHATSAPP_PAIR_RATE_PER_SECOND,
+                    pair_burst=WHATSAPP_PAIR_BURST,
+                    max_wait=WHATSAPP_OUTBOUND_MAX_WAIT_SECONDS,
+                    max_queue=WHATSAPP_OUTBOUND_QUEUE_MAXSIZE,
+                    workers=WHATSAPP_OUTBOUND_WORKERS,
+                    is_throttled=lambda result: result.status_code == 429,
+                    failed_result=lambda reason: SendResult(False, None, None, reason, 0, False),
+                    name="whatsapp-outbound"
+                )
+                _outbound_scheduler.start()
+    return _outbound_scheduler
+
+
+def get_outbound_stats():
+    """Per-number outbound queue stats, or just the flag if nothing has been queued yet."""
+    if _outbound_scheduler is None:
+        return {"running": False}
+    return _outbound_scheduler.stats()
+
+
+def queue_whatsapp_message(to_number, message_body, phone_number_id=None, access_token=None, client_id=None):
+    """
+    Like send_whatsapp_message, but goes through the outbound scheduler: over-budget sends
+    wait for their number's and recipient's rate budget instead of failing. Returns a Future
+    resolving to a SendResult. With the scheduler disabled the message is sent immediately
+    and the returned Future is already resolved.
+    """
+    phone_number_id = phone_number_id or WHATSAPP_PHONE_NUMBER_ID
+    access_token = access_token or WHATSAPP_ACCESS_TOKEN
+    if not access_token or not phone_number_id:
+        logger.error("WhatsApp API access token or phone number ID not set for client or in environment variables.")
+        future = Future()
+        future.set_result(SendResult(False, None, None, "missing credentials", 0, False))
+        return future
+
+    payload = _text_payload(to_number, message_body)
+    if not WHATSAPP_OUTBOUND_SCHEDULER_ENABLED:
+        future = Future()
+        future.set_result(post_message(phone_number_id, access_token, payload))
+    else:
+        # 429s are re-queued by the scheduler (after draining the number's budget) rather than retried here.
+        future = get_outbound_scheduler().submit(
+            phone_number_id, to_number,
+            lambda: post_message(phone_number_id, access_token, payload, retry_throttled=False),
+            client_id=client_id
+        )
+    future.add_done_callback(lambda f: _log_send_result(f.result(), to_number, message_body))
+    return future